@@ -0,0 +1,159 @@
+# Asyncio Interface
+# Slither
+
+# Runs FAT12 calls on a bounded pool of threads so they don't block the event loop.
+# Reads of a disk run at the same time behind its reader-writer lock, while writes
+# to it are queued on the event loop so only one at a time is handed to a thread.
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from slither_fat12 import *
+
+# Most threads working for every AsyncFAT12 that isn't given its own executor.
+ASYNC_WORKERS = 16
+
+# Bytes read at a time when a stream is iterated.
+STREAM_CHUNK = 64 * 1024
+
+# The shared executor, made on first use.
+executor = None
+executor_lock = threading.Lock()
+
+# Returns the executor shared by every AsyncFAT12.
+def getExecutor():
+    global executor
+
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(ASYNC_WORKERS, "slither")
+
+        return executor
+
+# Reads a file on the disk as an async stream. Every read runs on the executor.
+class AsyncFileReader:
+
+    def __init__(self, disk, f):
+        self.disk = disk
+        self.f = f
+        self.name = f.name
+
+    async def read(self, size=-1):
+        return await self.disk.run(self.f.read, size)
+
+    async def seek(self, offset, whence=0):
+        return await self.disk.run(self.f.seek, offset, whence)
+
+    def tell(self):
+        return self.f.tell()
+
+    async def close(self):
+        self.f.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        chunk = await self.read(STREAM_CHUNK)
+
+        if not chunk:
+            raise StopAsyncIteration
+
+        return chunk
+
+# An asyncio front end for a FAT12 disk.
+# Paths are taken from the root of the disk.
+class AsyncFAT12:
+
+    def __init__(self, disk=None, executor=None):
+        self.disk = FAT12() if disk is None else disk
+        self.executor = executor
+
+        # Paths go through a handle of their own, so they never
+        # depend on the current directory of the disk.
+        self.handle = self.disk.handle()
+
+        # Writes wait here instead of each holding a thread.
+        self.write_lock = asyncio.Lock()
+
+    # Runs a blocking call on the executor.
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor or getExecutor(),
+                                          functools.partial(func, *args, **kwargs))
+
+    # Runs a blocking call that changes the disk, one at a time.
+    async def write(self, func, *args, **kwargs):
+        async with self.write_lock:
+            future = asyncio.ensure_future(self.run(func, *args, **kwargs))
+
+            try:
+                return await asyncio.shield(future)
+
+            except asyncio.CancelledError:
+                # The thread can't be stopped, so the next write still waits for it.
+                await asyncio.wait([future])
+                raise
+
+    def isMounted(self):
+        return self.disk.isMounted()
+
+    async def mount(self, file="", mode="file", readonly=False, locking="whole", timeout=LOCK_TIMEOUT):
+        return await self.write(self.disk.mount, file, mode, readonly, locking, timeout)
+
+    async def unmount(self):
+        return await self.write(self.disk.unmount)
+
+    async def flush(self):
+        return await self.write(self.disk.flush)
+
+    async def commit(self, inplace=False):
+        return await self.write(self.disk.commit, inplace)
+
+    # Lists a directory of the disk.
+    async def getDir(self, path="/", vFAT=True):
+        return await self.run(self.listDir, path, vFAT)
+
+    def listDir(self, path, vFAT):
+
+        # The directory can't be removed between finding and reading it.
+        with self.disk.lock.read():
+            found = self.disk.findDir(path, self.handle.path)
+
+            if not found:
+                raise SlitherIOError("DirDoesNotExist", "The directory doesn't exist!")
+
+            return self.disk.getDir(vFAT, found[0])
+
+    async def exists(self, path):
+        return await self.run(self.handle.doesExist, path)
+
+    # Opens a file on the disk as an async stream.
+    async def open(self, file):
+        return AsyncFileReader(self, await self.run(self.handle.open, file))
+
+    async def readFile(self, file):
+        return await self.run(self.handle.readFile, file)
+
+    # Takes the same contents as FAT12.writeFile().
+    # A stream is read on the executor, not the event loop.
+    async def writeFile(self, file, contents, size=None):
+        return await self.write(self.handle.writeFile, file, contents, size)
+
+    async def deleteFile(self, file):
+        return await self.write(self.handle.deleteFile, file)
+
+    async def makeDir(self, directory):
+        return await self.write(self.handle.makeDir, directory)
+
+    # Copies a directory of the disk and everything under it to a host directory.
+    async def extract(self, dest, path="/", workers=4):
+        return await self.run(self.handle.extract_all, dest, path, workers)
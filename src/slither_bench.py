@@ -0,0 +1,405 @@
+# Benchmarks for the Slither FAT12 library.
+# Run it from the src directory: py -3 slither_bench.py
+
+import os
+import sys
+import time
+import shutil
+import asyncio
+import tempfile
+import threading
+from array import array
+
+from slither_fat12 import *
+from slither_async import AsyncFAT12
+from slither_pool import ImagePool
+
+# Builds the raw data of a directory with n files, each with a LFN.
+def make_dir_data(disk, n):
+    contents = bytearray()
+
+    for i in range(n):
+        name = "benchmark file {:0>5}.txt".format(i)
+        sfn = "BENCH{:0>3}".format(i % 1000).ljust(8) + "TXT"
+        cs = disk.gensumLFN(sfn)
+        parts = disk.splitLFN(name)
+
+        # Write each LFN entry.
+        for x in range(len(parts)):
+            if not x:
+                seq = len(parts) + 0x40
+            else:
+                seq = len(parts) - x
+
+            contents += LFN_ENTRY.pack(seq,
+                                       bytes(parts[x][:5], "utf-16-le"),
+                                       disk.attr_flags["LFN"],
+                                       0,
+                                       cs,
+                                       bytes(parts[x][5:11], "utf-16-le"),
+                                       0,
+                                       bytes(parts[x][11:13], "utf-16-le"))
+
+        # Write the SFN entry.
+        contents += SFN_ENTRY.pack(bytes(sfn[:8], "ascii"),
+                                   bytes(sfn[8:], "ascii"),
+                                   0, 0, 0, 0, 0, 0, 0, 0, 0, 0, i)
+
+    # Round the directory up to a whole number of clusters.
+    if len(contents) % 512:
+        contents += bytes(512 - len(contents) % 512)
+
+    return bytes(contents)
+
+# Times parseDir on directories of growing size.
+def bench_parse_dir(sizes=(1000, 2000, 4000, 8000, 16000), repeat=3):
+    disk = FAT12()
+    disk.attr["Bytes_Per_Sector"] = 512
+    disk.attr["Sectors_Per_Cluster"] = 1
+
+    print("Parsing directories with a LFN for every file.")
+    print("{:>8} {:>8} {:>12} {:>14}".format("files", "entries", "best (ms)", "per entry (us)"))
+
+    for n in sizes:
+        dir_data = make_dir_data(disk, n)
+
+        # One region per 512 byte cluster.
+        region_offsets = [i * 512 for i in range(len(dir_data) // 512)]
+
+        best = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            entries = disk.parseDir(dir_data, region_offsets, 512)
+            t = time.perf_counter() - start
+
+            if best is None or t < best:
+                best = t
+
+        if len(entries) != n:
+            print("Parsed {} entries instead of {}!".format(len(entries), n))
+            exit(-1)
+
+        print("{:>8} {:>8} {:>12.2f} {:>14.2f}".format(n,
+                                                       len(dir_data) // 32,
+                                                       best * 1000,
+                                                       best * 1000000 / (len(dir_data) // 32)))
+
+# Times import_tree on host trees of growing size, all in one directory.
+def bench_import_tree(sizes=(75, 150, 300), file_size=1000):
+    work = tempfile.mkdtemp(prefix="slither-bench-")
+
+    print("Importing host trees into a subdirectory of a memory mounted disk.")
+    print("{:>8} {:>12} {:>14}".format("files", "time (ms)", "per file (us)"))
+
+    try:
+        for n in sizes:
+            tree = os.path.join(work, "tree{}".format(n))
+            os.makedirs(tree)
+
+            for i in range(n):
+                with open(os.path.join(tree, "benchmark file {:0>5}.txt".format(i)), "wb") as f:
+                    f.write(bytes(file_size))
+
+            image = os.path.join(work, "bench{}.flp".format(n))
+            open(image, "wb").close()
+
+            disk = FAT12()
+            disk.mount(image, "memory")
+            disk.formatDisk("IBM PC 3.5IN 1.44MB")
+            disk.makeDir("BENCH")
+
+            start = time.perf_counter()
+            disk.import_tree(tree, "BENCH")
+            t = time.perf_counter() - start
+
+            disk.unmount()
+
+            print("{:>8} {:>12.2f} {:>14.2f}".format(n, t * 1000, t * 1000000 / n))
+
+    finally:
+        shutil.rmtree(work)
+
+# Times the whole-table FAT jobs on a packed 1.44MB FAT.
+def bench_fat_codec(repeat=100):
+    import slither_fatcodec
+
+    fat = slither_fatcodec.unpack(bytearray(4608))
+
+    # Lay out a chain of 3 clusters after every free cluster.
+    for i in range(2, 2849, 4):
+        fat[i + 1:i + 4] = array("H", [i + 2, i + 3, 0xFFF])
+
+    raw = slither_fatcodec.pack(fat)
+
+    jobs = (("unpack", lambda: slither_fatcodec.unpack(raw)),
+            ("pack", lambda: slither_fatcodec.pack(fat)),
+            ("chain starts", lambda: slither_fatcodec.chainStarts(fat, 2, 2849)),
+            ("cross-links", lambda: slither_fatcodec.crossLinks(fat, 2, 2849)),
+            ("compare", lambda: slither_fatcodec.compare(raw, raw)))
+
+    print("FAT12 table jobs on a 1.44MB FAT, NumPy {}.".format("on" if slither_fatcodec.hasNumpy() else "off"))
+    print("{:>14} {:>12}".format("job", "best (us)"))
+
+    for name, job in jobs:
+        best = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            job()
+            t = time.perf_counter() - start
+
+            if best is None or t < best:
+                best = t
+
+        print("{:>14} {:>12.1f}".format(name, best * 1000000))
+
+# Reads from one shared disk in many threads while one thread keeps writing.
+# Every read is checked, so a torn read or a broken directory stops the run.
+def bench_concurrent_readers(threads=(1, 2, 4, 8), seconds=1.0, files=16, file_size=5000):
+    work = tempfile.mkdtemp(prefix="slither-bench-")
+
+    print("Reading files from a shared disk while one thread writes.")
+    print("{:>8} {:>12} {:>12}".format("readers", "reads/s", "writes/s"))
+
+    try:
+        image = os.path.join(work, "shared.flp")
+        open(image, "wb").close()
+
+        disk = FAT12()
+        disk.mount(image)
+        disk.formatDisk("IBM PC 3.5IN 1.44MB")
+        disk.makeDir("DATA")
+
+        contents = {}
+        for i in range(files):
+            name = "shared file {:0>2}.bin".format(i)
+            contents[name] = os.urandom(file_size)
+            disk.writeFile("DATA/" + name, contents[name])
+
+        names = sorted(contents)
+
+        for n in threads:
+            stop = threading.Event()
+            errors = []
+            counts = [0] * (n + 1)
+
+            def read(index):
+                try:
+                    readFiles(index)
+                except SlitherIOError as e:
+                    errors.append(e.msg)
+
+            def write():
+                try:
+                    writeFiles()
+                except SlitherIOError as e:
+                    errors.append(e.msg)
+
+            def readFiles(index):
+                handle = disk.handle()
+                handle.goDir("DATA")
+
+                i = index
+                while not stop.is_set():
+                    name = names[i % len(names)]
+                    i += 1
+
+                    if handle.readFile(name) != contents[name]:
+                        errors.append("{} changed".format(name))
+
+                    if not set(names) <= set(handle.getDir()):
+                        errors.append("A shared file is missing from the directory")
+
+                    # The file being rewritten is always one whole version, never a mix.
+                    with disk.lock.read():
+                        if handle.fileExists("churn.bin") and len(set(handle.readFile("churn.bin"))) > 1:
+                            errors.append("churn.bin was read half written")
+
+                    counts[index] += 1
+
+            def writeFiles():
+                handle = disk.handle()
+                handle.goDir("DATA")
+
+                version = 0
+                while not stop.is_set():
+                    version += 1
+
+                    handle.writeFile("churn.bin", bytes([version % 256]) * (1000 + version % 7 * 700))
+                    handle.writeFile("temp file {}.tmp".format(version % 4), bytes(version % 1000))
+
+                    if not version % 4:
+                        for i in range(4):
+                            handle.deleteFile("temp file {}.tmp".format(i))
+
+                    counts[n] += 1
+
+            workers = [threading.Thread(target=read, args=(i,)) for i in range(n)]
+            workers.append(threading.Thread(target=write))
+
+            for i in workers:
+                i.start()
+
+            time.sleep(seconds)
+            stop.set()
+
+            for i in workers:
+                i.join()
+
+            if errors:
+                print("{} errors with {} readers, the first was: {}".format(len(errors), n, errors[0]))
+                exit(-1)
+
+            print("{:>8} {:>12.0f} {:>12.0f}".format(n, sum(counts[:n]) / seconds, counts[n] / seconds))
+
+        disk.unmount()
+
+    finally:
+        shutil.rmtree(work)
+
+# Reads every file of many images from inside an event loop, calling FAT12 straight
+# from the loop and then through AsyncFAT12, and times the longest the loop stalled.
+def bench_async_images(images=(8, 32, 128), files=8, file_size=20000):
+    work = tempfile.mkdtemp(prefix="slither-bench-")
+
+    print("Reading every file of many images from an event loop.")
+    print("{:>8} {:>12} {:>14} {:>12} {:>14}".format("images", "FAT12 (ms)", "stall (ms)", "async (ms)", "stall (ms)"))
+
+    try:
+        paths = []
+        for i in range(max(images)):
+            image = os.path.join(work, "image{}.flp".format(i))
+            open(image, "wb").close()
+
+            disk = FAT12()
+            disk.mount(image, "memory")
+            disk.formatDisk("IBM PC 3.5IN 1.44MB")
+
+            for x in range(files):
+                disk.writeFile("FILE{}.BIN".format(x), os.urandom(file_size))
+
+            disk.unmount()
+            paths.append(image)
+
+        async def blocking(image):
+            disk = FAT12()
+            disk.mount(image, readonly=True)
+
+            for name in disk.getDir():
+                disk.readFile(name)
+
+            disk.unmount()
+
+        async def concurrent(image):
+            disk = AsyncFAT12()
+            await disk.mount(image, readonly=True)
+
+            for name in await disk.getDir():
+                async with await disk.open(name) as f:
+                    async for chunk in f:
+                        pass
+
+            await disk.unmount()
+
+        # Runs the reads while a ticker measures the longest gap between its ticks.
+        async def measure(read, paths):
+            stall = 0
+            done = asyncio.Event()
+
+            async def tick():
+                nonlocal stall
+
+                last = time.perf_counter()
+                while not done.is_set():
+                    await asyncio.sleep(0.001)
+
+                    now = time.perf_counter()
+                    stall = max(stall, now - last)
+                    last = now
+
+            ticker = asyncio.ensure_future(tick())
+            await asyncio.sleep(0)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(read(image) for image in paths))
+            t = time.perf_counter() - start
+
+            done.set()
+            await ticker
+
+            return t, stall
+
+        for n in images:
+            blocking_time, blocking_stall = asyncio.run(measure(blocking, paths[:n]))
+            async_time, async_stall = asyncio.run(measure(concurrent, paths[:n]))
+
+            print("{:>8} {:>12.2f} {:>14.2f} {:>12.2f} {:>14.2f}".format(n,
+                                                                     blocking_time * 1000,
+                                                                     blocking_stall * 1000,
+                                                                     async_time * 1000,
+                                                                     async_stall * 1000))
+
+    finally:
+        shutil.rmtree(work)
+
+# Reads a file from a few popular images over and over, mounting for every
+# request and then through an ImagePool that keeps them mounted.
+def bench_image_pool(requests=2000, images=4, files=64):
+    work = tempfile.mkdtemp(prefix="slither-bench-")
+
+    print("Reading a file from one of {} images, {} times.".format(images, requests))
+    print("{:>10} {:>12} {:>16} {:>8} {:>8}".format("mounts", "time (ms)", "per request (us)", "hits", "misses"))
+
+    try:
+        paths = []
+        for i in range(images):
+            image = os.path.join(work, "image{}.flp".format(i))
+            open(image, "wb").close()
+
+            disk = FAT12()
+            disk.mount(image, "memory")
+            disk.formatDisk("IBM PC 3.5IN 1.44MB")
+            disk.makeDir("DATA")
+
+            for x in range(files):
+                disk.writeFile("DATA/pooled file {:0>3}.txt".format(x), bytes(1000))
+
+            disk.unmount()
+            paths.append(image)
+
+        start = time.perf_counter()
+        for i in range(requests):
+            disk = FAT12()
+            disk.mount(paths[i % images], readonly=True)
+            disk.readFile("DATA/pooled file {:0>3}.txt".format(i % files))
+            disk.unmount()
+        t = time.perf_counter() - start
+
+        print("{:>10} {:>12.2f} {:>16.2f} {:>8} {:>8}".format("each", t * 1000, t * 1000000 / requests, 0, requests))
+
+        with ImagePool(images, readonly=True) as pool:
+            start = time.perf_counter()
+            for i in range(requests):
+                with pool.open(paths[i % images]) as disk:
+                    disk.readFile("DATA/pooled file {:0>3}.txt".format(i % files))
+            t = time.perf_counter() - start
+
+            stats = pool.stats()
+
+        print("{:>10} {:>12.2f} {:>16.2f} {:>8} {:>8}".format("pooled", t * 1000, t * 1000000 / requests,
+                                                               stats["HITS"], stats["MISSES"]))
+
+    finally:
+        shutil.rmtree(work)
+
+if __name__ == "__main__":
+    bench_parse_dir()
+    print()
+    bench_import_tree()
+    print()
+    bench_fat_codec()
+    print()
+    bench_concurrent_readers()
+    print()
+    bench_async_images()
+    print()
+    bench_image_pool()
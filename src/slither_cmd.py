@@ -1,7 +1,10 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
+import os
 import sys
+import glob
+import shutil
 from cmd import Cmd
 from slither_fat12 import *
 
@@ -48,20 +51,33 @@ class Slither_CMD(Cmd):
 
     # ----- Slither Commands -----
     def do_mount(self, arg):
-        "mount <path>"
+        "mount <path> optional --readonly, --range to lock only what each command uses or --nolock"
 
-        if len(arg) != 1:
+        options = ("--readonly", "--range", "--nolock")
+        paths = [i for i in arg if i not in options]
+
+        if len(paths) != 1 or ("--range" in arg and "--nolock" in arg):
             self.arg_count()
             return False
 
+        locking = "whole"
+        if "--range" in arg:
+            locking = "range"
+        elif "--nolock" in arg:
+            locking = "none"
+
         if self.disk.isMounted():
             print("Already mounted!")
         else:
-            if self.disk.mount(arg[0]):
-                print("Sucessfully mounted the disk.")
-                self.prompt = "(%s)> " % arg[0].split("\\")[-1]
-            else:
-                print("Failed to mount the disk!")
+            try:
+                if self.disk.mount(paths[0], readonly="--readonly" in arg, locking=locking):
+                    print("Sucessfully mounted the disk.")
+                    self.prompt = "(%s)> " % paths[0].split("\\")[-1]
+                else:
+                    print("Failed to mount the disk!")
+
+            except SlitherIOError as e:
+                print(e.msg)
 
     def do_unmount(self, arg):
         "unmount <>"
@@ -80,7 +96,7 @@ class Slither_CMD(Cmd):
             print("No disk mounted!")
 
     def do_format(self, arg):
-        "format -g <style>"
+        "format -g <style> optional -s for a sparse disk or -c/--clone to clone a template disk"
 
         if not len(arg):
             self.arg_count()
@@ -93,15 +109,22 @@ class Slither_CMD(Cmd):
 
         else:
 
+            sparse = "-s" in arg
+            clone = "-c" in arg or "--clone" in arg
+
             style = ""
             for i in arg:
-                style += "%s " % i
+                if i not in ("-s", "-c", "--clone"):
+                    style += "%s " % i
             style = style.strip()
 
             print("Formatting disk to %s ..." % style)
 
             try:
-                self.disk.formatDisk(style)
+                if clone:
+                    self.disk.cloneDisk(style)
+                else:
+                    self.disk.formatDisk(style, sparse)
 
                 print("Successfully formated the disk!")
 
@@ -173,18 +196,31 @@ class Slither_CMD(Cmd):
             print(e.msg)
 
     def do_push(self, arg):
-        "push <file>"
+        "push <file> or push -r <dir> to push a whole directory"
 
-        if len(arg) != 1:
+        if len(arg) not in (1, 2) or (len(arg) == 2 and arg[0] != "-r"):
             self.arg_count()
             return False
 
-        try:
-            # Read the contents of the file.
-            f = open(arg[0], "rb")
-            cnt = f.read()
-            f.close()
+        # Push everything in a host directory into the current directory.
+        if arg[0] == "-r":
+            if len(arg) != 2:
+                self.arg_count()
+                return False
+
+            try:
+                count = self.disk.import_tree(arg[1], ".")
+                print("Successfully pushed %d files!" % count)
+
+            except OSError:
+                print("Unable to read the directory!")
+
+            except SlitherIOError as e:
+                print(e.msg)
 
+            return False
+
+        try:
             # Create a string to hold the filename.
             fn = arg[0]
 
@@ -192,7 +228,9 @@ class Slither_CMD(Cmd):
             if "/" in arg[0]:
                 fn = arg[0].split("/")[-1]
 
-            self.disk.addFile(fn, cnt)
+            # Stream the contents of the file over.
+            with open(arg[0], "rb") as f:
+                self.disk.addFile(fn, f, os.fstat(f.fileno()).st_size)
 
             print("Successfully pushed the file!")
 
@@ -202,6 +240,85 @@ class Slither_CMD(Cmd):
         except SlitherIOError as e:
             print(e.msg)
 
+    def do_mkdir(self, arg):
+        "mkdir <dir>"
+
+        if len(arg) != 1:
+            self.arg_count()
+            return False
+
+        try:
+            self.disk.makeDir(arg[0])
+            print("Successfully made the directory!")
+
+        except SlitherIOError as e:
+            print(e.msg)
+
+    def do_defrag(self, arg):
+        "defrag optional <bootfile> to put a file first"
+
+        if len(arg) > 1:
+            self.arg_count()
+            return False
+
+        try:
+            before, after = self.disk.defrag(arg[0] if arg else None)
+
+            print("Fragmented chains: %d before, %d after" % (before["FRAGMENTED"], after["FRAGMENTED"]))
+            print("Fragmentation score: %.1f%% before, %.1f%% after" % (before["SCORE"] * 100, after["SCORE"] * 100))
+
+        except SlitherIOError as e:
+            print(e.msg)
+
+    def do_check(self, arg):
+        "check optional -r to repair, or check -b <images> optional -r to check many images at once"
+
+        repair = "-r" in arg
+        images = [i for i in arg if i not in ("-r", "-b")]
+
+        # Check every image matching the patterns, a process per core.
+        if "-b" in arg:
+            paths = []
+            for i in images:
+                paths.extend(sorted(glob.glob(i)) or [i])
+
+            if not paths:
+                self.arg_count()
+                return False
+
+            for path, report in checkImages(paths, repair).items():
+                if "ERROR" in report:
+                    print("%s: %s" % (path, report["ERROR"]))
+                elif report["REPAIRED"]:
+                    print("%s: repaired %d errors" % (path, report["ERRORS"]))
+                else:
+                    print("%s: %d errors" % (path, report["ERRORS"]))
+
+            return False
+
+        if images:
+            self.arg_count()
+            return False
+
+        try:
+            report = self.disk.fsck(repair)
+
+            print("Cross-linked clusters: %d" % len(report["CROSS_LINKS"]))
+            print("Lost chains: %d" % len(report["LOST_CHAINS"]))
+            print("Chains past the end of the file: %d" % len(report["LONG_CHAINS"]))
+            print("Mismatched FAT copies: %d" % len(report["FAT_MISMATCHES"]))
+            print("Bad LFN checksums: %d" % len(report["BAD_LFNS"]))
+            print("Bad . and .. entries: %d" % len(report["BAD_DOT_ENTRIES"]))
+
+            for i in report["LONG_CHAINS"] + report["BAD_DOT_ENTRIES"]:
+                print("  %s" % i)
+
+            if report["REPAIRED"]:
+                print("Successfully repaired the disk!")
+
+        except SlitherIOError as e:
+            print(e.msg)
+
     def do_del(self, arg):
         "del <file>"
 
@@ -232,22 +349,37 @@ class Slither_CMD(Cmd):
             print(e.msg)
 
     def do_pull(self, arg):
-        "pull <file> optional <newfile>"
+        "pull <file> optional <newfile> or pull -r <dir> to pull the whole disk"
 
         if len(arg) not in (1, 2):
             self.arg_count()
             return False
 
+        # Pull every file on the disk into a host directory.
+        if arg[0] == "-r":
+            try:
+                count = self.disk.extract_all(arg[1] if len(arg) == 2 else ".")
+                print("Successfully pulled %d files!" % count)
+
+            except OSError:
+                print("Unable to create file!")
+
+            except SlitherIOError as e:
+                print(e.msg)
+
+            return False
+
         try:
-            c = self.disk.readFile(arg[0])
+            c = self.disk.open(arg[0])
 
             if len(arg) == 2:
                 f = open(arg[1], "wb")
             else:
                 f = open(arg[0], "wb")
 
-            f.write(c)
-            f.close()
+            # Stream the file over instead of loading all of it.
+            with c, f:
+                shutil.copyfileobj(c, f)
 
             print("Successfully pulled the file!")
 
@@ -257,6 +389,55 @@ class Slither_CMD(Cmd):
         except SlitherIOError as e:
             print(e.msg)
 
+    def do_build(self, arg):
+        "build <image> -m <manifest> or build <image> <dir> <style>"
+
+        if len(arg) < 3:
+            self.arg_count()
+            return False
+
+        try:
+            if arg[1] == "-m":
+                FAT12().buildImage(arg[0], manifest=arg[2])
+            else:
+                FAT12().buildImage(arg[0], " ".join(arg[2:]), arg[1])
+
+            print("Successfully built the disk!")
+
+        except OSError:
+            print("Unable to build the disk!")
+
+        except SlitherIOError as e:
+            print(e.msg)
+
+    def do_begin(self, arg):
+        "begin <> starts a batch, nothing is written to the disk until commit"
+
+        if len(arg):
+            self.arg_count()
+            return False
+
+        try:
+            self.disk.beginBatch()
+            print("Started a batch.")
+
+        except SlitherIOError as e:
+            print(e.msg)
+
+    def do_commit(self, arg):
+        "commit <> writes the batch to the disk"
+
+        if len(arg):
+            self.arg_count()
+            return False
+
+        try:
+            self.disk.commitBatch()
+            print("Successfully committed the batch!")
+
+        except SlitherIOError as e:
+            print(e.msg)
+
     def do_exit(self, arg):
         "Exits out of the prompt."
 
@@ -2,1152 +2,4569 @@
 # Slither
 
 import os
+import io
+import mmap
+import shutil
+import hashlib
+import tempfile
 import configparser
 import datetime
+import time
+import struct
+import threading
+import contextlib
+import functools
+from array import array
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections.abc import Mapping
+
+import slither_fatcodec as fatcodec
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Layout of the start of the boot sector up to the end of the EBPB.
+BOOT_SECTOR = struct.Struct("<3s8sHBHBHHBHHHIIBBBI11s8s")
+
+# Layouts of a 32 byte 8.3 entry and a vFAT long file name entry.
+SFN_ENTRY = struct.Struct("<8s3sBBBHHHHHHHI")
+LFN_ENTRY = struct.Struct("<B10sBBB12sH4s")
+
+# Most clusters read from a stream before they're written.
+WRITE_CLUSTERS = 64
+
+# Flags for the attributes of a file entry.
+ATTR_FLAGS = {"READ_ONLY": 0x01,
+              "HIDDEN": 0x02,
+              "SYSTEM": 0x04,
+              "VOLUME_ID": 0x08,
+              "DIRECTORY": 0x10,
+              "ARCHIVE": 0x20,
+              "LFN": 0x0F}
+
+# Where formatted template disks are kept.
+TEMPLATE_DIR = os.path.join(tempfile.gettempdir(), "slither_templates")
+
+# Copies a disk image, letting the kernel do the copy when it can.
+def copyImage(src, dest):
+
+    if hasattr(os, "copy_file_range"):
+        with open(src, "rb") as fsrc, open(dest, "wb") as fdest:
+            size = os.fstat(fsrc.fileno()).st_size
+            copied = 0
+
+            try:
+                while copied < size:
+                    n = os.copy_file_range(fsrc.fileno(), fdest.fileno(), size - copied)
+
+                    if not n:
+                        break
+
+                    copied += n
+
+            # Not supported between these files.
+            except OSError:
+                pass
 
-# Handles all of the IO exceptions in Slither.
-class SlitherIOError(Exception):
+            if copied == size:
+                return
 
-    def __init__(self, value, msg):
-        self.value = value
-        self.msg = msg
+    shutil.copyfile(src, dest)
 
-    def __str__(self):
-        return repr(self.msg)
+# Timestamp given to every entry of a built image unless the manifest says otherwise.
+BUILD_TIMESTAMP = datetime.datetime(1980, 1, 1)
 
-# The main library of FAT12 functions.
-class FAT12:
+# Most bytes read from the disk at once while extracting.
+EXTRACT_READ = 1 << 20
 
-    def __init__(self, f=""):
+# How long mount() waits for another process to unlock the disk, in seconds.
+LOCK_TIMEOUT = 30.0
 
-        # A dictionary containing common floppy disk file formats.
-        self.disk_formats = {}
+# The ways a disk image can be locked against other processes.
+LOCK_MODES = ("none", "whole", "range")
 
-        self.fp = f
+# Parsed formats.ini files keyed by their full path, kept until the file changes.
+FORMATS_CACHE = {}
+FORMATS_LOCK = threading.Lock()
 
-        self.f = None
+# Returns the disk formats in a formats.ini, parsing the file only when it's new or has changed.
+# The dictionaries are shared by every caller, so copy a format before changing it.
+def loadFormats(path="formats.ini"):
 
-        self.FS = "FAT12"
+    path = os.path.abspath(path)
 
-        # Current directory path.
-        self.path = "./"
+    try:
+        st = os.stat(path)
+    except OSError:
+        return {}
 
-        # Start of the cluster chain for current directory.
-        self.dir_cluster = 0
+    stamp = (st.st_mtime_ns, st.st_size)
 
-        # Flags for the attributes of a file entry.
-        self.attr_flags = {"READ_ONLY": 0x01,
-                            "HIDDEN": 0x02,
-                            "SYSTEM": 0x04,
-                            "VOLUME_ID": 0x08,
-                            "DIRECTORY": 0x10,
-                            "ARCHIVE": 0x20,
-                            "LFN": 0x0F}
+    with FORMATS_LOCK:
+        cached = FORMATS_CACHE.get(path)
 
-        # A dictionary for the BIOS Parameter Block.
-        self.attr = {
-            "OEM_Label" : "",
-            "Bytes_Per_Sector" : 0,
-            "Sectors_Per_Cluster" : 0,
-            "Reserved_Sectors" : 0,
-            "FATs" : 0,
-            "Dir_Entries" : 0,
-            "Logical_Sectors" : 0,
-            "Media_ID" : 0,
-            "Sectors_Per_FAT" : 0,
-            "Sectors_Per_Track" : 0,
-            "Sides": 0,
-            "Hidden_Sectors": 0,
-            "LBA_Sectors": 0,
-            "Drive_Number": 0,
-            "Windows_NT_Flag": 0,
-            "Signature": 0,
-            "Volume_ID": 0,
-            "Volume_Label": "",
-            "Identifier": ""}
+        if cached and cached[0] == stamp:
+            return cached[1]
 
-        self.get_disk_formats()
+    config = configparser.ConfigParser()
+    config.optionxform = str
+    config.read(path)
 
-    #######################
-    # INTERNAL FUNCTIONS
-    #######################
+    formats = {}
+    for i in config.sections():
+        formats[i] = {}
+        for x in config[i]:
+            if x in ("OEM_Label", "Volume_Label", "Identifier"):
+                formats[i][x] = str(config[i][x])
+            else:
+                formats[i][x] = int(config[i][x])
 
-    # Seek the Root Directory.
-    def _seek_root(self):
-        self.f.seek((self.attr["Reserved_Sectors"]+self.attr["Sectors_Per_FAT"]*self.attr["FATs"])*self.attr["Bytes_Per_Sector"])
+    with FORMATS_LOCK:
+        FORMATS_CACHE[path] = (stamp, formats)
 
-    # Seeks a file. Returns False if it doesn't exist, otherwise it's True.
-    def _seek_file(self, file):
+    return formats
 
-        # Get a list of files in the directory.
-        e = self.getDir()
-        e_files = [i for i in e if e[i]["IS_FILE"]]
+# Returns a name read from a disk if it's safe to use as one host file name.
+# Untrusted images can hold names that climb out of the directory they're extracted to.
+def checkHostName(name):
 
-        # Find the file!
-        if file in e_files:
-            self.f.seek(e[file]["SFN_LBA"])
-            return True
-        else:
-            return False
+    if ("/" in name or "\\" in name or "\0" in name or not name.rstrip(". ") or
+        os.path.isabs(name) or os.path.splitdrive(name)[0] or name[1:2] == ":"):
+        raise SlitherIOError("UnsafeFileName", "The disk has a file name that isn't safe to extract: %r" % name)
 
-    # Seeks a free entry.
-    # Deprecated. Use findFreeEntry()
-    def _seek_free(self, file, n=1):
-        return self.findFreeEntry(n)
+    return name
 
-    #######################
-    # MAIN FUNCTIONS
-    #######################
+# Image locks in this process keyed by the device and inode of the image.
+# A process can only hold one, since fcntl locks belong to the whole process.
+LOCKED_IMAGES = {}
+LOCKED_IMAGES_LOCK = threading.Lock()
 
-    # Get a list of disk formats from formats.ini
-    def get_disk_formats(self):
-        config = configparser.ConfigParser()
-        config.optionxform = str
-        config.read("formats.ini")
-        for i in config.sections():
-            self.disk_formats[i] = {}
-            for x in config[i]:
-                if x in ("OEM_Label", "Volume_Label", "Identifier"):
-                    self.disk_formats[i][x] = str(config[i][x])
-                else:
-                    self.disk_formats[i][x] = int(config[i][x])
+# A forked child doesn't inherit the fcntl locks of its parent.
+def forgetLockedImages():
+    global LOCKED_IMAGES_LOCK
 
-    def mount(self, file=""):
-        if file:
-            self.fp = file
-        else:
-            file = self.fp
+    LOCKED_IMAGES.clear()
+    LOCKED_IMAGES_LOCK = threading.Lock()
 
-        if os.path.exists(file):
-            self.f = open(file, "rb+")
-            self.f.seek(3)
-
-            # BPB
-            self.attr["OEM_Label"] = self.f.read(8).decode(encoding="ascii").rstrip()
-            self.attr["Bytes_Per_Sector"] = int.from_bytes(self.f.read(2), "little")
-            self.attr["Sectors_Per_Cluster"] = int.from_bytes(self.f.read(1), "little")
-            self.attr["Reserved_Sectors"] = int.from_bytes(self.f.read(2), "little")
-            self.attr["FATs"] = int.from_bytes(self.f.read(1), "little")
-            self.attr["Dir_Entries"] = int.from_bytes(self.f.read(2), "little")
-            self.attr["Logical_Sectors"] = int.from_bytes(self.f.read(2), "little")
-            self.attr["Media_ID"] = int.from_bytes(self.f.read(1), "little")
-            self.attr["Sectors_Per_FAT"] = int.from_bytes(self.f.read(2), "little")
-            self.attr["Sectors_Per_Track"] = int.from_bytes(self.f.read(2), "little")
-            self.attr["Sides"] = int.from_bytes(self.f.read(2), "little")
-            self.attr["Hidden_Sectors"] = int.from_bytes(self.f.read(4), "little")
-            self.attr["LBA_Sectors"] = int.from_bytes(self.f.read(4), "little")
-
-            # EPBP
-            self.attr["Drive_Number"] = int.from_bytes(self.f.read(1), "little")
-            self.attr["Windows_NT_Flag"] = int.from_bytes(self.f.read(1), "little")
-            self.attr["Signature"] = int.from_bytes(self.f.read(1), "little")
-            self.attr["Volume_ID"] = int.from_bytes(self.f.read(4), "little")
-            self.attr["Volume_Label"] = self.f.read(11).decode(encoding="ascii").rstrip()
-            self.attr["Identifier"] = self.f.read(8).decode(encoding="ascii").rstrip()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=forgetLockedImages)
 
-            return True
+# Positional reads and writes of a host file, which never move the file pointer.
+# Without pread and pwrite, the seek and the read or write are kept together with a lock.
+SEEK_LOCK = threading.Lock()
 
-        return False
+# Most buffers handed to one vectored call.
+IOV_MAX = 1024
 
-    def unmount(self):
-        if self.f:
-            self.f.close()
-            self.f = None
-            return True
+# Reads up to size bytes at an offset of a host file.
+def readAt(fd, size, offset):
 
-        return False
+    buf = bytearray(size)
+
+    del buf[readvAt(fd, [buf], offset):]
+
+    return buf
+
+# Writes data at an offset of a host file.
+def writeAt(fd, data, offset):
+    writevAt(fd, [data], offset)
+
+# Reads into a list of buffers, one after the other, from an offset of a host file.
+# Returns the number of bytes read, which is short at the end of the file.
+def readvAt(fd, bufs, offset):
+
+    bufs = [i for i in [memoryview(i).cast("B") for i in bufs] if len(i)]
+    count = 0
+    first = 0
+
+    while first < len(bufs):
+
+        if hasattr(os, "preadv"):
+            n = os.preadv(fd, bufs[first:first + IOV_MAX], offset)
+
+        elif hasattr(os, "pread"):
+            data = os.pread(fd, len(bufs[first]), offset)
+            n = len(data)
+            bufs[first][:n] = data
 
-    # Check to see if we're mounted.
-    def isMounted(self):
-        if self.f:
-            return True
         else:
-            return False
+            with SEEK_LOCK:
+                os.lseek(fd, offset, os.SEEK_SET)
+                data = os.read(fd, len(bufs[first]))
 
-    def getDirSector(self):
-        return (self.attr["Dir_Entries"] *32) // self.attr["Bytes_Per_Sector"]
+            n = len(data)
+            bufs[first][:n] = data
 
-    def getFirstDataSector(self):
-        return self.attr["Reserved_Sectors"]+self.attr["Sectors_Per_FAT"]*self.attr["FATs"] + self.getDirSector()
+        # The end of the file.
+        if not n:
+            break
 
-    def formatDisk(self, style):
-        # Make sure the disk is mounted first!
-        if not self.isMounted():
-            raise SlitherIOError("NotMounted", "No disk mounted!")
+        count += n
+        offset += n
 
-        # Make sure the format style exists.
-        if style not in self.disk_formats:
-            raise SlitherIOError("FormatDoesNotExist", "The format doesn't exist!")
+        # Drop the buffers that are full.
+        while first < len(bufs) and n >= len(bufs[first]):
+            n -= len(bufs[first])
+            first += 1
 
-        self.attr = self.disk_formats[style]
+        if n:
+            bufs[first] = bufs[first][n:]
 
-        self.f.close()
-        self.f = open(self.fp, "wb")
+    return count
 
-        # Number of logical sectors multiplied by bytes per sector.
-        for i in range(self.attr["Logical_Sectors"] * self.attr["Bytes_Per_Sector"]):
-            self.f.write(b'\x00')
-        self.f.close()
+# Writes a list of buffers, one after the other, at an offset of a host file.
+def writevAt(fd, bufs, offset):
 
-        self.f = open(self.fp, "rb+")
-
-        self.f.seek(0)
-        self.f.write(b'\xEB\x3C\x90')
-
-        #BPB
-        self.f.write(bytes(self.attr["OEM_Label"][:8].ljust(8), "ascii"))
-        self.f.write(self.attr["Bytes_Per_Sector"].to_bytes(2, "little"))
-        self.f.write(self.attr["Sectors_Per_Cluster"].to_bytes(1, "little"))
-        self.f.write(self.attr["Reserved_Sectors"].to_bytes(2, "little"))
-        self.f.write(self.attr["FATs"].to_bytes(1, "little"))
-        self.f.write(self.attr["Dir_Entries"].to_bytes(2, "little")) # Directory Entries
-        self.f.write(self.attr["Logical_Sectors"].to_bytes(2, "little")) # Logical sectors
-        self.f.write(self.attr["Media_ID"].to_bytes(1, "little")) # Media Descriptor
-        self.f.write(self.attr["Sectors_Per_FAT"].to_bytes(2, "little")) # Sectors Per FAT
-        self.f.write(self.attr["Sectors_Per_Track"].to_bytes(2, "little")) # Sectors Per Track
-        self.f.write(self.attr["Sides"].to_bytes(2, "little")) # Number of Sides
-        self.f.write(self.attr["Hidden_Sectors"].to_bytes(4, "little")) # Hidden Sectors
-        self.f.write(self.attr["LBA_Sectors"].to_bytes(4, "little")) # LBA Sectors
-
-        #EBPB
-        self.f.write(self.attr["Drive_Number"].to_bytes(1, "little")) # Drive Number
-        self.f.write(self.attr["Windows_NT_Flag"].to_bytes(1, "little")) # Windows NT Flag
-        self.f.write(self.attr["Signature"].to_bytes(1, "little")) # Signature
-        self.f.write(self.attr["Volume_ID"].to_bytes(4, "little")) # Volume ID
-        self.f.write(bytes(self.attr["Volume_Label"][:11].ljust(11), "ascii")) # Volume Label
-        self.f.write(bytes(self.attr["Identifier"][:8].ljust(8), "ascii")) # File System Identifier
+    bufs = [i for i in [memoryview(i).cast("B") for i in bufs] if len(i)]
+    first = 0
 
-        # FAT ID
-        self.f.seek(self.attr["Reserved_Sectors"]*self.attr["Bytes_Per_Sector"])
-        self.f.write(b"\xF0\xFF\xFF")
+    while first < len(bufs):
 
-    ############################
-    # ENTRY NAME FUNCTIONS
-    ############################
+        if hasattr(os, "pwritev"):
+            n = os.pwritev(fd, bufs[first:first + IOV_MAX], offset)
 
-    # Takes a file name and returns the appropriate type.
-    def toFN(self, name):
-        if self.isSFN(name):
-            return self.toSFN(name)
-        else:
-            return self.toLFN(name)
+        elif hasattr(os, "pwrite"):
+            n = os.pwrite(fd, bufs[first], offset)
 
-    # Takes a file name and returns the appropriate type in bytes.
-    def toFNb(self, name):
-        if self.isSFN(name):
-            return self.toSFNb(name)
         else:
-            return self.toLFNb(name)
+            with SEEK_LOCK:
+                os.lseek(fd, offset, os.SEEK_SET)
+                n = os.write(fd, bufs[first])
 
-    # Checks to see if this is a valid short name.
-    def isSFN(self, name):
+        offset += n
 
-        # Make sure there's an actual name.
-        if len(name) == 0:
-            return False
+        # Drop the buffers that were written.
+        while first < len(bufs) and n >= len(bufs[first]):
+            n -= len(bufs[first])
+            first += 1
 
-        # Split the file name into a name and extension.
-        dot = name.rfind(".")
+        if n:
+            bufs[first] = bufs[first][n:]
 
-        if dot != -1:
-            s_name = name[:dot]
-            s_ext = name[dot+1:]
-        else:
-            s_name = name
-            s_ext = ""
+# Reads from a stream until the buffer is full or the stream ends.
+# Returns the number of bytes read.
+def readFull(source, buf):
+    count = 0
 
-        # Make sure the name and extension are within size limits.
-        if len(s_name) > 8 or len(s_ext) > 3:
-            return False
+    while count < len(buf):
+        n = source.readinto(buf[count:])
 
-        # Make sure the name and extension have legal characters.
-        for i in s_name+s_ext:
-            if not self.legalSFNchar(i):
-                return False
+        if not n:
+            break
 
-        return True
+        count += n
 
-    # Checks to see if this is a valid long name.
-    # TODO
-    def isLFN(self, name):
-        pass
+    return count
 
+# Handles all of the IO exceptions in Slither.
+class SlitherIOError(Exception):
 
-    # Turns file name into a SFN entry.
-    def toSFN(self, name):
-        if self.isSFN(name):
-            return name.split(".")[0][:8].ljust(8) + name.split(".")[1][:3].ljust(3)
-        else:
-            return False
+    def __init__(self, value, msg):
+        self.value = value
+        self.msg = msg
 
-    # Return a SFN in bytes.
-    def toSFNb(self, name):
-        r = self.toSFN(name)
-        if r:
-            # Split the file name into a name and extension.
-            if "." in name:
-                s_name, s_ext = name.split(".")
-            else:
-                s_name = name
-                s_ext = ""
-            return bytes(s_name.ljust(8)+s_ext.ljust(3), "cp437")
+    def __str__(self):
+        return repr(self.msg)
 
-        return False
+# A file or directory entry read from a directory.
+# Only the raw fields are stored, everything else is worked out when asked for.
+# Entries can still be read like the old dictonaries, entry["IS_FILE"] is entry.is_file.
+class DirEntry(Mapping):
+
+    __slots__ = ("disk",
+                 "raw_name",
+                 "attributes",
+                 "reserved",
+                 "creation_tenth_second",
+                 "creation_time",
+                 "creation_date",
+                 "accessed_date",
+                 "higher_cluster",
+                 "modified_time",
+                 "modified_date",
+                 "lower_cluster",
+                 "size",
+                 "long_file_name",
+                 "sfn_lba",
+                 "lfn_lba")
+
+    # The dictonary keys an entry can be read with.
+    KEYS = ("SHORT_NAME", "SHORT_EXT", "ATTRIBUTES",
+            "IS_READ_ONLY", "IS_HIDDEN", "IS_SYSTEM", "IS_VOLUME_ID", "IS_DIRECTORY", "IS_ARCHIVE", "IS_FILE",
+            "RESERVED", "CREATION_TENTH_SECOND",
+            "CREATION_TIME", "CREATION_TIME_SECOND", "CREATION_TIME_MINUTE", "CREATION_TIME_HOUR", "CREATION_TIME_STR",
+            "CREATION_DATE", "CREATION_DATE_DAY", "CREATION_DATE_MONTH", "CREATION_DATE_YEAR", "CREATION_DATE_STR",
+            "ACCESSED_DATE", "ACCESSED_DATE_DAY", "ACCESSED_DATE_MONTH", "ACCESSED_DATE_YEAR", "ACCESSED_DATE_STR",
+            "HIGHER_CLUSTER",
+            "MODIFIED_TIME", "MODIFIED_TIME_SECOND", "MODIFIED_TIME_MINUTE", "MODIFIED_TIME_HOUR", "MODIFIED_TIME_STR",
+            "MODIFIED_DATE", "MODIFIED_DATE_DAY", "MODIFIED_DATE_MONTH", "MODIFIED_DATE_YEAR", "MODIFIED_DATE_STR",
+            "LOWER_CLUSTER", "CLUSTER", "SIZE", "SIZE_ON_DISK",
+            "LONG_FILE_NAME", "SHORT_FILE_NAME", "SFN_LBA", "LFN_LBA", "FILE_NAME")
+
+    _KEYS = frozenset(KEYS)
+
+    # Takes the unpacked SFN_ENTRY fields.
+    def __init__(self, disk, fields, sfn_lba, lfn_lba=(), long_file_name=""):
+        self.disk = disk
+        self.raw_name = fields[0] + fields[1]
+        (self.attributes,
+         self.reserved,
+         self.creation_tenth_second,
+         self.creation_time,
+         self.creation_date,
+         self.accessed_date,
+         self.higher_cluster,
+         self.modified_time,
+         self.modified_date,
+         self.lower_cluster,
+         self.size) = fields[2:]
+        self.sfn_lba = sfn_lba
+        self.lfn_lba = list(lfn_lba)
+        self.long_file_name = long_file_name
+
+    # ----- Dictonary Methods -----
+
+    def __getitem__(self, key):
+        if key not in self._KEYS:
+            raise KeyError(key)
+
+        return getattr(self, key.lower())
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def __repr__(self):
+        return "DirEntry({!r})".format(self.file_name)
+
+    # ----- Names -----
+
+    @property
+    def short_name(self):
+        return self.raw_name[:8].decode(encoding="ascii").rstrip()
+
+    @property
+    def short_ext(self):
+        return self.raw_name[8:].decode(encoding="ascii").rstrip()
+
+    @property
+    def short_file_name(self):
+        if self.is_directory or not self.short_ext:
+            return self.short_name
+
+        return "{}.{}".format(self.short_name, self.short_ext)
+
+    @property
+    def file_name(self):
+        if self.long_file_name:
+            return self.long_file_name
+
+        return self.short_file_name
+
+    # ----- Attributes -----
+
+    @property
+    def is_read_only(self):
+        return bool(self.attributes & ATTR_FLAGS["READ_ONLY"])
+
+    @property
+    def is_hidden(self):
+        return bool(self.attributes & ATTR_FLAGS["HIDDEN"])
+
+    @property
+    def is_system(self):
+        return bool(self.attributes & ATTR_FLAGS["SYSTEM"])
+
+    @property
+    def is_volume_id(self):
+        return bool(self.attributes & ATTR_FLAGS["VOLUME_ID"])
+
+    @property
+    def is_directory(self):
+        return bool(self.attributes & ATTR_FLAGS["DIRECTORY"])
+
+    @property
+    def is_archive(self):
+        return bool(self.attributes & ATTR_FLAGS["ARCHIVE"])
+
+    @property
+    def is_file(self):
+        return not (self.is_volume_id or self.is_directory)
 
-    # Turns file name into a tuple of each LFN entry.
-    def toLFN(self, name):
-        return tuple([name[i:i+13] for i in range(0, len(name), 13)][::-1])
+    # ----- Clusters -----
 
-    # Return a SFN in bytes.
-    def toLFNb(self, name):
-        r = self.toLFN(name+"\uFFFF")
-        if r:
-            return tuple([bytes(r[i].ljust(13, "\u0000") , "utf-16-le") for i in range(len(r))])
-        else:
-            return False
+    @property
+    def cluster(self):
+        return (self.higher_cluster << 16) + self.lower_cluster
 
-        return r
+    @property
+    def size_on_disk(self):
+        return self.disk.chainLength(self.cluster) * self.disk.getClusterSize()
 
-    # Creates a new duplicated SFN.
-    def dupSFN(self, name):
+    # ----- Times & Dates -----
 
-        # Make sure this is a valid SFN.
-        if not self.isSFN(name):
-            return False
+    @property
+    def creation_time_second(self):
+        return (self.creation_time & 0x1F) * 2
 
-        # Get a list of SFN in the directory.
-        e = self.getDir()
-        e_names = tuple([e[i]["SHORT_FILE_NAME"] for i in e])
+    @property
+    def creation_time_minute(self):
+        return (self.creation_time >> 5) & 0x3F
 
-        # Make sure this file does exist, otherwise just give back the orignal SFN!
-        if name not in e_names:
-            return name
+    @property
+    def creation_time_hour(self):
+        return (self.creation_time >> 11) & 0x1F
 
-        # Split the file name into a name and extension.
-        if "." in name:
-            s_name, s_ext = name.split(".")
-        else:
-            s_name = name
-            s_ext = ""
+    @property
+    def creation_time_str(self):
+        return "{:0>2}:{:0>2}:{:0>2}".format(self.creation_time_hour, self.creation_time_minute, self.creation_time_second)
 
-        for i in range(1000):
-            new_name = "{}~{}.{}".format(s_name[:7-len(str(i))], i, s_ext)
-            if new_name not in e_names:
-                return new_name
+    @property
+    def creation_date_day(self):
+        return self.creation_date & 0x1F
 
+    @property
+    def creation_date_month(self):
+        return (self.creation_date >> 5) & 0xF
 
-    # Makes a SFN from a LFN.
-    def makeSFN(self, name):
+    @property
+    def creation_date_year(self):
+        return ((self.creation_date >> 9) & 0x7F) + 1980
 
-        # Lowercase letters aren't allowed in SFN.
-        name = name.upper()
+    @property
+    def creation_date_str(self):
+        return "{:0>2}/{:0>2}/{}".format(self.creation_date_month, self.creation_date_day, self.creation_date_year) #MMDDYYYY
 
-        # See if there's a file extension.
-        dot = name.rfind(".")
+    @property
+    def accessed_date_day(self):
+        return self.accessed_date & 0x1F
 
-        if dot != -1:
-            s_name = name[:dot]
-            s_ext = name[dot+1:]
-            dot = "."
-        else:
-            s_name = name
-            s_ext = ""
-            dot = ""
+    @property
+    def accessed_date_month(self):
+        return (self.accessed_date >> 5) & 0xF
 
-        # New SFN holder.
-        new_name = ""
-        new_ext = ""
+    @property
+    def accessed_date_year(self):
+        return ((self.accessed_date >> 9) & 0x7F) + 1980
 
-        # Convert illegal characters in the file name.
-        for i in s_name:
-            if self.legalSFNchar(i):
-                new_name = new_name + i
-            else:
-                new_name = new_name + "~"
+    @property
+    def accessed_date_str(self):
+        return "{:0>2}/{:0>2}/{}".format(self.accessed_date_month, self.accessed_date_day, self.accessed_date_year) #MMDDYYYY
 
-        # Convert illegal characters in the file extension.
-        for i in s_ext:
-            if self.legalSFNchar(i):
-                new_ext = new_ext + i
-            else:
-                new_ext = new_ext + "~"
+    @property
+    def modified_time_second(self):
+        return (self.modified_time & 0x1F) * 2
 
-        # Split file name holders.
-        f_name = ""
-        l_name = ""
+    @property
+    def modified_time_minute(self):
+        return (self.modified_time >> 5) & 0x3F
 
-        if len(new_name) <= 8:
-            f_name = new_name
-        else:
-            f_name = new_name[:4]
-            l_name = new_name[-4:]
+    @property
+    def modified_time_hour(self):
+        return (self.modified_time >> 11) & 0x1F
 
-        return "{}{}{}{}".format(f_name, l_name, dot, new_ext[:3])
+    @property
+    def modified_time_str(self):
+        return "{:0>2}:{:0>2}:{:0>2}".format(self.modified_time_hour, self.modified_time_minute, self.modified_time_second)
 
+    @property
+    def modified_date_day(self):
+        return self.modified_date & 0x1F
 
-    # Creates a fake SFN for a LFN.
-    def fakeSFN(self, name):
-        return self.dupSFN(self.makeSFN(name))
+    @property
+    def modified_date_month(self):
+        return (self.modified_date >> 5) & 0xF
 
-    # Returns True if the character is allowed in a SFN, otherwise it returns false.
-    def legalSFNchar(self, char):
-        if ord(char) in (0x20, 0x21, 0x2D, 0x40, 0x7B, 0x7D, 0x7E) or 0x23 <= ord(char) <= 0x29 or 0x30 <= ord(char) <= 0x39 or 0x41 <= ord(char) <= 0x5A or 0x5E <= ord(char) <= 0x60 or 0x80 <= ord(char) <= 0xFF:
-            return True
+    @property
+    def modified_date_year(self):
+        return ((self.modified_date >> 9) & 0x7F) + 1980
+
+    @property
+    def modified_date_str(self):
+        return "{:0>2}/{:0>2}/{}".format(self.modified_date_month, self.modified_date_day, self.modified_date_year) #MMDDYYYY
+
+# A read-only, file-like view of a file on the disk.
+# Use FAT12.open() to get one wrapped in a buffer.
+class FileReader(io.RawIOBase):
+
+    def __init__(self, disk, entry):
+        io.RawIOBase.__init__(self)
+
+        self.disk = disk
+        self.name = entry["FILE_NAME"]
+        self.size = entry["SIZE"]
+        self.pos = 0
+
+        # The clusters of the file in order, so any offset maps straight to its cluster.
+        self.cluster_size = disk.getClusterSize()
+        self.clusters = [i for i in disk.getChain(entry["CLUSTER"]) if 2 <= i < 0xFF0]
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self.pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
         else:
-            return False
+            raise ValueError("Invalid whence!")
 
-    # Generate a checksum for a LFN from a SFN.
-    def gensumLFN(self, name):
+        if pos < 0:
+            raise ValueError("Negative seek position!")
+
+        self.pos = pos
+
+        return self.pos
+
+    # Reads happen under the disk's read lock, but a stream does see
+    # changes made to the disk between two reads.
+    def readinto(self, b):
+        with self.disk.lock.read():
+            return self.readRuns(b)
+
+    def readRuns(self, b):
+        view = memoryview(b).cast("B")
+
+        end = min(self.size, self.pos + len(view))
+        count = 0
+
+        while self.pos < end:
+            index, offset = divmod(self.pos, self.cluster_size)
+
+            # The chain is shorter than the file.
+            if index >= len(self.clusters):
+                break
+
+            # Merge physically adjacent clusters into one read.
+            last = index
+            while (last + 1 < len(self.clusters) and
+                   (last + 1) * self.cluster_size < end and
+                   self.clusters[last + 1] == self.clusters[last] + 1):
+                last += 1
+
+            size = min(end, (last + 1) * self.cluster_size) - self.pos
+            disk_offset = self.disk.getClusterOffset(self.clusters[index]) + offset
+
+            # With byte range locks, only the clusters being read are locked.
+            if self.disk.locking == "range":
+                self.disk.image_lock.acquire(disk_offset, size, False)
+
+                try:
+                    n = self.disk.dev.readinto(disk_offset, view[count:count + size])
+                finally:
+                    self.disk.image_lock.release(disk_offset, size, False)
+
+            else:
+                n = self.disk.dev.readinto(disk_offset, view[count:count + size])
+
+            if not n:
+                break
+
+            self.pos += n
+            count += n
+
+        return count
+
+    def readall(self):
+        contents = bytearray(max(self.size - self.pos, 0))
+        return bytes(contents[:self.readinto(contents)])
+
+# Turns an iterable of byte chunks into a readable stream.
+class ChunkReader(io.RawIOBase):
+
+    def __init__(self, chunks):
+        io.RawIOBase.__init__(self)
+
+        self.chunks = iter(chunks)
+        self.chunk = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        view = memoryview(b).cast("B")
+
+        # Get the next chunk that isn't empty.
+        while not self.chunk:
+            try:
+                self.chunk = memoryview(next(self.chunks)).cast("B")
+            except StopIteration:
+                return 0
+
+        n = min(len(view), len(self.chunk))
+        view[:n] = self.chunk[:n]
+
+        # Move along the chunk without copying what's left of it.
+        self.chunk = self.chunk[n:]
+
+        return n
+
+# Reads and writes a disk image through a regular file.
+# Every access says where it goes, so the file pointer is never shared.
+class FileDevice:
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.readonly = readonly
+
+        self.open()
+
+    def open(self):
+        # Unbuffered, so nothing is held back from pread and pwrite.
+        if self.readonly:
+            self.f = open(self.path, "rb", buffering=0)
+        else:
+            self.f = open(self.path, "rb+", buffering=0)
+
+        self.fd = self.f.fileno()
+
+    # Opens the image at the path again, after another process replaced it.
+    def reopen(self):
+        self.close()
+        self.open()
+
+    # Returns the device and inode of the open image.
+    def getKey(self):
+        st = os.fstat(self.fd)
+        return (st.st_dev, st.st_ino)
+
+    # Make sure the image can be written to.
+    def checkWritable(self):
+        if self.readonly:
+            raise SlitherIOError("ReadOnly", "The disk is mounted read-only!")
+
+    def read(self, offset, size):
+        return readAt(self.fd, size, offset)
+
+    def readinto(self, offset, buf):
+        return readvAt(self.fd, [buf], offset)
+
+    # Reads into a list of buffers from one place on the disk in one call.
+    def readv(self, offset, bufs):
+        return readvAt(self.fd, bufs, offset)
+
+    def write(self, offset, data):
+        self.checkWritable()
+        writeAt(self.fd, data, offset)
+
+    # Writes a list of buffers to one place on the disk in one call.
+    def writev(self, offset, bufs):
+        self.checkWritable()
+        writevAt(self.fd, bufs, offset)
+
+    def flush(self):
+        pass
+
+    # Makes sure all of the changes are on the disk.
+    def commit(self, inplace=False, prepare=None):
+        self.flush()
+
+    # Replaces the whole image with the contents followed by zeros up to the size.
+    # A sparse image leaves the zeros as a hole in the file.
+    def reset(self, contents, size, sparse=False):
+        self.checkWritable()
+
+        self.f.truncate(0)
+        writeAt(self.fd, contents, 0)
+
+        if sparse:
+            self.f.truncate(size)
+        else:
+            writeAt(self.fd, bytes(size - len(contents)), len(contents))
+
+    def close(self):
+        self.f.close()
+
+# Maps the whole disk image into memory.
+# Reads return memoryview slices of the mapping instead of copies.
+class MmapDevice(FileDevice):
+
+    def __init__(self, path, readonly=False):
+        self.map = None
+        self.view = memoryview(b"")
+
+        FileDevice.__init__(self, path, readonly)
+
+    def open(self):
+        FileDevice.open(self)
+        self.mapFile()
+
+    # Maps the whole file.
+    def mapFile(self):
+
+        # An empty file can't be mapped.
+        if os.fstat(self.f.fileno()).st_size:
+            if self.readonly:
+                self.map = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.map = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_WRITE)
+
+            self.view = memoryview(self.map)
+
+    # Lets go of the mapping.
+    def unmapFile(self):
+        self.view.release()
+        self.view = memoryview(b"")
+
+        if self.map:
+            # Views handed out by read() keep the mapping open until they're gone.
+            try:
+                self.map.close()
+            except BufferError:
+                pass
+
+            self.map = None
+
+    def read(self, offset, size):
+        return self.view[offset:offset + size]
+
+    def readinto(self, offset, buf):
+        data = self.view[offset:offset + len(buf)]
+        buf[:len(data)] = data
+        return len(data)
+
+    def readv(self, offset, bufs):
+        count = 0
+
+        for buf in bufs:
+            n = self.readinto(offset + count, buf)
+            count += n
+
+            if n < len(buf):
+                break
+
+        return count
+
+    def write(self, offset, data):
+        self.checkWritable()
+
+        if offset + len(data) > len(self.view):
+            raise SlitherIOError("OutOfRange", "Can't write past the end of the disk!")
+
+        self.view[offset:offset + len(data)] = data
+
+    def writev(self, offset, bufs):
+        for buf in bufs:
+            self.write(offset, buf)
+            offset += len(buf)
+
+    def flush(self):
+        if self.map and not self.readonly:
+            self.map.flush()
+
+    def reset(self, contents, size, sparse=False):
+        self.checkWritable()
+
+        # The file changes size, so map it again afterwards.
+        self.unmapFile()
+        FileDevice.reset(self, contents, size, sparse)
+        self.mapFile()
+
+    def close(self):
+        self.unmapFile()
+        self.f.close()
+
+# Loads the whole disk image into memory and only writes it back on commit.
+class MemoryDevice:
+
+    # Size of the blocks that changes are tracked in.
+    BLOCK_SIZE = 512
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.readonly = readonly
+
+        # The image stays open, as closing any file of it drops the process's locks on it.
+        self.open()
+
+        self.buf = readAt(self.f.fileno(), os.fstat(self.f.fileno()).st_size, 0)
+
+        # Blocks that changed since the last commit.
+        self.dirty = set()
+
+    def open(self):
+        if self.readonly:
+            self.f = open(self.path, "rb", buffering=0)
+            return
+
+        # An image that can't be written to can still be replaced on commit.
+        try:
+            self.f = open(self.path, "rb+", buffering=0)
+        except PermissionError:
+            self.f = open(self.path, "rb", buffering=0)
+
+    # Make sure the image can be written to.
+    def checkWritable(self):
+        if self.readonly:
+            raise SlitherIOError("ReadOnly", "The disk is mounted read-only!")
+
+    def read(self, offset, size):
+        return memoryview(self.buf)[offset:offset + size]
+
+    def readinto(self, offset, buf):
+        data = self.buf[offset:offset + len(buf)]
+        buf[:len(data)] = data
+        return len(data)
+
+    def write(self, offset, data):
+        self.checkWritable()
+
+        if offset + len(data) > len(self.buf):
+            raise SlitherIOError("OutOfRange", "Can't write past the end of the disk!")
+
+        self.buf[offset:offset + len(data)] = data
+
+        if len(data):
+            self.dirty.update(range(offset // self.BLOCK_SIZE, (offset + len(data) - 1) // self.BLOCK_SIZE + 1))
+
+    def readv(self, offset, bufs):
+        count = 0
+
+        for buf in bufs:
+            n = self.readinto(offset + count, buf)
+            count += n
+
+            if n < len(buf):
+                break
+
+        return count
+
+    def writev(self, offset, bufs):
+        for buf in bufs:
+            self.write(offset, buf)
+            offset += len(buf)
+
+    # Nothing reaches the disk until a commit.
+    def flush(self):
+        pass
+
+    # Replaces the whole image in memory. Sparse images don't apply here.
+    def reset(self, contents, size, sparse=False):
+        self.checkWritable()
+
+        self.buf = bytearray(size)
+        self.buf[:len(contents)] = contents
+
+        self.dirty = set(range(-(-size // self.BLOCK_SIZE)))
+
+    # Returns a list of (offset, size) ranges that changed since the last commit.
+    def getDirtyRanges(self):
+        ranges = []
+
+        for i in sorted(self.dirty):
+            if ranges and ranges[-1][0] + ranges[-1][1] == i * self.BLOCK_SIZE:
+                ranges[-1][1] += self.BLOCK_SIZE
+            else:
+                ranges.append([i * self.BLOCK_SIZE, self.BLOCK_SIZE])
+
+        return [(offset, min(size, len(self.buf) - offset)) for offset, size in ranges]
+
+    # Writes the image back to the disk.
+    # By default the whole image is written to a temporary file that replaces
+    # the old one, so a crash never leaves a half written image behind.
+    # With inplace, only the blocks that changed are patched into the old image.
+    # Before it replaces the image, prepare is called with the path of the new file.
+    def commit(self, inplace=False, prepare=None):
+        if not self.dirty:
+            return
+
+        if inplace:
+            for offset, size in self.getDirtyRanges():
+                writeAt(self.f.fileno(), memoryview(self.buf)[offset:offset + size], offset)
+
+            self.f.truncate(len(self.buf))
+            os.fsync(self.f.fileno())
+
+        else:
+            fd, temp = tempfile.mkstemp(prefix=".slither-", dir=os.path.dirname(os.path.abspath(self.path)))
+
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(self.buf)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                # Keep the permissions of the old image.
+                os.chmod(temp, os.stat(self.path).st_mode & 0o7777)
+
+                if prepare:
+                    prepare(temp)
+
+                os.replace(temp, self.path)
+
+            except BaseException:
+                if os.path.exists(temp):
+                    os.remove(temp)
+                raise
+
+            # Keep the new image open instead of the old one.
+            self.f.close()
+            self.open()
+
+        self.dirty = set()
+
+    def close(self):
+        self.buf = bytearray()
+        self.f.close()
+
+# Stages writes to another device in memory until the batch is applied.
+# Writes are kept per block, so many small writes to the same sectors
+# reach the disk as a few block sized writes.
+class BatchDevice:
+
+    # Size of the blocks that writes are staged in.
+    BLOCK_SIZE = 512
+
+    def __init__(self, dev, data_offset=0, cluster_size=0, free=b""):
+        self.dev = dev
+        self.path = dev.path
+        self.readonly = dev.readonly
+
+        # Staged blocks by block number.
+        self.blocks = {}
+
+        # Clusters that were free when the batch began, which nothing on the disk points to.
+        # Writes to them go straight to the disk, so file data is never held in memory.
+        # Clusters that don't line up with the blocks are staged like everything else.
+        self.data_offset = data_offset
+        self.cluster_size = cluster_size
+
+        if cluster_size and not data_offset % self.BLOCK_SIZE and not cluster_size % self.BLOCK_SIZE:
+            self.free = free
+        else:
+            self.free = b""
+
+    def checkWritable(self):
+        self.dev.checkWritable()
+
+    # Returns the staged block numbers inside a range.
+    def stagedBlocks(self, offset, size):
+        first = offset // self.BLOCK_SIZE
+        last = (offset + size - 1) // self.BLOCK_SIZE
+
+        if last - first + 1 <= len(self.blocks):
+            return [i for i in range(first, last + 1) if i in self.blocks]
+
+        return sorted(i for i in self.blocks if first <= i <= last)
+
+    def read(self, offset, size):
+        staged = self.stagedBlocks(offset, size) if size > 0 else []
+
+        if not staged:
+            return self.dev.read(offset, size)
+
+        data = bytearray(self.dev.read(offset, size))
+
+        # Lay the staged blocks over what's on the disk.
+        for i in staged:
+            start = max(offset, i * self.BLOCK_SIZE)
+            end = min(offset + len(data), (i + 1) * self.BLOCK_SIZE)
+
+            if start < end:
+                data[start - offset:end - offset] = self.blocks[i][start - i * self.BLOCK_SIZE:end - i * self.BLOCK_SIZE]
+
+        return data
+
+    def readinto(self, offset, buf):
+        data = self.read(offset, len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    def readv(self, offset, bufs):
+        count = 0
+
+        for buf in bufs:
+            n = self.readinto(offset + count, buf)
+            count += n
+
+            if n < len(buf):
+                break
+
+        return count
+
+    def writev(self, offset, bufs):
+
+        size = sum(memoryview(buf).nbytes for buf in bufs)
+
+        # File data in free clusters keeps going to the disk in one vectored write.
+        if size and self.freeSize(offset, size) == size:
+            self.checkWritable()
+            self.dev.writev(offset, bufs)
+            return
+
+        for buf in bufs:
+            self.write(offset, buf)
+            offset += len(buf)
+
+    # Returns how much of a write from offset on lands in clusters that were free when the batch began.
+    def freeSize(self, offset, size):
+        if offset < self.data_offset:
+            return 0
+
+        cluster = (offset - self.data_offset) // self.cluster_size + 2
+
+        if cluster >= len(self.free) or not self.free[cluster]:
+            return 0
+
+        end = self.free.find(0, cluster)
+
+        if end == -1:
+            end = len(self.free)
+
+        return min(size, self.data_offset + (end - 2) * self.cluster_size - offset)
+
+    def write(self, offset, data):
+        self.checkWritable()
+
+        data = memoryview(data).cast("B")
+        pos = 0
+
+        while pos < len(data):
+
+            n = self.freeSize(offset + pos, len(data) - pos)
+
+            if n:
+                self.dev.write(offset + pos, data[pos:pos + n])
+                pos += n
+                continue
+
+            i = (offset + pos) // self.BLOCK_SIZE
+            start = (offset + pos) % self.BLOCK_SIZE
+            n = min(self.BLOCK_SIZE - start, len(data) - pos)
+
+            # Start from what's on the disk the first time a block is written.
+            if i not in self.blocks:
+                block = bytearray(self.dev.read(i * self.BLOCK_SIZE, self.BLOCK_SIZE))
+
+                if len(block) < n + start:
+                    raise SlitherIOError("OutOfRange", "Can't write past the end of the disk!")
+
+                self.blocks[i] = block
+
+            self.blocks[i][start:start + n] = data[pos:pos + n]
+            pos += n
+
+    # Nothing reaches the disk until the batch is applied.
+    def flush(self):
+        pass
+
+    def commit(self, inplace=False, prepare=None):
+        pass
+
+    def reset(self, contents, size, sparse=False):
+        raise SlitherIOError("BatchInProgress", "Can't format the disk during a batch!")
+
+    # Writes the staged blocks to the device, each run of neighbouring blocks in one vectored write.
+    def apply(self):
+        run_start = None
+        run = []
+
+        for i in sorted(self.blocks):
+            if run_start is not None and run_start + len(run) == i:
+                run.append(self.blocks[i])
+                continue
+
+            if run:
+                self.dev.writev(run_start * self.BLOCK_SIZE, run)
+
+            run_start = i
+            run = [self.blocks[i]]
+
+        if run:
+            self.dev.writev(run_start * self.BLOCK_SIZE, run)
+
+        self.blocks = {}
+        self.dev.flush()
+
+    def close(self):
+        self.blocks = {}
+        self.dev.close()
+
+# The ways a disk image can be mounted.
+DEVICES = {"file": FileDevice,
+           "mmap": MmapDevice,
+           "memory": MemoryDevice}
+
+# A lock that lets many threads read at once but only one thread write.
+# Both sides are reentrant and the writing thread can read too. Waiting
+# writers go ahead of new readers, and the readers waiting when a writer
+# finishes go ahead of the next writer, so neither side can starve the other.
+class RWLock:
+
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+
+        # Read depth of each reading thread.
+        self.readers = {}
+
+        self.writer = None
+        self.writer_depth = 0
+        self.waiting_writers = 0
+
+        # Readers waiting, and how many of them get in before the next writer.
+        self.waiting_readers = 0
+        self.admitted = 0
+
+    def acquireRead(self):
+        me = threading.get_ident()
+
+        # Only the writer ever sets the writer to itself, so this is safe to check
+        # without the lock. The writer's reads count as part of its write.
+        if self.writer == me:
+            self.writer_depth += 1
+            return
+
+        with self.cond:
+            if me not in self.readers:
+                self.waiting_readers += 1
+
+                try:
+                    while self.writer is not None or (self.waiting_writers and not self.admitted):
+                        self.cond.wait()
+                finally:
+                    self.waiting_readers -= 1
+                    self.admitted = min(max(self.admitted - 1, 0), self.waiting_readers)
+
+            self.readers[me] = self.readers.get(me, 0) + 1
+
+    def releaseRead(self):
+        me = threading.get_ident()
+
+        if self.writer == me:
+            self.releaseWrite()
+            return
+
+        with self.cond:
+            self.readers[me] -= 1
+
+            if not self.readers[me]:
+                del self.readers[me]
+                self.cond.notify_all()
+
+    def acquireWrite(self):
+        me = threading.get_ident()
+
+        if self.writer == me:
+            self.writer_depth += 1
+            return
+
+        with self.cond:
+
+            # Waiting here would wait on ourselves.
+            if me in self.readers:
+                raise SlitherIOError("LockUpgrade", "Can't write to the disk while reading it!")
+
+            self.waiting_writers += 1
+
+            try:
+                while self.writer is not None or self.readers or self.admitted:
+                    self.cond.wait()
+            finally:
+                self.waiting_writers -= 1
+
+            self.writer = me
+            self.writer_depth = 1
+
+    # How deep the calling thread is in the lock, 0 if it doesn't hold it.
+    def depth(self):
+        me = threading.get_ident()
+
+        if self.writer == me:
+            return self.writer_depth
+
+        return self.readers.get(me, 0)
+
+    def releaseWrite(self):
+        if self.writer_depth > 1:
+            self.writer_depth -= 1
+            return
+
+        with self.cond:
+            self.writer_depth = 0
+            self.writer = None
+            self.admitted = self.waiting_readers
+            self.cond.notify_all()
+
+    @contextlib.contextmanager
+    def read(self):
+        self.acquireRead()
+
+        try:
+            yield
+        finally:
+            self.releaseRead()
+
+    @contextlib.contextmanager
+    def write(self):
+        self.acquireWrite()
+
+        try:
+            yield
+        finally:
+            self.releaseWrite()
+
+# Runs a FAT12 method while holding the read side of the disk's lock.
+def readLocked(method):
+
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        self.lock.acquireRead()
+
+        try:
+            # With byte range locks, the outermost call locks the disk's metadata too.
+            ranged = self.locking == "range" and self.lock.depth() == 1
+
+            if ranged:
+                self.lockMetadata(False)
+
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                if ranged:
+                    self.unlockMetadata(False)
+
+        finally:
+            self.lock.releaseRead()
+
+    return locked
+
+# Runs a FAT12 method while holding the disk's lock for writing.
+def writeLocked(method):
+
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        self.lock.acquireWrite()
+
+        try:
+            # With byte range locks, the outermost call locks the disk's metadata too.
+            ranged = self.locking == "range" and self.lock.depth() == 1
+
+            if ranged:
+                self.lockMetadata(True)
+
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                if ranged:
+                    self.unlockMetadata(True)
+
+        finally:
+            self.lock.releaseWrite()
+
+    return locked
+
+# Advisory locks on a disk image, shared with other processes through fcntl.
+# The whole image can be locked, or blocks of it, where each block keeps a count
+# of the shared and exclusive holders in this process. fcntl locks belong to the
+# process, so threads that share a mount are kept apart by RWLock instead.
+# For the same reason a process can only have one ImageLock on an image at a time,
+# as closing another file of the image would silently drop this one's locks.
+# Without fcntl, as on Windows, nothing is locked.
+class ImageLock:
+
+    # Size of the blocks that locks are counted in.
+    BLOCK_SIZE = 512
+
+    def __init__(self, path, writable, timeout=None):
+        self.path = path
+        self.writable = writable
+        self.timeout = timeout
+
+        self.fd = None
+        self.key = None
+        self.mutex = threading.Lock()
+
+        # Whether the whole image is locked, and if it's exclusive.
+        self.whole = None
+
+        # Shared and exclusive holders of each locked block.
+        self.blocks = {}
+
+        # Set when the image was replaced under a lock, so what's held has to be locked again.
+        self.lost = False
+
+        # A file locked by prepare() that's about to replace the image.
+        self.next_fd = None
+
+        self.open()
+
+    def open(self):
+        if not fcntl:
+            return
+
+        try:
+            self.fd = os.open(self.path, os.O_RDWR if self.writable else os.O_RDONLY)
+        except PermissionError:
+            self.fd = os.open(self.path, os.O_RDONLY)
+            self.writable = False
+
+        st = os.fstat(self.fd)
+        self.key = (st.st_dev, st.st_ino)
+
+        # Closing any other file of the image in this process would drop this one's locks.
+        with LOCKED_IMAGES_LOCK:
+            if LOCKED_IMAGES.get(self.key, self) is not self:
+                os.close(self.fd)
+                self.fd = None
+                raise SlitherIOError("AlreadyLocked", "The disk is already mounted with a lock in this process!")
+
+            LOCKED_IMAGES[self.key] = self
+
+    # Locks or unlocks a run of blocks, or the whole image when count is 0.
+    # Returns False if another process holds a lock that's in the way.
+    def setLock(self, kind, first=0, count=0, fd=None):
+        try:
+            fcntl.lockf(self.fd if fd is None else fd, kind | (fcntl.LOCK_NB if kind != fcntl.LOCK_UN else 0),
+                        count * self.BLOCK_SIZE, first * self.BLOCK_SIZE)
+
+        except (BlockingIOError, PermissionError):
+            return False
+
+        except OSError:
+            raise SlitherIOError("LockFailed", "Unable to lock the disk!")
+
+        return True
+
+    # Keeps trying to take locks until they're all taken or the timeout runs out.
+    # The attempt returns True once it has what it needs.
+    def wait(self, attempt):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        delay = 0.001
+
+        while not attempt():
+            if deadline is not None and time.monotonic() >= deadline:
+                raise SlitherIOError("LockTimeout", "Timed out waiting for another process to unlock the disk!")
+
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
+    # Locks the whole image, exclusive for a writer and shared for a reader.
+    def lockWhole(self, exclusive):
+        if not fcntl:
+            return
+
+        def attempt():
+            with self.mutex:
+                if not self.relock() or not self.setLock(fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH):
+                    return False
+
+                if self.replaced():
+                    return False
+
+                self.whole = exclusive
+                return True
+
+        self.wait(attempt)
+
+    # Checks that the locked file is still the image at the path. A process waiting for
+    # a lock gets it on the old file once a memory mount replaces the image, and then
+    # opens the new one, which has to be locked again. Only called with the mutex held.
+    def replaced(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False
+
+        if (st.st_dev, st.st_ino) == self.key:
+            return False
+
+        self.close()
+        self.open()
+        self.lost = True
+
+        return True
+
+    # Takes every lock that's held on the file again, after the image was opened again.
+    # With fd, the locks are taken on that file instead. Only called with the mutex held.
+    def relock(self, fd=None):
+        if fd is None and not self.lost:
+            return True
+
+        if self.whole is not None and not self.setLock(fcntl.LOCK_EX if self.whole else fcntl.LOCK_SH, fd=fd):
+            return False
+
+        for start, count in self.runs(min(self.blocks, default=0), max(self.blocks, default=-1) + 1,
+                                      lambda held: held[0] or held[1]):
+            for block in range(start, start + count):
+                if not self.setLock(fcntl.LOCK_EX if self.blocks[block][1] else fcntl.LOCK_SH, block, 1, fd):
+                    return False
+
+        if fd is None:
+            self.lost = False
+
+        return True
+
+    # Returns the runs of blocks from first up to end that pass the test, as (first, count).
+    def runs(self, first, end, test):
+        runs = []
+
+        for i in range(first, end):
+            if not test(self.blocks.get(i, (0, 0))):
+                continue
+
+            if runs and runs[-1][0] + runs[-1][1] == i:
+                runs[-1][1] += 1
+            else:
+                runs.append([i, 1])
+
+        return runs
+
+    # Locks the blocks that cover a range of bytes.
+    # Calls refresh, while still holding the mutex, if any of them weren't locked before.
+    def acquire(self, offset, size, exclusive, refresh=None):
+        if not fcntl or size <= 0:
+            return
+
+        first = offset // self.BLOCK_SIZE
+        end = (offset + size - 1) // self.BLOCK_SIZE + 1
+
+        def attempt():
+            with self.mutex:
+                if not self.relock():
+                    return False
+
+                # Only blocks without a strong enough lock need a new one.
+                if exclusive:
+                    runs = self.runs(first, end, lambda held: not held[1])
+                else:
+                    runs = self.runs(first, end, lambda held: not held[0] and not held[1])
+
+                fresh = bool(self.runs(first, end, lambda held: not held[0] and not held[1]))
+
+                for i in range(len(runs)):
+                    if not self.setLock(fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH, *runs[i]):
+
+                        # Put back what this attempt changed.
+                        for start, count in runs[:i]:
+                            for block in range(start, start + count):
+                                if self.blocks.get(block, (0, 0))[0]:
+                                    self.setLock(fcntl.LOCK_SH, block, 1)
+                                else:
+                                    self.setLock(fcntl.LOCK_UN, block, 1)
+
+                        return False
+
+                # Nothing was counted yet, so only what was held before is locked again.
+                if self.replaced():
+                    return False
+
+                for block in range(first, end):
+                    held = self.blocks.get(block, (0, 0))
+                    self.blocks[block] = (held[0], held[1] + 1) if exclusive else (held[0] + 1, held[1])
+
+                if fresh and refresh:
+                    refresh()
+
+                return True
+
+        self.wait(attempt)
+
+    # Lets go of the blocks that cover a range of bytes.
+    def release(self, offset, size, exclusive):
+        if not fcntl or size <= 0:
+            return
+
+        first = offset // self.BLOCK_SIZE
+        end = (offset + size - 1) // self.BLOCK_SIZE + 1
+
+        with self.mutex:
+            for block in range(first, end):
+                held = self.blocks[block]
+                held = (held[0], held[1] - 1) if exclusive else (held[0] - 1, held[1])
+
+                if held == (0, 0):
+                    del self.blocks[block]
+                else:
+                    self.blocks[block] = held
+
+            # Blocks nobody holds are unlocked, blocks only readers hold go back to shared.
+            for start, count in self.runs(first, end, lambda held: not held[0] and not held[1]):
+                self.setLock(fcntl.LOCK_UN, start, count)
+
+            if exclusive:
+                for start, count in self.runs(first, end, lambda held: held[0] and not held[1]):
+                    self.setLock(fcntl.LOCK_SH, start, count)
+
+    # Opens the image again and takes back every lock, after the image was replaced
+    # or after a file of it was closed, which drops every lock the process had on it.
+    def reopen(self):
+        if not fcntl:
+            return
+
+        with self.mutex:
+            self.close()
+            self.open()
+            self.lost = True
+
+        def attempt():
+            with self.mutex:
+                return self.relock() and not self.replaced()
+
+        self.wait(attempt)
+
+    # Locks a new file that's about to replace the image the same way as the image,
+    # so no other process can lock the image in between. Nobody else has the file yet.
+    def prepare(self, path):
+        if not fcntl:
+            return
+
+        fd = os.open(path, os.O_RDWR)
+
+        with self.mutex:
+            self.dropNext()
+
+            if not self.relock(fd):
+                os.close(fd)
+                raise SlitherIOError("LockFailed", "Unable to lock the disk!")
+
+            self.next_fd = fd
+
+    # Takes the locks over to a new image put in place of the old one.
+    def follow(self):
+        if not fcntl:
+            return
+
+        new = os.stat(self.path)
+        new = (new.st_dev, new.st_ino)
+
+        with self.mutex:
+            if new == self.key:
+                self.dropNext()
+                return
+
+            if self.next_fd is not None:
+                st = os.fstat(self.next_fd)
+
+                if (st.st_dev, st.st_ino) == new:
+                    with LOCKED_IMAGES_LOCK:
+                        if LOCKED_IMAGES.get(self.key) is self:
+                            del LOCKED_IMAGES[self.key]
+
+                        LOCKED_IMAGES[new] = self
+
+                    # The old image is gone from the path, so its locks can go.
+                    os.close(self.fd)
+                    self.fd = self.next_fd
+                    self.key = new
+                    self.next_fd = None
+                    return
+
+        self.reopen()
+
+    # Closes a file from prepare() that didn't replace the image.
+    def dropNext(self):
+        if self.next_fd is not None:
+            os.close(self.next_fd)
+            self.next_fd = None
+
+    # Closing the file lets go of every lock.
+    def close(self):
+        self.dropNext()
+
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+            with LOCKED_IMAGES_LOCK:
+                if LOCKED_IMAGES.get(self.key) is self:
+                    del LOCKED_IMAGES[self.key]
+
+# A caller's own view of a mounted disk, with its own current directory.
+# Threads sharing one FAT12 each use a handle from FAT12.handle(),
+# so changing directory in one thread doesn't move the others.
+class DiskHandle:
+
+    def __init__(self, disk):
+        self.disk = disk
+
+        # Current directory path and the start of its cluster chain.
+        self.path = "./"
+        self.dir_cluster = 0
+
+    # Turns a path relative to the handle's directory into a path from the root.
+    def absolute(self, path):
+        return "/" + "/".join(self.disk.splitPath(path, self.path))
+
+    def goDir(self, sd):
+        found = self.disk.findDir(sd, self.path)
+
+        if found:
+            self.dir_cluster, self.path = found
+
+    def getDir(self, vFAT=True):
+        return self.disk.getDir(vFAT, self.dir_cluster)
+
+    def doesExist(self, entry):
+        return self.disk.doesExist(self.absolute(entry))
+
+    def fileExists(self, file):
+        return self.disk.fileExists(self.absolute(file))
+
+    def dirExists(self, directory):
+        return self.disk.dirExists(self.absolute(directory))
+
+    def open(self, file, mode="rb"):
+        return self.disk.open(self.absolute(file), mode)
+
+    def readFile(self, file):
+        return self.disk.readFile(self.absolute(file))
+
+    def writeFile(self, file, contents, size=None):
+        return self.disk.writeFile(self.absolute(file), contents, size)
+
+    def addFile(self, file, contents, size=None):
+        return self.disk.addFile(self.absolute(file), contents, size)
+
+    def deleteFile(self, file):
+        return self.disk.deleteFile(self.absolute(file))
+
+    def renameFile(self, old_name, new_name):
+
+        # A plain new name stays in the directory of the file.
+        if "/" in new_name or "\\" in new_name:
+            new_name = self.absolute(new_name)
+
+        return self.disk.renameFile(self.absolute(old_name), new_name)
+
+    def makeDir(self, directory):
+        return self.disk.makeDir(self.absolute(directory))
+
+    def setAttributes(self, file, attributes):
+        return self.disk.setAttributes(self.absolute(file), attributes)
+
+    def extract_all(self, dest, path=".", workers=4):
+        return self.disk.extract_all(dest, self.absolute(path), workers)
+
+    def import_tree(self, src, dest="."):
+        return self.disk.import_tree(src, self.absolute(dest))
+
+# The main library of FAT12 functions.
+class FAT12:
+
+    def __init__(self, f=""):
+
+        # A dictionary containing common floppy disk file formats.
+        self.disk_formats = {}
+
+        self.fp = f
+
+        # The mounted disk image and how it was mounted.
+        self.dev = None
+        self.mode = "file"
+        self.readonly = False
+
+        self.FS = "FAT12"
+
+        # Current directory path.
+        self.path = "./"
+
+        # Start of the cluster chain for current directory.
+        self.dir_cluster = 0
+
+        # Decoded 12-bit entries of the FAT and the packed table they came from.
+        self.fat = array("H")
+        self.fat_raw = bytearray()
+
+        # Sectors of the FAT that need to be written back to every FAT copy.
+        self.fat_dirty = set()
+
+        # A map of free clusters (1 is free) and where the next search starts.
+        self.fat_free = bytearray()
+        self.free_clusters = 0
+        self.free_hint = 2
+
+        # Number of clusters in each chain keyed by its first cluster.
+        self.chain_lengths = {}
+
+        # Parsed entries of each directory keyed by the start of its cluster chain.
+        self.dir_cache = {}
+
+        # Every path on the disk, case folded, mapped to its directory's cluster and its entry.
+        # Built when first needed and kept up to date as entries change.
+        self.path_index = None
+
+        # Case folded path of each indexed directory keyed by its cluster.
+        self.dir_paths = {}
+
+        # Where to start looking for free entries in each directory.
+        self.entry_hints = {}
+
+        # A fixed time for new entries, or None for the current time.
+        self.timestamp = None
+
+        # Lets many threads read the disk at once while writers take turns.
+        self.lock = RWLock()
+
+        # Keeps readers from building the path index at the same time.
+        self.index_lock = threading.Lock()
+
+        # How the image is locked against other processes, the lock itself
+        # and the byte ranges the current write has locked.
+        self.locking = "none"
+        self.image_lock = None
+        self.locked_ranges = []
+
+        # Flags for the attributes of a file entry.
+        self.attr_flags = ATTR_FLAGS.copy()
+
+        # A dictionary for the BIOS Parameter Block.
+        self.attr = {
+            "OEM_Label" : "",
+            "Bytes_Per_Sector" : 0,
+            "Sectors_Per_Cluster" : 0,
+            "Reserved_Sectors" : 0,
+            "FATs" : 0,
+            "Dir_Entries" : 0,
+            "Logical_Sectors" : 0,
+            "Media_ID" : 0,
+            "Sectors_Per_FAT" : 0,
+            "Sectors_Per_Track" : 0,
+            "Sides": 0,
+            "Hidden_Sectors": 0,
+            "LBA_Sectors": 0,
+            "Drive_Number": 0,
+            "Windows_NT_Flag": 0,
+            "Signature": 0,
+            "Volume_ID": 0,
+            "Volume_Label": "",
+            "Identifier": ""}
+
+        self.get_disk_formats()
+
+    #######################
+    # INTERNAL FUNCTIONS
+    #######################
+
+    # Returns the offset of the Root Directory.
+    def _root_offset(self):
+        return (self.attr["Reserved_Sectors"]+self.attr["Sectors_Per_FAT"]*self.attr["FATs"])*self.attr["Bytes_Per_Sector"]
+
+    # Seeks a free entry.
+    # Deprecated. Use findFreeEntry()
+    def _seek_free(self, file, n=1):
+        return self.findFreeEntry(n)
+
+    #######################
+    # MAIN FUNCTIONS
+    #######################
+
+    # Get a list of disk formats from formats.ini
+    # The file is only parsed again when it changes.
+    def get_disk_formats(self):
+        self.disk_formats.update(loadFormats())
+
+    # Mounts a disk image. The mode is "file", "mmap" or "memory".
+    # A memory mount keeps every change in memory until commit() or unmount().
+    # The image is locked against other processes, shared for a read-only mount
+    # and exclusive otherwise. The locking is "whole" for the whole image while mounted,
+    # "range" for only the parts each call uses or "none". Waiting for another
+    # process gives up with LockTimeout after the timeout, or never if it's None.
+    @writeLocked
+    def mount(self, file="", mode="file", readonly=False, locking="whole", timeout=LOCK_TIMEOUT):
+        if file:
+            self.fp = file
+        else:
+            file = self.fp
+
+        if mode not in DEVICES:
+            raise SlitherIOError("ModeDoesNotExist", "The mount mode doesn't exist!")
+
+        if locking not in LOCK_MODES:
+            raise SlitherIOError("LockModeDoesNotExist", "The lock mode doesn't exist!")
+
+        # A memory mount only writes to the image on commit.
+        if locking == "range" and mode == "memory":
+            raise SlitherIOError("BadLockMode", "Byte range locks need a file or mmap mount!")
+
+        if os.path.exists(file):
+            image_lock = None
+
+            # Lock the image before reading any of it.
+            if locking != "none":
+                image_lock = ImageLock(file, not readonly, timeout)
+
+            self.image_lock = image_lock
+            self.locked_ranges = []
+
+            # A disk that can't be mounted mustn't stay locked or open.
+            try:
+                if locking == "whole":
+                    image_lock.lockWhole(not readonly)
+
+                self.dev = DEVICES[mode](file, readonly)
+                self.mode = mode
+                self.readonly = readonly
+                self.locking = locking
+
+                self.loadBPB()
+
+                # Keep the FAT in memory while mounted.
+                self.loadFAT()
+                self.dir_cache = {}
+                self.path_index = None
+                self.entry_hints = {}
+
+            except BaseException:
+                self.closeMount()
+                raise
+
+            return True
+
+        return False
+
+    # Reads the BPB and EBPB of the mounted disk.
+    def loadBPB(self):
+
+        boot = io.BytesIO(self.dev.read(0, 62))
+        boot.seek(3)
+
+        # BPB
+        self.attr["OEM_Label"] = boot.read(8).decode(encoding="ascii").rstrip()
+        self.attr["Bytes_Per_Sector"] = int.from_bytes(boot.read(2), "little")
+        self.attr["Sectors_Per_Cluster"] = int.from_bytes(boot.read(1), "little")
+        self.attr["Reserved_Sectors"] = int.from_bytes(boot.read(2), "little")
+        self.attr["FATs"] = int.from_bytes(boot.read(1), "little")
+        self.attr["Dir_Entries"] = int.from_bytes(boot.read(2), "little")
+        self.attr["Logical_Sectors"] = int.from_bytes(boot.read(2), "little")
+        self.attr["Media_ID"] = int.from_bytes(boot.read(1), "little")
+        self.attr["Sectors_Per_FAT"] = int.from_bytes(boot.read(2), "little")
+        self.attr["Sectors_Per_Track"] = int.from_bytes(boot.read(2), "little")
+        self.attr["Sides"] = int.from_bytes(boot.read(2), "little")
+        self.attr["Hidden_Sectors"] = int.from_bytes(boot.read(4), "little")
+        self.attr["LBA_Sectors"] = int.from_bytes(boot.read(4), "little")
+
+        # EPBP
+        self.attr["Drive_Number"] = int.from_bytes(boot.read(1), "little")
+        self.attr["Windows_NT_Flag"] = int.from_bytes(boot.read(1), "little")
+        self.attr["Signature"] = int.from_bytes(boot.read(1), "little")
+        self.attr["Volume_ID"] = int.from_bytes(boot.read(4), "little")
+        self.attr["Volume_Label"] = boot.read(11).decode(encoding="ascii").rstrip()
+        self.attr["Identifier"] = boot.read(8).decode(encoding="ascii").rstrip()
+
+    @writeLocked
+    def unmount(self):
+        if self.dev:
+            if self.inBatch():
+                self.commitBatch()
+
+            self.commit()
+            self.closeMount()
+
+            return True
+
+        return False
+
+    # Closes the disk and lets go of its lock without writing anything out.
+    def closeMount(self):
+        if self.dev:
+            self.dev.close()
+
+        if self.image_lock:
+            self.image_lock.close()
+
+        self.dev = None
+        self.dir_cache = {}
+        self.path_index = None
+        self.entry_hints = {}
+
+        self.locking = "none"
+        self.image_lock = None
+        self.locked_ranges = []
+
+    # Writes any pending changes out to the disk.
+    @writeLocked
+    def flush(self):
+        if self.dev:
+            self.flushFAT()
+            self.dev.flush()
+
+    # Writes any pending changes out to the disk image.
+    # A memory mount is written to a new file that replaces the image,
+    # or with inplace, only the changed blocks are written over the image.
+    @writeLocked
+    def commit(self, inplace=False):
+        if self.dev:
+            self.flushFAT()
+
+            # A memory mount can replace the image, which has to be locked before it's in place.
+            if self.image_lock:
+                self.dev.commit(inplace, self.image_lock.prepare)
+                self.image_lock.follow()
+            else:
+                self.dev.commit(inplace)
+
+    # Returns a new handle with its own current directory, for one caller of a shared disk.
+    def handle(self):
+        return DiskHandle(self)
+
+    # Returns the size of the boot sector, the FATs and the root directory,
+    # which byte range locks lock as one.
+    def getMetadataSize(self):
+        return self.getFirstDataSector() * self.attr["Bytes_Per_Sector"]
+
+    # Locks the disk's metadata against other processes. Another process may have
+    # changed the disk since this one last held the lock, so the FAT is loaded again
+    # and the cached directories are forgotten whenever the lock is newly taken.
+    # A read-only mount only ever takes shared locks, since it can't change the disk
+    # and fcntl can't lock a file opened read-only for writing.
+    def lockMetadata(self, exclusive):
+        if self.image_lock:
+            self.image_lock.acquire(0, self.getMetadataSize(), exclusive and self.image_lock.writable,
+                                    self.reloadMetadata)
+
+    # Lets go of the disk's metadata, and after a write, the clusters it locked.
+    def unlockMetadata(self, exclusive):
+        if not self.image_lock:
+            return
+
+        exclusive = exclusive and self.image_lock.writable
+
+        if exclusive:
+
+            # Changes to the FAT have to be on the disk before other processes can see it.
+            self.flushFAT()
+
+            for offset, size in self.locked_ranges:
+                self.image_lock.release(offset, size, True)
+
+            self.locked_ranges = []
+
+        self.image_lock.release(0, self.getMetadataSize(), exclusive)
+
+    # Loads the FAT again and forgets everything read from the directories.
+    # Changes to the FAT that haven't been flushed yet, such as from calling
+    # makeChain() or setChain() directly, are kept instead of being loaded over.
+    def reloadMetadata(self):
+
+        # Another process may have replaced the image while nothing of it was locked.
+        if self.locking == "range" and self.dev.getKey() != self.image_lock.key:
+            self.dev.reopen()
+            self.loadBPB()
+
+        if not self.fat_dirty:
+            self.loadFAT()
+
+        self.dir_cache = {}
+        self.path_index = None
+        self.entry_hints = {}
+
+    # Locks a range of the data area against other processes until the write is done.
+    # Only byte range locks need it, a whole image lock already covers everything.
+    def lockData(self, offset, size):
+        if self.locking == "range":
+            self.image_lock.acquire(offset, size, True)
+            self.locked_ranges.append((offset, size))
+
+    # Check to see if we're mounted.
+    def isMounted(self):
+        if self.dev:
+            return True
+        else:
+            return False
+
+    # Check to see if changes are being batched.
+    def inBatch(self):
+        return isinstance(self.dev, BatchDevice)
+
+    # Starts staging changes in memory until commitBatch. File data written
+    # to free clusters goes straight to the disk, as nothing points to it yet.
+    @writeLocked
+    def beginBatch(self):
+        # Make sure the disk is mounted first!
+        if not self.isMounted():
+            raise SlitherIOError("NotMounted", "No disk mounted!")
+
+        if self.inBatch():
+            raise SlitherIOError("BatchInProgress", "A batch is already in progress!")
+
+        # Make sure the disk can be written to.
+        self.dev.checkWritable()
+
+        # Anything from before the batch goes out first.
+        self.flush()
+        self.dev = BatchDevice(self.dev, self.getClusterOffset(2), self.getClusterSize(), bytes(self.fat_free))
+
+        # Other processes have to wait for the whole batch.
+        if self.locking == "range":
+            self.lockMetadata(True)
+
+    # Writes all of the staged changes to the disk at once.
+    @writeLocked
+    def commitBatch(self):
+        if not self.inBatch():
+            raise SlitherIOError("NoBatch", "No batch in progress!")
+
+        self.flushFAT()
+
+        if self.locking == "range":
+            self.lockData(self.getClusterOffset(2), self.getClusterCount() * self.getClusterSize())
+
+        batch = self.dev
+        self.dev = batch.dev
+        batch.apply()
+
+        if self.locking == "range":
+            self.image_lock.release(0, self.getMetadataSize(), True)
+
+    # Throws away all of the staged changes.
+    @writeLocked
+    def abortBatch(self):
+        if not self.inBatch():
+            raise SlitherIOError("NoBatch", "No batch in progress!")
+
+        self.dev = self.dev.dev
+
+        if self.locking == "range":
+            self.image_lock.release(0, self.getMetadataSize(), True)
+
+        # Go back to the FAT and directories on the disk.
+        self.reloadMetadata()
+
+    # Groups changes so they're written to the disk once at the end.
+    # If anything goes wrong, none of the changes are written.
+    @contextlib.contextmanager
+    def batch(self):
+        self.beginBatch()
+
+        try:
+            yield self
+
+        except BaseException:
+            self.abortBatch()
+            raise
+
+        self.commitBatch()
+
+    def getDirSector(self):
+        return (self.attr["Dir_Entries"] *32) // self.attr["Bytes_Per_Sector"]
+
+    def getFirstDataSector(self):
+        return self.attr["Reserved_Sectors"]+self.attr["Sectors_Per_FAT"]*self.attr["FATs"] + self.getDirSector()
+
+    # Returns the number of bytes in a cluster.
+    def getClusterSize(self):
+        return self.attr["Sectors_Per_Cluster"] * self.attr["Bytes_Per_Sector"]
+
+    # Returns the number of clusters in the data area.
+    def getClusterCount(self):
+        if not self.attr["Sectors_Per_Cluster"]:
+            return 0
+
+        return (self.attr["Logical_Sectors"] - self.getFirstDataSector()) // self.attr["Sectors_Per_Cluster"]
+
+    # Builds the boot sector, the FATs and an empty root directory for a format.
+    def buildHeader(self, attr):
+
+        bps = attr["Bytes_Per_Sector"]
+
+        contents = bytearray((attr["Reserved_Sectors"] + attr["Sectors_Per_FAT"]*attr["FATs"])*bps +
+                             attr["Dir_Entries"]*32)
+
+        # BPB and EBPB
+        BOOT_SECTOR.pack_into(contents, 0,
+                              b"\xEB\x3C\x90",
+                              bytes(attr["OEM_Label"][:8].ljust(8), "ascii"),
+                              attr["Bytes_Per_Sector"],
+                              attr["Sectors_Per_Cluster"],
+                              attr["Reserved_Sectors"],
+                              attr["FATs"],
+                              attr["Dir_Entries"],
+                              attr["Logical_Sectors"],
+                              attr["Media_ID"],
+                              attr["Sectors_Per_FAT"],
+                              attr["Sectors_Per_Track"],
+                              attr["Sides"],
+                              attr["Hidden_Sectors"],
+                              attr["LBA_Sectors"],
+                              attr["Drive_Number"],
+                              attr["Windows_NT_Flag"],
+                              attr["Signature"],
+                              attr["Volume_ID"],
+                              bytes(attr["Volume_Label"][:11].ljust(11), "ascii"),
+                              bytes(attr["Identifier"][:8].ljust(8), "ascii"))
+
+        # FAT ID
+        for i in range(attr["FATs"]):
+            fat_start = (attr["Reserved_Sectors"]+attr["Sectors_Per_FAT"]*i)*bps
+            contents[fat_start:fat_start+3] = b"\xF0\xFF\xFF"
+
+        return contents
+
+    # Formats the disk. A sparse disk leaves the data area as a hole in the file.
+    @writeLocked
+    def formatDisk(self, style, sparse=False):
+        # Make sure the disk is mounted first!
+        if not self.isMounted():
+            raise SlitherIOError("NotMounted", "No disk mounted!")
+
+        # Make sure the format style exists.
+        if style not in self.disk_formats:
+            raise SlitherIOError("FormatDoesNotExist", "The format doesn't exist!")
+
+        # Make sure the disk can be written to.
+        self.dev.checkWritable()
+
+        # A batch has to be finished before formatting.
+        if self.inBatch():
+            raise SlitherIOError("BatchInProgress", "Can't format the disk during a batch!")
+
+        self.attr = self.disk_formats[style].copy()
+
+        # Number of logical sectors multiplied by bytes per sector.
+        self.dev.reset(self.buildHeader(self.attr),
+                       self.attr["Logical_Sectors"] * self.attr["Bytes_Per_Sector"],
+                       sparse)
+
+        # Reload the freshly formatted FAT.
+        self.loadFAT()
+        self.dir_cache = {}
+        self.path_index = None
+        self.entry_hints = {}
+
+    # Returns the path of a formatted template disk for a format style.
+    # Templates are made once and kept in the template directory,
+    # named after a hash of every parameter of the format.
+    def getTemplate(self, style, template_dir=TEMPLATE_DIR):
+
+        # Make sure the format style exists.
+        if style not in self.disk_formats:
+            raise SlitherIOError("FormatDoesNotExist", "The format doesn't exist!")
+
+        attr = self.disk_formats[style]
+
+        key = hashlib.sha1(repr(sorted(attr.items())).encode("utf-8")).hexdigest()
+        template = os.path.join(template_dir, "{}.img".format(key))
+
+        if not os.path.exists(template):
+            os.makedirs(template_dir, exist_ok=True)
+
+            # Build it under a temporary name so nobody clones half a template.
+            fd, temp = tempfile.mkstemp(prefix=".slither-", dir=template_dir)
+
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    contents = self.buildHeader(attr)
+                    f.write(contents)
+                    f.write(bytes(attr["Logical_Sectors"] * attr["Bytes_Per_Sector"] - len(contents)))
+
+                os.replace(temp, template)
+
+            except BaseException:
+                if os.path.exists(temp):
+                    os.remove(temp)
+                raise
+
+        return template
+
+    # Formats the disk by cloning a template disk, then sets the volume label and ID.
+    @writeLocked
+    def cloneDisk(self, style, volume_label=None, volume_id=None, template_dir=TEMPLATE_DIR):
+        # Make sure the disk is mounted first!
+        if not self.isMounted():
+            raise SlitherIOError("NotMounted", "No disk mounted!")
+
+        # Make sure the disk can be written to.
+        self.dev.checkWritable()
+
+        # A batch has to be finished before formatting.
+        if self.inBatch():
+            raise SlitherIOError("BatchInProgress", "Can't format the disk during a batch!")
+
+        template = self.getTemplate(style, template_dir)
+
+        # A memory mount takes the template's contents, everything else gets a copy of the file.
+        if self.mode == "memory":
+            with open(template, "rb") as f:
+                contents = f.read()
+
+            self.dev.reset(contents, len(contents))
+
+        else:
+            self.dev.close()
+            self.dev = None
+
+            copyImage(template, self.fp)
+            self.dev = DEVICES[self.mode](self.fp, self.readonly)
+
+            # Closing the image dropped its locks.
+            if self.image_lock:
+                self.image_lock.reopen()
+
+        self.attr = self.disk_formats[style].copy()
+
+        # Reload the freshly cloned FAT.
+        self.loadFAT()
+        self.dir_cache = {}
+        self.path_index = None
+        self.entry_hints = {}
+
+        self.setVolume(volume_label, volume_id)
+
+    # Sets the volume label and/or the volume ID in the EBPB.
+    @writeLocked
+    def setVolume(self, volume_label=None, volume_id=None):
+        # Make sure the disk is mounted first!
+        if not self.isMounted():
+            raise SlitherIOError("NotMounted", "No disk mounted!")
+
+        # Make sure the disk can be written to.
+        self.dev.checkWritable()
+
+        if volume_id is not None:
+            self.dev.write(39, volume_id.to_bytes(4, "little"))
+            self.attr["Volume_ID"] = volume_id
+
+        if volume_label is not None:
+            self.dev.write(43, bytes(volume_label[:11].ljust(11), "ascii"))
+            self.attr["Volume_Label"] = volume_label[:11].rstrip()
+
+        self.flush()
+
+    # Builds a whole disk image in memory from a host directory and/or a manifest,
+    # then writes it out in one go. The same inputs always give the same image,
+    # since every entry gets a fixed timestamp and everything is added in order.
+    #
+    # A manifest is an ini file. Its [image] section can hold the format, a boot
+    # sector file, a volume_label, a volume_id, a timestamp and a tree to import.
+    # Every other section is a path on the disk, with the host file to copy as
+    # source (or directory = yes), attributes such as READ_ONLY HIDDEN and a timestamp.
+    # Host paths are relative to the manifest.
+    @writeLocked
+    def buildImage(self, path, style=None, tree=None, manifest=None, timestamp=BUILD_TIMESTAMP):
+
+        if self.isMounted():
+            raise SlitherIOError("AlreadyMounted", "A disk is already mounted!")
+
+        image = {}
+        entries = []
+        base = ""
+
+        if manifest:
+            image, entries = self.loadManifest(manifest)
+            base = os.path.dirname(os.path.abspath(manifest))
+
+        style = style or image.get("format")
+
+        if not style:
+            raise SlitherIOError("FormatDoesNotExist", "The format doesn't exist!")
+
+        if "timestamp" in image:
+            timestamp = datetime.datetime.fromisoformat(image["timestamp"])
+
+        if not tree and "tree" in image:
+            tree = os.path.join(base, image["tree"])
+
+        # Build the image in a memory mount of an empty file next to the image.
+        fd, temp = tempfile.mkstemp(prefix=".slither-", dir=os.path.dirname(os.path.abspath(path)))
+        os.close(fd)
+
+        try:
+            self.mount(temp, "memory")
+            self.timestamp = timestamp
+
+            self.formatDisk(style)
+
+            if "boot" in image:
+                with open(os.path.join(base, image["boot"]), "rb") as f:
+                    self.addBootloader("", f.read())
+
+                # The boot sector can carry its own BPB.
+                self.loadBPB()
+                self.loadFAT()
+
+            if "volume_label" in image or "volume_id" in image:
+                self.setVolume(image.get("volume_label"),
+                               int(image["volume_id"], 0) if "volume_id" in image else None)
+
+            if tree:
+                self.import_tree(tree)
+
+            for disk_path, settings in entries:
+                self.timestamp = (datetime.datetime.fromisoformat(settings["timestamp"])
+                                  if "timestamp" in settings else timestamp)
+
+                # Make any directories on the way.
+                parts = self.splitPath("/" + disk_path)
+                for i in range(1, len(parts)):
+                    if not self.dirExists("/" + "/".join(parts[:i])):
+                        self.makeDir("/" + "/".join(parts[:i]))
+
+                if settings.get("directory", "no").lower() in ("yes", "true", "1"):
+                    if not self.dirExists("/" + disk_path):
+                        self.makeDir("/" + disk_path)
+
+                elif "source" in settings:
+                    with open(os.path.join(base, settings["source"]), "rb") as f:
+                        self.writeFile("/" + disk_path, f, os.fstat(f.fileno()).st_size)
+
+                else:
+                    self.writeFile("/" + disk_path, b"")
+
+                if "attributes" in settings:
+                    attributes = 0
+                    for i in settings["attributes"].replace(",", " ").split():
+                        if i.upper() not in self.attr_flags:
+                            raise SlitherIOError("BadAttribute", "The attribute doesn't exist!")
+                        attributes |= self.attr_flags[i.upper()]
+
+                    self.setAttributes("/" + disk_path, attributes)
+
+            # Write the whole image out.
+            self.unmount()
+
+            # A new image gets the usual permissions instead of those of a temporary file.
+            if os.path.exists(path):
+                os.chmod(temp, os.stat(path).st_mode & 0o7777)
+            else:
+                os.chmod(temp, 0o644)
+
+            os.replace(temp, path)
+
+        except BaseException:
+            self.closeMount()
+
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+
+        finally:
+            self.timestamp = None
+
+        return True
+
+    # Reads a manifest for buildImage and returns the [image] settings
+    # and a sorted list of the disk paths with their settings.
+    def loadManifest(self, manifest):
+
+        config = configparser.ConfigParser(interpolation=None)
+
+        if not config.read(manifest):
+            raise SlitherIOError("ManifestDoesNotExist", "The manifest doesn't exist!")
+
+        image = dict(config["image"]) if config.has_section("image") else {}
+
+        entries = sorted((i.replace("\\", "/").strip("/"), dict(config[i])) for i in config.sections() if i != "image")
+
+        return image, entries
+
+    ############################
+    # ENTRY NAME FUNCTIONS
+    ############################
+
+    # Takes a file name and returns the appropriate type.
+    def toFN(self, name):
+        if self.isSFN(name):
+            return self.toSFN(name)
+        else:
+            return self.toLFN(name)
+
+    # Takes a file name and returns the appropriate type in bytes.
+    def toFNb(self, name):
+        if self.isSFN(name):
+            return self.toSFNb(name)
+        else:
+            return self.toLFNb(name)
+
+    # Checks to see if this is a valid short name.
+    def isSFN(self, name):
+
+        # Make sure there's an actual name.
+        if len(name) == 0:
+            return False
+
+        # Split the file name into a name and extension.
+        dot = name.rfind(".")
+
+        if dot != -1:
+            s_name = name[:dot]
+            s_ext = name[dot+1:]
+        else:
+            s_name = name
+            s_ext = ""
+
+        # Make sure the name and extension are within size limits.
+        if len(s_name) > 8 or len(s_ext) > 3:
+            return False
+
+        # Make sure the name and extension have legal characters.
+        for i in s_name+s_ext:
+            if not self.legalSFNchar(i):
+                return False
+
+        return True
+
+    # Checks to see if this is a valid long name.
+    # TODO
+    def isLFN(self, name):
+        pass
+
+
+    # Turns file name into a SFN entry.
+    def toSFN(self, name):
+        if self.isSFN(name):
+            return name.split(".")[0][:8].ljust(8) + name.split(".")[1][:3].ljust(3)
+        else:
+            return False
+
+    # Return a SFN in bytes.
+    def toSFNb(self, name):
+        r = self.toSFN(name)
+        if r:
+            # Split the file name into a name and extension.
+            if "." in name:
+                s_name, s_ext = name.split(".")
+            else:
+                s_name = name
+                s_ext = ""
+            return bytes(s_name.ljust(8)+s_ext.ljust(3), "cp437")
+
+        return False
+
+    # Turns file name into a tuple of each LFN entry.
+    def toLFN(self, name):
+        return tuple([name[i:i+13] for i in range(0, len(name), 13)][::-1])
+
+    # Return a SFN in bytes.
+    def toLFNb(self, name):
+        r = self.toLFN(name+"\uFFFF")
+        if r:
+            return tuple([bytes(r[i].ljust(13, "\u0000") , "utf-16-le") for i in range(len(r))])
+        else:
+            return False
+
+        return r
+
+    # Creates a new duplicated SFN for a directory, the current one by default.
+    def dupSFN(self, name, cluster=None):
+        if cluster is None:
+            cluster = self.dir_cluster
+
+        # Make sure this is a valid SFN.
+        if not self.isSFN(name):
+            return False
+
+        # Check the path index for the names if it covers this directory.
+        if self.path_index is not None and cluster in self.dir_paths:
+            prefix = self.dir_paths[cluster] + "/" if cluster else ""
+
+            def taken(i):
+                return prefix + i.casefold() in self.path_index
+
+        # Otherwise get a list of SFN in the directory.
+        else:
+            e = self.getDir(cluster=cluster)
+            taken = {e[i]["SHORT_FILE_NAME"] for i in e}.__contains__
+
+        # Make sure this file does exist, otherwise just give back the orignal SFN!
+        if not taken(name):
+            return name
+
+        # Split the file name into a name and extension.
+        if "." in name:
+            s_name, s_ext = name.split(".")
+        else:
+            s_name = name
+            s_ext = ""
+
+        for i in range(1000):
+            new_name = "{}~{}.{}".format(s_name[:7-len(str(i))], i, s_ext)
+            if not taken(new_name):
+                return new_name
+
+
+    # Makes a SFN from a LFN.
+    def makeSFN(self, name):
+
+        # Lowercase letters aren't allowed in SFN.
+        name = name.upper()
+
+        # See if there's a file extension.
+        dot = name.rfind(".")
+
+        if dot != -1:
+            s_name = name[:dot]
+            s_ext = name[dot+1:]
+            dot = "."
+        else:
+            s_name = name
+            s_ext = ""
+            dot = ""
+
+        # New SFN holder.
+        new_name = ""
+        new_ext = ""
+
+        # Convert illegal characters in the file name.
+        for i in s_name:
+            if self.legalSFNchar(i):
+                new_name = new_name + i
+            else:
+                new_name = new_name + "~"
+
+        # Convert illegal characters in the file extension.
+        for i in s_ext:
+            if self.legalSFNchar(i):
+                new_ext = new_ext + i
+            else:
+                new_ext = new_ext + "~"
+
+        # Split file name holders.
+        f_name = ""
+        l_name = ""
+
+        if len(new_name) <= 8:
+            f_name = new_name
+        else:
+            f_name = new_name[:4]
+            l_name = new_name[-4:]
+
+        return "{}{}{}{}".format(f_name, l_name, dot, new_ext[:3])
+
+
+    # Creates a fake SFN for a LFN.
+    def fakeSFN(self, name, cluster=None):
+        return self.dupSFN(self.makeSFN(name), cluster)
+
+    # Returns True if the character is allowed in a SFN, otherwise it returns false.
+    def legalSFNchar(self, char):
+        if ord(char) in (0x20, 0x21, 0x2D, 0x40, 0x7B, 0x7D, 0x7E) or 0x23 <= ord(char) <= 0x29 or 0x30 <= ord(char) <= 0x39 or 0x41 <= ord(char) <= 0x5A or 0x5E <= ord(char) <= 0x60 or 0x80 <= ord(char) <= 0xFF:
+            return True
+        else:
+            return False
+
+    # Generate a checksum for a LFN from a SFN.
+    def gensumLFN(self, name):
+
+        # Create a new checksum to verify with the current checksum.
+        ns = 0
+
+        for i in name:
+            ns = (((ns & 1) << 7) + (ns >> 1) + ord(i)) & 0xFF
+
+        return ns
+
+    # Make sure the checksum for the LFN match the SFN.
+    def checksumLFN(self, name, cs):
+        return self.gensumLFN(name) == cs
+
+    # Splits a LFN into SFN entries.
+    def splitLFN(self, name):
+
+        # List of LFN parts.
+        LFNS = []
+
+        # Add a null character.
+        name += "\u0000"
+
+        while name:
+            LFNS.append(name[:13].ljust(13, "\uFFFF"))
+            name = name[13:]
+
+        return tuple(LFNS[::-1])
+
+    ############################
+    # ENTRY EXISTS FUNCTIONS
+    ############################
+
+    # Checks to see if that entry exists. Names and paths ignore case.
+    @readLocked
+    def doesExist(self, entry):
+
+        if self.lookupPath(entry):
+            return True
+
+        return False
+
+    # Checks to see if a file exists.
+    @readLocked
+    def fileExists(self, file):
+
+        found = self.lookupPath(file)
+        if found and found[1]["IS_FILE"]:
+            return True
+
+        return False
+
+    # Checks to see if a directory exists.
+    @readLocked
+    def dirExists(self, directory):
+
+        # The root directory is always there.
+        if not self.splitPath(directory):
+            return True
+
+        found = self.lookupPath(directory)
+        if found and found[1]["IS_DIRECTORY"]:
+            return True
+
+        return False
+
+    ############################
+    # TIME & DATE FUNCTIONS
+    ############################
+
+    # Returns the time in FAT format.
+    def getTime(self):
+        now = self.timestamp or datetime.datetime.now()
+        return int((now.hour << 11) + (now.minute << 5) + (now.second // 2)).to_bytes(2, "little")
+
+    # Returns the date in FAT format.
+    def getDate(self):
+        now = self.timestamp or datetime.datetime.now()
+        return int(((now.year - 1980) << 9) + (now.month << 5) + now.day).to_bytes(2, "little")
+
+
+    ############################
+    # FAT TABLE FUNCTIONS
+    ############################
+
+    # Loads the first FAT and decodes it into a table of 12-bit entries.
+    def loadFAT(self):
+
+        # Read the whole packed FAT in one go.
+        self.fat_raw = bytearray(self.dev.read(self.attr["Reserved_Sectors"]*self.attr["Bytes_Per_Sector"],
+                                               self.attr["Sectors_Per_FAT"]*self.attr["Bytes_Per_Sector"]))
+        self.fat_dirty = set()
+
+        # Decode the whole table at once.
+        self.fat = fatcodec.unpack(self.fat_raw)
+
+        self.loadFreeMap()
+
+    # Builds the map of free clusters from the FAT.
+    def loadFreeMap(self):
+
+        # Only clusters 2 up to the end of the data area can be handed out.
+        last_cluster = min(self.getClusterCount() + 2, len(self.fat))
+
+        self.fat_free = fatcodec.freeMap(self.fat, 2, last_cluster)
+
+        self.free_clusters = self.fat_free.count(1)
+        self.free_hint = 2
+
+        self.chain_lengths = {}
+
+    # Changes an entry in the FAT and marks its sector(s) as dirty.
+    def setFAT(self, cluster, value):
+
+        fat_offset = cluster * 3 // 2
+
+        # Adjust the 12-bit cluster appropriately while preserving the 4 bit part of the neighboring cluster.
+        if cluster & 1:
+            self.fat_raw[fat_offset] = (self.fat_raw[fat_offset] & 0x0F) + ((value << 4) & 0xF0)
+            self.fat_raw[fat_offset+1] = (value >> 4) & 0xFF
+        else:
+            self.fat_raw[fat_offset] = value & 0xFF
+            self.fat_raw[fat_offset+1] = (self.fat_raw[fat_offset+1] & 0xF0) + ((value >> 8) & 0x0F)
+
+        # Keep the free cluster map up to date.
+        if self.fat[cluster] and not value:
+            self.fat_free[cluster] = 1
+            self.free_clusters += 1
+        elif value and not self.fat[cluster]:
+            self.fat_free[cluster] = 0
+            self.free_clusters -= 1
+
+        self.fat[cluster] = value
+
+        # Chain lengths may have changed.
+        if self.chain_lengths:
+            self.chain_lengths = {}
+
+        # An entry can straddle two sectors.
+        self.fat_dirty.add(fat_offset // self.attr["Bytes_Per_Sector"])
+        self.fat_dirty.add((fat_offset+1) // self.attr["Bytes_Per_Sector"])
+
+    # Writes the dirty sectors of the FAT to every FAT copy.
+    def flushFAT(self):
+
+        if not self.fat_dirty:
+            return
+
+        bps = self.attr["Bytes_Per_Sector"]
+
+        # Merge neighboring dirty sectors into runs.
+        runs = []
+        for i in sorted(self.fat_dirty):
+            if runs and runs[-1][1] == i:
+                runs[-1][1] = i + 1
+            else:
+                runs.append([i, i + 1])
+
+        for i in range(self.attr["FATs"]):
+            fat_start = (self.attr["Reserved_Sectors"]+self.attr["Sectors_Per_FAT"]*i)*bps
+
+            for start, end in runs:
+                self.dev.write(fat_start + start*bps, self.fat_raw[start*bps:end*bps])
+
+        self.fat_dirty = set()
+
+    ############################
+    # CLUSTER CHAIN FUNCTIONS
+    ############################
+
+    # Returns a tuple of a cluster chain.
+    def getChain(self, cluster):
+
+        cc = [cluster]
+
+        while cluster and (cluster < 0xFF0):
+
+            cluster = self.nextChain(cluster)
+            cc.append(cluster)
+
+        return tuple(cc)
+
+    # Returns the number of clusters in a cluster chain.
+    def chainLength(self, cluster):
+
+        if cluster in self.chain_lengths:
+            return self.chain_lengths[cluster]
+
+        start = cluster
+        length = 0
+
+        # Stop at the end of the FAT in case the chain loops.
+        while cluster and (cluster < 0xFF0) and length < len(self.fat):
+            cluster = self.nextChain(cluster)
+            length += 1
+
+        self.chain_lengths[start] = length
+
+        return length
+
+    # Loads the content of a cluster chain.
+    def readChain(self, cluster):
+
+        # Read cluster data, leaving out the end of the chain.
+        return bytes(self.readClusters([i for i in self.getChain(cluster) if 2 <= i < 0xFF0]))
+
+    # Adds cluster(s) to the cluster chain.
+    # Returns a list of the new clusters.
+    def growChain(self, cluster, clusters):
+
+        # There's no chain yet.
+        if not cluster:
+            return self.makeChain(clusters)
+
+        # Find the end of the chain.
+        while 2 <= self.nextChain(cluster) < 0xFF0:
+            cluster = self.nextChain(cluster)
+
+        # Try to carry on right after the last cluster.
+        cluster_chain = self.makeChain(clusters, cluster + 1)
+
+        if cluster_chain:
+            self.setFAT(cluster, cluster_chain[0])
+
+        return cluster_chain
+
+    # Removes cluster(s) from the end of the cluster chain.
+    def shrinkChain(self, cluster, clusters):
+        return self.setChain(cluster, max(self.chainLength(cluster) - clusters, 0))
+
+    # Grows or shrinks the cluster chain based on number of clusters needed.
+    # Returns the start of the chain, which is 0 if the chain is gone.
+    def setChain(self, cluster, clusters):
+
+        length = self.chainLength(cluster)
+
+        if clusters > length:
+            cluster_chain = self.growChain(cluster, clusters - length)
+
+            if not cluster:
+                cluster = cluster_chain[0]
+
+        elif not clusters:
+            self.deleteChain(cluster)
+            cluster = 0
+
+        elif clusters < length:
+
+            # Find the new last cluster.
+            last_cluster = cluster
+            for i in range(clusters - 1):
+                last_cluster = self.nextChain(last_cluster)
+
+            # Cut the chain off after it.
+            next_cluster = self.nextChain(last_cluster)
+            self.setFAT(last_cluster, 0xFFF)
+            self.deleteChain(next_cluster)
+
+        return cluster
+
+    # Completely removes the cluster chain.
+    def deleteChain(self, cluster):
+
+        while cluster and (cluster < 0xFF0):
+
+            # Free the current cluster after finding the next one.
+            next_cluster = self.nextChain(cluster)
+            self.setFAT(cluster, 0)
+            cluster = next_cluster
+
+    # Finds free clusters, in one contiguous run if possible.
+    # Returns a list of clusters without claiming them.
+    def findFreeClusters(self, clusters, start=0):
+
+        if clusters > self.free_clusters:
+            raise SlitherIOError("DiskFull", "Not enough free space on the disk!")
+
+        if not clusters:
+            return []
+
+        # Search from the hint first, then from the start of the data area.
+        if not start:
+            start = self.free_hint
+
+        run = b"\x01" * clusters
+
+        cluster = self.fat_free.find(run, start)
+
+        if cluster == -1:
+            cluster = self.fat_free.find(run, 2)
+
+        if cluster != -1:
+            return list(range(cluster, cluster + clusters))
+
+        # Settle for the first free clusters.
+        cluster_chain = []
+        cluster = 2
+
+        while len(cluster_chain) < clusters:
+            cluster = self.fat_free.find(1, cluster)
+            cluster_chain.append(cluster)
+            cluster += 1
+
+        return cluster_chain
+
+    # Creates a cluster chain, searching from the start cluster if one is given.
+    def makeChain(self, clusters, start=0):
+
+        cluster_chain = self.findFreeClusters(clusters, start)
+
+        last_cluster = 0
+
+        for cluster in cluster_chain+[0xFFF]:
+
+            # Link the last cluster to the current cluster.
+            if last_cluster:
+                self.setFAT(last_cluster, cluster)
+
+            last_cluster = cluster
+
+        # Start the next search past this chain.
+        if cluster_chain:
+            self.free_hint = cluster_chain[-1] + 1
+
+        return cluster_chain
+
+    # Finds the next cluster in the chain.
+    def nextChain(self, cluster):
+
+        # Anything past the end of the FAT ends the chain.
+        if cluster >= len(self.fat):
+            return 0xFFF
+
+        return self.fat[cluster]
+
+    # Returns the byte offset of a cluster on the disk.
+    def getClusterOffset(self, cluster):
+        return ((cluster-2) * self.attr["Sectors_Per_Cluster"] + self.getFirstDataSector()) * self.attr["Bytes_Per_Sector"]
+
+    # Reads the sector(s) in that cluster.
+    # This is a memoryview of the disk when it's mounted with mmap.
+    def readCluster(self, cluster):
+        return self.dev.read(self.getClusterOffset(cluster), self.getClusterSize())
+
+    # Reads a list of clusters, each run of neighboring clusters in one go.
+    def readClusters(self, clusters):
+
+        cluster_size = self.getClusterSize()
+        contents = bytearray(len(clusters) * cluster_size)
+
+        with memoryview(contents) as view:
+
+            start = 0
+            while start < len(clusters):
+
+                # Find the end of this run of clusters.
+                end = start + 1
+                while end < len(clusters) and clusters[end] == clusters[end - 1] + 1:
+                    end += 1
+
+                self.dev.readinto(self.getClusterOffset(clusters[start]), view[start * cluster_size:end * cluster_size])
+
+                start = end
+
+        return contents
+
+    # Writes to the sector(s) in that cluster.
+    def writeCluster(self, cluster, content):
+        self.lockData(self.getClusterOffset(cluster), self.getClusterSize())
+        self.dev.write(self.getClusterOffset(cluster), content[:self.getClusterSize()])
+
+    # Writes data over a list of clusters.
+    # Each run of neighboring clusters is written in one go,
+    # with the padding of the last cluster in the same vectored write.
+    def writeClusters(self, clusters, contents):
+
+        cluster_size = self.getClusterSize()
+
+        with memoryview(contents) as view:
+            view = view.cast("B")
+
+            start = 0
+            while start < len(clusters):
+
+                # Find the end of this run of clusters.
+                end = start + 1
+                while end < len(clusters) and clusters[end] == clusters[end - 1] + 1:
+                    end += 1
+
+                data = view[start * cluster_size:end * cluster_size]
+
+                self.lockData(self.getClusterOffset(clusters[start]), (end - start) * cluster_size)
+
+                # Pad out the rest of the last cluster.
+                self.dev.writev(self.getClusterOffset(clusters[start]),
+                                [data, bytes((end - start) * cluster_size - len(data))])
+
+                start = end
+
+    # Wipes the sector(s) in that cluster blank.
+    def wipeCluster(self, cluster):
+        self.writeCluster(cluster, b"\x00"*(self.attr["Sectors_Per_Cluster"] * self.attr["Bytes_Per_Sector"]))
+
+    ############################
+    # DIRECTORY FUNCTIONS
+    ############################
+
+    # Go to the directory path given. Takes a name or a whole path.
+    # Only the disk's current directory changes, so the read lock is enough.
+    @readLocked
+    def goDir(self, sd):
+
+        found = self.findDir(sd)
+
+        if found:
+            self.dir_cluster, self.path = found
+
+    # Returns the cluster of a directory and its path in the form of self.path,
+    # or None if the directory isn't there. Relative paths start from cwd if given.
+    @readLocked
+    def findDir(self, sd, cwd=None):
+
+        # Make sure the disk is mounted first!
+        if not self.isMounted():
+            raise SlitherIOError("NotMounted", "No disk mounted!")
+
+        parts = self.splitPath(sd, cwd)
+        names = []
+
+        # Look up each directory on the way, so the path uses the names on the disk.
+        for i in range(len(parts)):
+            found = self.lookupPath("/".join(parts[:i+1]), True)
+
+            if not found or not found[1]["IS_DIRECTORY"]:
+                return None
+
+            names.append(found[1]["FILE_NAME"])
+
+        return found[1]["CLUSTER"] if parts else 0, "./" + "".join("{}/".format(i) for i in names)
+
+    # Creates a new, empty directory. Takes a name or a whole path.
+    @writeLocked
+    def makeDir(self, directory):
+
+        # Make sure the disk is mounted first!
+        if not self.isMounted():
+            raise SlitherIOError("NotMounted", "No disk mounted!")
+
+        # Make sure the disk can be written to.
+        self.dev.checkWritable()
+
+        dir_cluster, name = self.splitParent(directory)
+
+        if self.doesExist(directory):
+            raise SlitherIOError("EntryExists", "This entry already exists!")
+
+        cluster = self.makeChain(1)[0]
+
+        try:
+            entry = self.buildEntry(name, self.attr_flags["DIRECTORY"], cluster, 0)
+
+            # The first entries link to the directory itself and its parent.
+            links = b"".join(SFN_ENTRY.pack(bytes(i.ljust(8), "ascii"),
+                                            b"   ",
+                                            entry["ATTRIBUTES"],
+                                            0,
+                                            0,
+                                            entry["CREATION_TIME"],
+                                            entry["CREATION_DATE"],
+                                            entry["ACCESSED_DATE"],
+                                            0,
+                                            entry["MODIFIED_TIME"],
+                                            entry["MODIFIED_DATE"],
+                                            link,
+                                            0) for i, link in ((".", cluster), ("..", dir_cluster)))
+
+            self.writeClusters([cluster], links)
+
+            # Forget anything about an old directory in this cluster.
+            self.clearDirCache(cluster)
+            self.entry_hints.pop(cluster, None)
+
+            # Create the new entry within the parent directory.
+            if not self.newEntry(name, entry, dir_cluster):
+                raise SlitherIOError("DirectoryFull", "There's no room left in the directory!")
+
+        except Exception:
+
+            # Don't leave the cluster behind.
+            self.deleteChain(cluster)
+
+            self.flush()
+
+            raise
+
+        self.flush()
+
+        return True
+
+    # Returns the values for a new entry made now.
+    def buildEntry(self, name, attributes, cluster, size):
+
+        entry = {}
+        entry["FILE_NAME"] = name
+        entry["ATTRIBUTES"] = attributes
+        entry["RESERVED"] = 0
+        entry["CREATION_TENTH_SECOND"] = 0
+        entry["CREATION_TIME"] = int.from_bytes(self.getTime(), "little")
+        entry["CREATION_DATE"] = int.from_bytes(self.getDate(), "little")
+        entry["ACCESSED_DATE"] = int.from_bytes(self.getDate(), "little")
+        entry["HIGHER_CLUSTER"] = 0
+        entry["MODIFIED_TIME"] = int.from_bytes(self.getTime(), "little")
+        entry["MODIFIED_DATE"] = int.from_bytes(self.getDate(), "little")
+        entry["LOWER_CLUSTER"] = cluster
+        entry["SIZE"] = size
+
+        return entry
+
+    # Sets the attributes of a file or directory. Whether it's a directory stays the same.
+    @writeLocked
+    def setAttributes(self, file, attributes):
+
+        # Make sure the disk is mounted first!
+        if not self.isMounted():
+            raise SlitherIOError("NotMounted", "No disk mounted!")
+
+        # Make sure the disk can be written to.
+        self.dev.checkWritable()
+
+        found = self.lookupPath(file)
+
+        if not found:
+            raise SlitherIOError("EntryDoesNotExist", "The entry doesn't exist!")
+
+        cluster, entry = found
+
+        attributes = (attributes & ~self.attr_flags["DIRECTORY"]) | (entry["ATTRIBUTES"] & self.attr_flags["DIRECTORY"])
+
+        # The attributes are the 12th byte of the SFN entry.
+        self.dev.write(entry["SFN_LBA"] + 11, bytes([attributes]))
+
+        self.clearDirCache(cluster)
+
+        # Put the changed entry in the path index.
+        self.indexEntry(cluster, DirEntry(self,
+                                          SFN_ENTRY.unpack(bytes(self.dev.read(entry["SFN_LBA"], 32))),
+                                          entry["SFN_LBA"],
+                                          entry["LFN_LBA"],
+                                          entry["LONG_FILE_NAME"]))
+
+        self.flush()
+
+        return True
+
+    # Edits the values of an entry.
+    @writeLocked
+    def editEntry(self, name, entry, new_entry, cluster=None):
+
+        # Remove the old entry.
+        self.removeEntry(entry, cluster)
+
+        # Update a copy of the entry with the new data.
+        entry = dict(entry)
+        entry.update(new_entry)
+
+        # Create a new entry.
+        self.newEntry(entry["FILE_NAME"], entry, cluster)
+
+        return True
+
+    # Creates a new entry in a directory, the current one by default.
+    @writeLocked
+    def newEntry(self, name, entry, cluster=None):
+        if cluster is None:
+            cluster = self.dir_cluster
+
+        # A tuple of LFN parts.
+        LFNS = ()
+        long_file_name = ""
+
+        # Make sure this entry doesn't exist, using the path index if it covers this directory.
+        if self.path_index is not None and cluster in self.dir_paths:
+            prefix = self.dir_paths[cluster] + "/" if cluster else ""
+
+            if prefix + name.casefold() in self.path_index:
+                raise SlitherIOError("EntryExists", "This entry already exists!")
+
+        # Otherwise match the long and short names of the directory without case, like the index.
+        else:
+            folded = name.casefold()
+
+            for i in self.getDir(cluster=cluster).values():
+                if folded in (i["FILE_NAME"].casefold(), i["SHORT_FILE_NAME"].casefold()):
+                    raise SlitherIOError("EntryExists", "This entry already exists!")
+
+        # Check to see if this is a LFN.
+        if not self.isSFN(name):
+            LFNS = self.splitLFN(name)
+            long_file_name = name
+            name = self.fakeSFN(name, cluster)
+
+        # Split the SFN.
+        if "." in name:
+            file_name, file_ext = name.split(".")
+        else:
+            file_name = name
+            file_ext = ""
+
+        # Generate a checksum.
+        cs = self.gensumLFN(file_name.ljust(8)+file_ext.ljust(3))
+
+
+        # Find enough free entries.
+        entries = self.findFreeEntry(len(LFNS)+1, cluster)
+
+        # A full subdirectory gets another cluster, the root directory can't grow.
+        if not entries and cluster:
+            self.growDir(cluster, len(LFNS)+1)
+            entries = self.findFreeEntry(len(LFNS)+1, cluster)
+
+        # Not enough free entries!
+        if not entries:
+            return False
+
+        # The directory is about to change.
+        self.clearDirCache(cluster)
+
+        # Build each LFN entry.
+        contents = []
+        for i in range(len(LFNS)):
+
+            # Is this the last LFN entry?
+            if len(LFNS)-i == len(LFNS):
+                seq = len(LFNS)+0x40
+            else:
+                seq = len(LFNS)-i
+
+            contents.append(LFN_ENTRY.pack(seq,
+                                           bytes(LFNS[i][:5], "utf-16-le"),
+                                           self.attr_flags["LFN"],
+                                           0,
+                                           cs,
+                                           bytes(LFNS[i][5:11], "utf-16-le"),
+                                           0,
+                                           bytes(LFNS[i][11:13], "utf-16-le")))
+
+        fields = (bytes(file_name.ljust(8), "ascii"),
+                  bytes(file_ext.ljust(3), "ascii"),
+                  entry["ATTRIBUTES"],
+                  entry["RESERVED"],
+                  entry["CREATION_TENTH_SECOND"],
+                  entry["CREATION_TIME"],
+                  entry["CREATION_DATE"],
+                  entry["ACCESSED_DATE"],
+                  entry["HIGHER_CLUSTER"],
+                  entry["MODIFIED_TIME"],
+                  entry["MODIFIED_DATE"],
+                  entry["LOWER_CLUSTER"],
+                  entry["SIZE"])
+
+        # Write the LFN entries and the SFN entry together.
+        contents.append(SFN_ENTRY.pack(*fields))
+        self.writeEntries(entries, contents)
+
+        self.indexEntry(cluster, DirEntry(self, fields, entries[-1], entries[:-1], long_file_name))
+
+        return True
+
+    # Frees up an entry in a directory, the current one by default.
+    @writeLocked
+    def removeEntry(self, entry, cluster=None):
+        if cluster is None:
+            cluster = self.dir_cluster
+
+        entries = list(entry["LFN_LBA"]) + [entry["SFN_LBA"]]
+
+        # The directory is about to change.
+        self.clearDirCache(cluster)
+        self.unindexEntry(cluster, entry)
+
+        # Look for free entries from the start again.
+        self.entry_hints.pop(cluster, None)
+
+        # Remove each entry associated with the file.
+        self.writeEntries(entries, [b'\xE5' + bytes(31)] * len(entries))
+
+        return True
+
+    # Writes raw entries to a list of LBAs.
+    # Each run of neighboring entries is written in one vectored write.
+    def writeEntries(self, entries, contents):
+
+        start = 0
+        while start < len(entries):
+
+            # Find the end of this run of entries.
+            end = start + 1
+            while end < len(entries) and entries[end] == entries[end - 1] + 32:
+                end += 1
+
+            self.dev.writev(entries[start], contents[start:end])
+
+            start = end
+
+    # Finds free entries and returns a list of LBAs.
+    # The search starts after the last entries found, then from the start of the directory.
+    def findFreeEntry(self, n=1, cluster=None):
+        if cluster is None:
+            cluster = self.dir_cluster
+
+        hint = self.entry_hints.get(cluster, 0)
+
+        for start in ((hint, 0) if hint else (0,)):
+
+            # A subdirectory is only read from the cluster the search starts in.
+            skip = start * 32 // self.getClusterSize() if cluster else 0
+
+            dir_data, region_offsets, region_size = self.readDir(cluster, skip)
+
+            # A chain of entries. Needed for LFNs.
+            entries = []
+
+            # Start searching through the directory one entry at a time.
+            for i in range(start * 32 - skip * region_size, len(dir_data), 32):
+
+                # Check to see if this is a free entry.
+                if dir_data[i] in (0x00, 0xE5):
+                    entries.append(region_offsets[i // region_size] + i % region_size)
+
+                    # Return if we have enough entries.
+                    if len(entries) == n:
+                        self.entry_hints[cluster] = skip * region_size // 32 + i // 32 + 1
+                        return tuple(entries)
+                else:
+                    entries = []
+
+        # Return the chain of entries.
+        return tuple()
+
+    # Adds enough blank clusters to the end of a subdirectory for n more entries.
+    def growDir(self, cluster, n=1):
+
+        cluster_chain = self.growChain(cluster, -(-n * 32 // self.getClusterSize()))
+
+        self.writeClusters(cluster_chain, bytes(len(cluster_chain) * self.getClusterSize()))
+
+        self.clearDirCache(cluster)
+
+        return cluster_chain
+
+    # Reads a directory and returns its content, the offset of
+    # each region of the directory and the size of the regions.
+    # The root directory is one region while a subdirectory has one per cluster.
+    # Reads the current directory unless given the cluster of another.
+    # A subdirectory can be read from part way along by skipping its first clusters.
+    def readDir(self, cluster=None, skip=0):
+        if cluster is None:
+            cluster = self.dir_cluster
+
+        # We're at the root directory.
+        if not cluster:
+
+            region_offsets = [self._root_offset()]
+            region_size = 32*self.attr["Dir_Entries"]
+
+            # Read the root directory.
+            return self.dev.read(region_offsets[0], region_size), region_offsets, region_size
+
+        clusters = []
+        region_size = self.attr["Sectors_Per_Cluster"] * self.attr["Bytes_Per_Sector"]
+
+        while cluster and (cluster < 0xFF0):
+
+            # Read cluster data.
+            if skip:
+                skip -= 1
+            else:
+                clusters.append(cluster)
+
+            # Load the next cluster.
+            cluster = self.nextChain(cluster)
+
+        return self.readClusters(clusters), [self.getClusterOffset(i) for i in clusters], region_size
+
+    # Forgets the parsed entries of a directory, the current one by default.
+    def clearDirCache(self, cluster=None):
+        if cluster is None:
+            cluster = self.dir_cluster
+
+        self.dir_cache.pop((cluster, True), None)
+        self.dir_cache.pop((cluster, False), None)
+
+    # Reads the Entry table for the current directory
+    # and returns a dictonary of entries.
+    # The dictonary is shared between calls, so don't modify it.
+    # Reads the current directory unless given the cluster of another.
+    @readLocked
+    def getDir(self, vFAT=True, cluster=None):
+        if cluster is None:
+            cluster = self.dir_cluster
+
+        # Reuse the entries if this directory was already parsed.
+        if (cluster, vFAT) in self.dir_cache:
+            return self.dir_cache[(cluster, vFAT)]
+
+        entries = self.parseDir(*self.readDir(cluster), vFAT=vFAT)
+
+        self.dir_cache[(cluster, vFAT)] = entries
+
+        return entries
+
+    # Parses raw directory data and returns a dictonary of entries.
+    def parseDir(self, dir_data, region_offsets, region_size, vFAT=True):
+
+        entries = {}
+
+        # LFN holder
+        LFN = []
+
+        with memoryview(dir_data) as dir_view:
+
+            # Start searching through the directory one entry at a time.
+            for index, fn in enumerate(SFN_ENTRY.iter_unpack(dir_view)):
+
+                # If this entry is empty, we're done.
+                if not fn[0][0]:
+                    break
+
+                # If this entry is free, skip to the next.
+                elif fn[0][0] == 0xE5:
+                    continue
+
+                # Get the entry's location in LBA.
+                lba = region_offsets[index*32 // region_size] + index*32 % region_size
+
+                # Check to see if this is a vFAT entry.
+                if vFAT and fn[2] == self.attr_flags["LFN"]:
+                    lfn = LFN_ENTRY.unpack_from(dir_view, index*32)
+                    LFN.append((lfn[0], lfn[4], self.getLFNPart(lfn), lba))
+
+                # Otherwise this is a 8.3 entry, unless it's the volume label.
+                # LFN entries have the volume label flag too.
+                elif not fn[2] & self.attr_flags["VOLUME_ID"]:
+
+                    # Make sure the checksum matches.
+                    cs = self.gensumLFN((fn[0] + fn[1]).decode("latin-1"))
+                    LFN = [i for i in LFN if i[1] == cs]
+
+                    entry = DirEntry(self, fn, lba, [i[3] for i in LFN], "".join([i[2] for i in LFN[::-1]]))
+
+                    # Add the entry to the list of entries.
+                    entries[entry.file_name] = entry
+
+                    # Clean up the LFN for the next entry.
+                    LFN = []
+
+        return entries
+
+    # Returns the part of a long name held in an unpacked LFN entry.
+    def getLFNPart(self, lfn):
+        name_part = (lfn[1] + lfn[5] + lfn[7]).decode("utf-16-le")
+
+        # If this is the end of the LFN, cut off the excess.
+        return name_part.split("\u0000")[0]
+
+    # Puts a long name back together from its LFN entries in the order they're in on the disk,
+    # whatever their checksums are. Returns None unless they're numbered as one whole name.
+    def joinLFN(self, lfn):
+        if not lfn or lfn[0][0] != len(lfn) | 0x40:
+            return None
+
+        if [i[0] & 0x3F for i in lfn] != list(range(len(lfn), 0, -1)):
+            return None
+
+        return "".join([self.getLFNPart(i) for i in lfn[::-1]])
+
+    ############################
+    # PATH FUNCTIONS
+    ############################
+
+    # Splits a path into the names leading to it from the root directory.
+    # Paths are relative to the current directory, or to the directory path given,
+    # unless they start with a slash.
+    def splitPath(self, path, cwd=None):
+        if cwd is None:
+            cwd = self.path
+
+        path = path.replace("\\", "/")
+
+        if path.startswith("/"):
+            parts = []
+        else:
+            parts = [i for i in cwd.split("/")[1:] if i]
+
+        for i in path.split("/"):
+            if i in ("", "."):
+                continue
+            elif i == "..":
+                if parts:
+                    parts.pop()
+            else:
+                parts.append(i)
+
+        return parts
+
+    # Returns the directory cluster and entry of a path, or None if there's nothing there.
+    # A whole path is one dictonary lookup once the path index is built.
+    @readLocked
+    def lookupPath(self, path, absolute=False):
+
+        # Only one reader builds the index.
+        if self.path_index is None:
+            with self.index_lock:
+                if self.path_index is None:
+                    self.buildPathIndex()
+
+        if not absolute:
+            path = "/".join(self.splitPath(path))
+
+        return self.path_index.get(path.casefold())
+
+    # Returns the cluster of the directory a path is in and the name at the end of the path.
+    def splitParent(self, path):
+
+        parts = self.splitPath(path)
+
+        if not parts:
+            raise SlitherIOError("BadPath", "The path doesn't name an entry!")
+
+        if len(parts) == 1:
+            return 0, parts[0]
+
+        found = self.lookupPath("/".join(parts[:-1]), True)
+
+        if not found or not found[1]["IS_DIRECTORY"]:
+            raise SlitherIOError("DirDoesNotExist", "The directory doesn't exist!")
+
+        return found[1]["CLUSTER"], parts[-1]
+
+    # Builds the path index in one pass over every directory from the root.
+    # The index is only put in place once it's whole, so readers never see part of it.
+    def buildPathIndex(self):
+
+        path_index = {}
+        self.dir_paths = {0: ""}
+
+        dirs = [0]
+
+        while dirs:
+            cluster = dirs.pop()
+
+            for entry in self.getDir(cluster=cluster).values():
+
+                # Skip the links to this directory and its parent.
+                if entry.short_name in (".", ".."):
+                    continue
+
+                # Don't follow a directory twice.
+                if entry.is_directory and entry.cluster and entry.cluster not in self.dir_paths:
+                    dirs.append(entry.cluster)
+
+                self.indexEntry(cluster, entry, path_index)
+
+        self.path_index = path_index
+
+    # Adds an entry to the path index under both its long and short names.
+    # Adds to the index being built when given one.
+    def indexEntry(self, cluster, entry, path_index=None):
+        if path_index is None:
+            path_index = self.path_index
+
+        if path_index is None or cluster not in self.dir_paths:
+            return None
+
+        prefix = self.dir_paths[cluster] + "/" if cluster else ""
+        key = prefix + entry["FILE_NAME"].casefold()
+
+        path_index[prefix + entry["SHORT_FILE_NAME"].casefold()] = (cluster, entry)
+        path_index[key] = (cluster, entry)
+
+        # Entries in a new directory go under its path.
+        if entry["IS_DIRECTORY"] and entry["CLUSTER"] and entry["CLUSTER"] not in self.dir_paths:
+            self.dir_paths[entry["CLUSTER"]] = key
+
+        return key
+
+    # Removes an entry from the path index, along with everything under it.
+    def unindexEntry(self, cluster, entry):
+
+        if self.path_index is None or cluster not in self.dir_paths:
+            return
+
+        prefix = self.dir_paths[cluster] + "/" if cluster else ""
+
+        for name in (entry["FILE_NAME"], entry["SHORT_FILE_NAME"]):
+            found = self.path_index.get(prefix + name.casefold())
+
+            if found and found[1]["SFN_LBA"] == entry["SFN_LBA"]:
+                del self.path_index[prefix + name.casefold()]
+
+        if entry["IS_DIRECTORY"] and entry["CLUSTER"] in self.dir_paths:
+            key = self.dir_paths.pop(entry["CLUSTER"]) + "/"
+
+            for i in [i for i in self.path_index if i.startswith(key)]:
+                del self.path_index[i]
+
+            for i in [i for i in self.dir_paths if self.dir_paths[i].startswith(key)]:
+                del self.dir_paths[i]
+
+    ############################
+    # FILE FUNCTIONS
+    ############################
+
+    # Creates a new, empty file.
+    # TODO
+    def newFile(self, file):
+        pass
+
+    # Opens a file on the disk and returns a buffered, file-like object.
+    # Only reading is supported.
+    @readLocked
+    def open(self, file, mode="rb"):
+
+        # Make sure the disk is mounted first!
+        if not self.isMounted():
+            raise SlitherIOError("NotMounted", "No disk mounted!")
+
+        if mode not in ("r", "rb"):
+            raise SlitherIOError("BadMode", "Files can only be opened for reading!")
+
+        found = self.lookupPath(file)
+
+        # Make sure the file exists.
+        if not found or not found[1]["IS_FILE"]:
+            raise SlitherIOError("FileDoesNotExist", "The file doesn't exist!")
+
+        return io.BufferedReader(FileReader(self, found[1]))
+
+    # Get the contents of a file off the disk.
+    @readLocked
+    def readFile(self, file, vFAT=False):
+
+        # Return the file's content.
+        with self.open(file) as f:
+            return f.read()
+
+    # Writes a file from bytes, a binary file object or an iterable of byte chunks.
+    # The size is a hint for streams so the clusters can be found up front.
+    @writeLocked
+    def writeFile(self, file, contents, size=None):
+
+        # Make sure the disk is mounted first!
+        if not self.isMounted():
+            raise SlitherIOError("NotMounted", "No disk mounted!")
+
+        # Make sure the disk can be written to.
+        self.dev.checkWritable()
+
+        dir_cluster, name = self.splitParent(file)
+
+        # If the file exists, delete it because we're overwriting it.
+        if self.fileExists(file):
+            self.deleteFile(file)
+
+        elif self.doesExist(file):
+            raise SlitherIOError("NotFile", "Can't write to a nonfile!")
+
+        cluster_size = self.getClusterSize()
+
+        # Most bytes written at once.
+        chunk = WRITE_CLUSTERS * cluster_size
+
+        # Bytes can be written straight from memory.
+        if isinstance(contents, (bytes, bytearray, memoryview)):
+            view = memoryview(contents).cast("B")
+            size = len(view)
+            source = None
+
+        else:
+            view = None
+
+            if hasattr(contents, "readinto"):
+                source = contents
+            elif hasattr(contents, "read"):
+                source = ChunkReader(iter(lambda: contents.read(chunk), b""))
+            else:
+                source = ChunkReader(contents)
+
+            buf = memoryview(bytearray(chunk))
+
+        cluster_chain = []
+        file_size = 0
+
+        try:
+
+            # Find all of the clusters at once when the size is known.
+            if size:
+                cluster_chain = self.makeChain(-(-size // cluster_size))
+
+            while True:
+
+                index = file_size // cluster_size
+
+                # Take up to WRITE_CLUSTERS clusters of data at a time.
+                if view is not None:
+                    data = view[file_size:file_size + chunk]
+                else:
+                    data = buf[:readFull(source, buf)]
+
+                if not data:
+                    break
+
+                # Add as many clusters as the data runs past the chain.
+                clusters = -(-len(data) // cluster_size)
+                if index + clusters > len(cluster_chain):
+                    if cluster_chain:
+                        cluster_chain += self.growChain(cluster_chain[-1], index + clusters - len(cluster_chain))
+                    else:
+                        cluster_chain = self.makeChain(clusters)
+
+                # Write the data to the disk, a call for each run of clusters.
+                self.writeClusters(cluster_chain[index:index + clusters], data)
+
+                file_size += len(data)
+
+                # A short read means the stream is done.
+                if len(data) < chunk:
+                    break
+
+            # Give back any clusters that weren't needed.
+            used = -(-file_size // cluster_size)
+            if used < len(cluster_chain):
+                self.setChain(cluster_chain[0], used)
+                cluster_chain = cluster_chain[:used]
+
+            # Update the entry.
+            entry = self.buildEntry(name, 0, cluster_chain[0] if cluster_chain else 0, file_size)
+
+            # Create the new entry within the directory.
+            if not self.newEntry(name, entry, dir_cluster):
+                raise SlitherIOError("DirectoryFull", "There's no room left in the directory!")
+
+        except Exception:
+
+            # Don't leave the clusters behind.
+            if cluster_chain:
+                self.deleteChain(cluster_chain[0])
+
+            self.flush()
+
+            raise
+
+        self.flush()
+
+        return True
+
+    # Appends a file.
+    # TODO
+    def appendFile(self, file):
+        pass
+
+
+    # Rename a file.
+    @writeLocked
+    def renameFile(self, old_name, new_name):
+
+        # Make sure the disk is mounted first!
+        if not self.isMounted():
+            raise SlitherIOError("NotMounted", "No disk mounted!")
+
+        # Make sure the disk can be written to.
+        self.dev.checkWritable()
+
+        found = self.lookupPath(old_name)
+
+        # Make sure the file exists.
+        if not found or not found[1]["IS_FILE"]:
+            raise SlitherIOError("FileDoesNotExist", "The file doesn't exist!")
+
+        dir_cluster, entry = found
+
+        # A path for the new name has to stay in the same directory.
+        if "/" in new_name or "\\" in new_name:
+            new_cluster, new_name = self.splitParent(new_name)
+
+            if new_cluster != dir_cluster:
+                raise SlitherIOError("NotSameDir", "Files can only be renamed within their directory!")
+
+        taken = self.lookupPath("/".join(self.splitPath(old_name)[:-1] + [new_name]), True)
+
+        # Make sure the new file name isn't already taken, unless it's only a change of case!
+        if taken and taken[1]["SFN_LBA"] != entry["SFN_LBA"]:
+            raise SlitherIOError("FileExists", "The new file name already exists!")
+
+        # Edit the directory entry.
+        self.editEntry(old_name, entry, {"FILE_NAME": new_name}, dir_cluster)
+
+        return True
+
+    # Deletes a file if it exists.
+    @writeLocked
+    def deleteFile(self, file):
+
+        # Make sure the disk is mounted first!
+        if not self.isMounted():
+            raise SlitherIOError("NotMounted", "No disk mounted!")
+
+        # Make sure the disk can be written to.
+        self.dev.checkWritable()
+
+        found = self.lookupPath(file)
+
+        # Make sure the file exists.
+        if not found or not found[1]["IS_FILE"]:
+            raise SlitherIOError("FileDoesNotExist", "The file doesn't exist!")
+
+        # Remove the file entries associated with the file.
+        self.removeEntry(found[1], found[0])
+
+        # Remove the cluster chain associated with the file.
+        self.deleteChain(found[1]["CLUSTER"])
+
+        self.flush()
+
+        return True
+
+    # Change to writeFile.
+    @writeLocked
+    def addFile(self, file, contents, size=None):
+        self.writeFile(file, contents, size)
+
+    @writeLocked
+    def addBootloader(self, file, contents):
+        # Make sure the disk is mounted first!
+        if not self.isMounted():
+            raise SlitherIOError("NotMounted", "No disk mounted!")
+
+        # Make sure the disk can be written to.
+        self.dev.checkWritable()
+
+        # Fit the last data into the size of a sector, if needed.
+        if len(contents) % self.attr["Bytes_Per_Sector"]:
+            contents += b'\x00' * (self.attr["Bytes_Per_Sector"] - (len(contents) % self.attr["Bytes_Per_Sector"]))
+
+        self.dev.write(0, contents)
+
+    ############################
+    # TREE FUNCTIONS
+    ############################
+
+    # Copies a directory of the disk and everything under it to a host directory.
+    # The clusters of every file are read in the order they sit on the disk,
+    # while a pool of threads writes them out to the host files.
+    # Returns the number of files extracted.
+    @readLocked
+    def extract_all(self, dest, path="/", workers=4):
+
+        # Make sure the disk is mounted first!
+        if not self.isMounted():
+            raise SlitherIOError("NotMounted", "No disk mounted!")
 
-        # Create a new checksum to verify with the current checksum.
-        ns = 0
+        if not self.dirExists(path):
+            raise SlitherIOError("DirDoesNotExist", "The directory doesn't exist!")
 
-        for i in name:
-            ns = (((ns & 1) << 7) + (ns >> 1) + ord(i)) & 0xFF
+        found = self.lookupPath(path)
+        cluster = found[1]["CLUSTER"] if found else 0
 
-        return ns
+        cluster_size = self.getClusterSize()
 
-    # Make sure the checksum for the LFN match the SFN.
-    def checksumLFN(self, name, cs):
-        return self.gensumLFN(name) == cs
+        # Walk the tree, listing the host directories and files.
+        # Nothing is made on the host until every name has been checked.
+        files = []
+        host_dirs = []
+        dirs = [(cluster, dest)]
+        seen = {cluster}
 
-    # Splits a LFN into SFN entries.
-    def splitLFN(self, name):
+        while dirs:
+            cluster, host_dir = dirs.pop()
 
-        # List of LFN parts.
-        LFNS = []
+            for entry in self.getDir(cluster=cluster).values():
 
-        # Add a null character.
-        name += "\u0000"
+                # Skip the links to this directory and its parent.
+                if entry.short_name in (".", ".."):
+                    continue
 
-        while name:
-            LFNS.append(name[:13].ljust(13, "\uFFFF"))
-            name = name[13:]
+                host_path = os.path.join(host_dir, checkHostName(entry.file_name))
 
-        return tuple(LFNS[::-1])
+                if entry.is_directory:
+                    if entry.cluster not in seen:
+                        seen.add(entry.cluster)
+                        host_dirs.append(host_path)
+                        dirs.append((entry.cluster, host_path))
 
-    ############################
-    # ENTRY EXISTS FUNCTIONS
-    ############################
+                elif entry.is_file:
+                    files.append((host_path, entry))
 
-    # Checks to see if that entry exists.
-    def doesExist(self, entry):
+        os.makedirs(dest, exist_ok=True)
 
-        # Get a list of everything in the current directory.
-        e = self.getDir()
+        # A symbolic link already in the destination could still lead out of it.
+        root = os.path.realpath(dest)
+        for host_path in host_dirs + [i[0] for i in files]:
+            if os.path.commonpath([root, os.path.realpath(host_path)]) != root:
+                raise SlitherIOError("UnsafeFileName", "A file would be extracted outside of the destination!")
 
-        if entry in e.keys():
-            return True
+        for host_path in host_dirs:
+            os.makedirs(host_path, exist_ok=True)
 
-        return False
+        # Split every file into runs of clusters and where each run goes in the file.
+        segments = []
+        remaining = []
 
-    # Checks to see if a file exists.
-    def fileExists(self, file):
+        for index, (host_path, entry) in enumerate(files):
+            chain = [i for i in self.getChain(entry.cluster) if 2 <= i < 0xFF0] if entry.size else []
+            chain = chain[:-(-entry.size // cluster_size)]
 
-        # Get a list of files in the directory.
-        e = self.getDir()
-        if file in [i for i in e if e[i]["IS_FILE"]]:
-            return True
+            count = 0
+            start = 0
+            while start < len(chain):
+                end = start + 1
+                while end < len(chain) and chain[end] == chain[end - 1] + 1:
+                    end += 1
 
-        return False
+                size = min(entry.size, end * cluster_size) - start * cluster_size
+                segments.append((self.getClusterOffset(chain[start]), size, index, start * cluster_size))
+                count += 1
 
-    # Checks to see if a directory exists.
-    def dirExists(self, directory):
+                start = end
 
-        # Get a list of files in the directory.
-        e = self.getDir()
-        if directory in [i for i in e if e[i]["IS_DIRECTORY"]]:
-            return True
+            remaining.append(count)
 
-        return False
+        segments.sort()
 
-    ############################
-    # TIME & DATE FUNCTIONS
-    ############################
+        # Make every host file at its full size, so the runs can be written in any order.
+        fds = []
+        try:
+            for host_path, entry in files:
+                fds.append(None)
+                fd = os.open(host_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o666)
+                os.ftruncate(fd, entry.size)
 
-    # Returns the time in FAT format.
-    def getTime(self):
-        return int((datetime.datetime.now().hour << 11) + (datetime.datetime.now().minute << 5) + (datetime.datetime.now().second // 2)).to_bytes(2, "little")
+                # Files with nothing to write are done already.
+                if remaining[len(fds) - 1]:
+                    fds[-1] = fd
+                else:
+                    os.close(fd)
 
-    # Returns the date in FAT format.
-    def getDate(self):
-        return int(((datetime.datetime.now().year - 1980) << 9) + (datetime.datetime.now().month << 5) + datetime.datetime.now().day).to_bytes(2, "little")
+        except BaseException:
+            for fd in fds:
+                if fd is not None:
+                    os.close(fd)
+            raise
 
+        lock = threading.Lock()
 
-    ############################
-    # CLUSTER CHAIN FUNCTIONS
-    ############################
+        # Writes a run and closes the file after its last run.
+        def write(data, index, offset):
+            try:
+                writeAt(fds[index], data, offset)
+            finally:
+                with lock:
+                    remaining[index] -= 1
+                    done = not remaining[index]
 
-    # Returns a tuple of a cluster chain.
-    def getChain(self, cluster):
+                if done:
+                    os.close(fds[index])
 
-        cc = [cluster]
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = []
 
-        while cluster and (cluster < 0xFF0):
+                i = 0
+                while i < len(segments):
 
-            cluster = self.nextChain(cluster)
-            cc.append(cluster)
+                    # Read runs that follow each other on the disk in one go.
+                    start = segments[i][0]
+                    end = i + 1
+                    while (end < len(segments) and segments[end][0] == segments[end - 1][0] + segments[end - 1][1] and
+                           segments[end][0] + segments[end][1] - start <= EXTRACT_READ):
+                        end += 1
 
-        return tuple(cc)
+                    data = memoryview(bytes(self.dev.read(start, segments[end - 1][0] + segments[end - 1][1] - start)))
 
-    # Loads the content of a cluster chain.
-    def readChain(self, cluster):
+                    for offset, size, index, file_offset in segments[i:end]:
+                        futures.append(pool.submit(write, data[offset - start:offset - start + size], index, file_offset))
 
-        contents = bytes()
+                    i = end
 
-        for i in self.getChain(cluster):
+                # Pass on the first error from writing.
+                for future in futures:
+                    future.result()
 
-            # Read cluster data.
-            contents += self.readCluster(i)
+        finally:
+            # Close any file that never got all of its runs.
+            for index in range(len(fds)):
+                if fds[index] is not None and remaining[index] > 0:
+                    os.close(fds[index])
 
-        return contents
+        return len(files)
 
-    # Adds cluster(s) to the cluster chain.
-    # TODO
-    def growChain(self, cluster, clusters):
-        pass
+    # Copies a host directory and everything under it into a directory of the disk.
+    # The whole import is planned first, so a tree that doesn't fit fails before
+    # anything is written. Then the directories and files are written in one batch.
+    # Returns the number of files imported.
+    @writeLocked
+    def import_tree(self, src, dest="/"):
 
-    # Removes cluster(s) from the cluster chain.
-    # TODO
-    def shrinkChain(self, cluster, clusters):
-        pass
+        # Make sure the disk is mounted first!
+        if not self.isMounted():
+            raise SlitherIOError("NotMounted", "No disk mounted!")
 
-    # Grows or shrinks the cluster chain based on number of clusters needed.
-    def setChain(self, cluster, clusters):
-        pass
+        # Make sure the disk can be written to.
+        self.dev.checkWritable()
 
-    # Completely removes the cluster chain.
-    def deleteChain(self, cluster):
+        if not os.path.isdir(src):
+            raise SlitherIOError("HostDirDoesNotExist", "The host directory doesn't exist!")
 
-        while cluster and (cluster < 0xFF0):
+        if not self.dirExists(dest):
+            raise SlitherIOError("DirDoesNotExist", "The directory doesn't exist!")
 
-            # Calculate the location of the next cluster.
-            fat_offset = int(cluster * 1.5)
+        cluster_size = self.getClusterSize()
+        base = self.splitPath(dest)
 
-            # Check if the current cluster is even or odd.
-            even = cluster & 1
+        # New directories and the files to write, parents before their children.
+        new_dirs = []
+        files = []
 
-            # Load the next cluster.
-            self.f.seek(self.attr["Reserved_Sectors"]*self.attr["Bytes_Per_Sector"]+fat_offset)
-            cluster = int.from_bytes(self.f.read(2), "little")
-            self.f.seek(-2, 1)
-
-            # Adjust the 12-bit cluster appropriately.
-            if even:
-                self.f.write((cluster & 0xF).to_bytes(2, "little"))
-                cluster >>= 4
-            else:
-                self.f.write((cluster & 0xF000).to_bytes(2, "little"))
-                cluster &= 0xFFF
+        # Entries needed and entries free in each directory, keyed by its path.
+        needed = {}
+        free = {}
 
-    # Creates a cluster chain.
-    def makeChain(self, clusters):
+        clusters = 0
+        freed = 0
 
-        cluster = 0
-        cluster_chain = []
+        for root, dir_names, file_names in os.walk(src):
+            dir_names.sort()
+            file_names.sort()
 
-        while clusters:
+            rel = os.path.relpath(root, src)
+            parts = base + ([] if rel == "." else rel.split(os.sep))
+            key = "/".join(parts)
 
-            # Get the next cluster.
-            self.seekChain(cluster)
-            _cluster = int.from_bytes(self.f.read(2), "little")
+            if key not in needed:
+                needed[key] = 0
 
-            # Adjust the 12-bit cluster appropriately.
-            if cluster & 1:
-                _cluster >>= 4
-            else:
-                _cluster &= 0xFFF
+                found = self.lookupPath(key, True) if parts else None
 
+                # A new directory needs room for its links to itself and its parent.
+                if parts and not found:
+                    free[key] = 0
+                    needed[key] = 2
 
-            # If this cluster is free, add it to our list.
-            if not _cluster:
-                cluster_chain.append(cluster)
-                clusters -= 1
+                # Count the free entries of a directory already on the disk.
+                else:
+                    dir_data = self.readDir(found[1]["CLUSTER"] if found else 0)[0]
+                    free[key] = sum(1 for i in range(0, len(dir_data), 32) if dir_data[i] in (0x00, 0xE5))
 
-            cluster += 1
+            for name in dir_names + file_names:
+                path = key + "/" + name if key else name
+                found = self.lookupPath(path, True)
 
-        last_cluster = 0
+                is_dir = name in dir_names
 
-        for cluster in cluster_chain+[0xFFF]:
+                if found and found[1]["IS_DIRECTORY"] != is_dir:
+                    if is_dir:
+                        raise SlitherIOError("NotDir", "Can't make a directory over a file!")
+                    raise SlitherIOError("NotFile", "Can't write to a nonfile!")
 
-            if last_cluster:
-                # Load the last cluster.
-                self.seekChain(last_cluster)
-                c = int.from_bytes(self.f.read(2), "little")
+                # A file being replaced gives back its entries and clusters.
+                if found and not is_dir:
+                    free[key] += len(found[1]["LFN_LBA"]) + 1
+                    freed += self.chainLength(found[1]["CLUSTER"]) if found[1]["CLUSTER"] else 0
+
+                if not found or not is_dir:
+                    needed[key] += 1 if self.isSFN(name) else len(self.splitLFN(name)) + 1
 
-                # Add the current cluster in the old cluster's spot while preserving the 4 bit part of the neighboring cluster.
-                if last_cluster & 1:
-                    c = (cluster << 4) + (c & 0x000F)
+                if is_dir:
+                    if not found:
+                        new_dirs.append(path)
                 else:
-                    c = cluster + (c & 0xF000)
+                    size = os.path.getsize(os.path.join(root, name))
+                    files.append((os.path.join(root, name), path, size))
+                    clusters += -(-size // cluster_size)
 
-                # Write the current cluster in the old cluster's spot.
-                self.f.seek(-2, 1)
-                self.f.write(c.to_bytes(2, "little"))
+        # Directories need clusters for their entries too.
+        for key in needed:
+            extra = needed[key] - free[key]
 
-            last_cluster = cluster
+            if extra > 0:
+                if not key:
+                    raise SlitherIOError("DirectoryFull", "There's no room left in the directory!")
 
-        return cluster_chain
+                clusters += -(-extra * 32 // cluster_size)
 
+        if clusters > self.free_clusters + freed:
+            raise SlitherIOError("DiskFull", "Not enough free space on the disk!")
 
-    # Finds the next cluster in the chain.
-    def nextChain(self, cluster):
+        # Don't start a batch inside another one.
+        with (contextlib.nullcontext() if self.inBatch() else self.batch()):
 
-        # Load the next cluster.
-        self.f.seek(self.attr["Reserved_Sectors"]*self.attr["Bytes_Per_Sector"]+int(cluster*1.5))
-        next_cluster = int.from_bytes(self.f.read(2), "little")
+            for path in new_dirs:
+                self.makeDir("/" + path)
 
-        # Adjust the 12-bit cluster appropriately.
-        if cluster & 1:
-            next_cluster >>= 4
-        else:
-            next_cluster &= 0xFFF
+            for host_path, path, size in files:
+                with open(host_path, "rb") as f:
+                    self.writeFile("/" + path, f, size)
 
-        return next_cluster
+        return len(files)
 
-    # Seeks the location of the cluster.
-    def seekChain(self, cluster):
-        self.f.seek(self.attr["Reserved_Sectors"]*self.attr["Bytes_Per_Sector"]+int(cluster*1.5))
+    ############################
+    # DEFRAG FUNCTIONS
+    ############################
 
-    # Reads the sector(s) in that cluster.
-    def readCluster(self, cluster):
-        # Load the sector.
-        self.f.seek(((cluster-2) * self.attr["Sectors_Per_Cluster"] + self.getFirstDataSector()) * self.attr["Bytes_Per_Sector"])
+    # Returns the clusters of a chain, stopping if the chain loops back on itself.
+    def walkChain(self, cluster):
 
-        # Read the cluster data.
-        return self.f.read(self.attr["Sectors_Per_Cluster"] * self.attr["Bytes_Per_Sector"])
+        chain = []
+        seen = set()
 
-    # Writes to the sector(s) in that cluster.
-    def writeCluster(self, cluster, content):
-        # Load the sector(s) in the cluster.
-        self.f.seek(((cluster-2) * self.attr["Sectors_Per_Cluster"] + self.getFirstDataSector()) * self.attr["Bytes_Per_Sector"])
+        while 2 <= cluster < 0xFF0 and cluster < len(self.fat) and cluster not in seen:
+            chain.append(cluster)
+            seen.add(cluster)
+            cluster = self.fat[cluster]
 
-        # Write the cluster data.
-        self.f.write(content[:self.attr["Sectors_Per_Cluster"] * self.attr["Bytes_Per_Sector"]])
+        return chain
 
-    # Wipes the sector(s) in that cluster blank.
-    def wipeCluster(self, cluster):
-        self.writeCluster(cluster, b"\x00"*(self.attr["Sectors_Per_Cluster"] * self.attr["Bytes_Per_Sector"]))
+    # Returns the first cluster of every chain in the FAT.
+    # A chain starts at a used cluster that no other cluster points to.
+    @readLocked
+    def chainStarts(self):
 
-    ############################
-    # DIRECTORY FUNCTIONS
-    ############################
+        return fatcodec.chainStarts(self.fat, 2, min(self.getClusterCount() + 2, len(self.fat)))
 
-    # Go to the directory path given.
-    def goDir(self, sd):
+    # Returns the clusters that more than one cluster points to.
+    @readLocked
+    def crossLinks(self):
+        return fatcodec.crossLinks(self.fat, 2, min(self.getClusterCount() + 2, len(self.fat)))
+
+    # Returns the clusters whose entries differ between the first FAT and each other copy,
+    # as a list with one list of clusters per copy after the first.
+    # The copies are compared as they are on the disk, without changes that haven't been flushed.
+    @readLocked
+    def compareFATs(self):
 
         # Make sure the disk is mounted first!
         if not self.isMounted():
             raise SlitherIOError("NotMounted", "No disk mounted!")
 
-        e = self.getDir()
-        e_dir = [i for i in e if e[i]["IS_DIRECTORY"]]
+        size = self.attr["Sectors_Per_FAT"]*self.attr["Bytes_Per_Sector"]
+        first = self.attr["Reserved_Sectors"]*self.attr["Bytes_Per_Sector"]
 
-        if sd in e_dir:
-            self.dir_cluster = e[sd]["CLUSTER"]
+        fat = bytes(self.dev.read(first, size))
 
-            if sd == ".":
-                pass
-            elif sd == ".." and self.path != "./":
-                self.path = self.path[:self.path[:-1].rfind("/")+1]
-            else:
-                self.path += "{}/".format(sd)
+        return [fatcodec.compare(fat, self.dev.read(first + size*i, size)) for i in range(1, self.attr["FATs"])]
 
-    # Edits the values of an entry.
-    def editEntry(self, name, entry, new_entry):
+    # Measures how fragmented the cluster chains are.
+    # The score is the share of steps along the chains that jump instead of
+    # going on to the next cluster, so 0.0 means every chain is contiguous.
+    @readLocked
+    def fragmentation(self):
 
-        # Remove the old entry.
-        self.removeEntry(entry)
+        # Make sure the disk is mounted first!
+        if not self.isMounted():
+            raise SlitherIOError("NotMounted", "No disk mounted!")
 
-        # Update the entry with the new data.
-        entry.update(new_entry)
+        report = {"CHAINS": 0, "CLUSTERS": 0, "FRAGMENTS": 0, "FRAGMENTED": 0, "SCORE": 0.0}
 
-        # Create a new entry.
-        self.newEntry(entry["FILE_NAME"], entry)
+        for cluster in self.chainStarts():
+            chain = self.walkChain(cluster)
+            fragments = 1 + sum(1 for i in range(1, len(chain)) if chain[i] != chain[i - 1] + 1)
 
-        return True
+            report["CHAINS"] += 1
+            report["CLUSTERS"] += len(chain)
+            report["FRAGMENTS"] += fragments
 
-    # Creates a new entry.
-    def newEntry(self, name, entry):
+            if fragments > 1:
+                report["FRAGMENTED"] += 1
 
-        # A tuple of LFN parts.
-        LFNS = ()
+        if report["CLUSTERS"] > report["CHAINS"]:
+            report["SCORE"] = (report["FRAGMENTS"] - report["CHAINS"]) / (report["CLUSTERS"] - report["CHAINS"])
 
-        e = self.getDir()
+        return report
 
-        # Make sure this entry exists.
-        if name in e.keys():
-            raise SlitherIOError("EntryExists", "This entry already exists!")
+    # Rewrites every cluster chain into one contiguous run. A boot file goes
+    # first, then the directories, then the files, then any lost chains.
+    # The new data area is laid out in memory and only the clusters that
+    # change are written, in runs. Returns the fragmentation before and after.
+    @writeLocked
+    def defrag(self, boot_file=None):
 
-        # Check to see if this is a LFN.
-        if not self.isSFN(name):
-            LFNS = self.splitLFN(name)
-            name = self.fakeSFN(name)
+        # Make sure the disk is mounted first!
+        if not self.isMounted():
+            raise SlitherIOError("NotMounted", "No disk mounted!")
 
-        # Split the SFN.
-        if "." in name:
-            file_name, file_ext = name.split(".")
-        else:
-            file_name = name
-            file_ext = ""
+        # Make sure the disk can be written to.
+        self.dev.checkWritable()
 
-        # Generate a checksum.
-        cs = self.gensumLFN(file_name.ljust(8)+file_ext.ljust(3))
+        before = self.fragmentation()
 
+        # Write out anything pending so the disk matches the FAT in memory.
+        self.flush()
 
-        # Find enough free entries.
-        entries = self.findFreeEntry(len(LFNS)+1)
+        cluster_size = self.getClusterSize()
+        last_cluster = min(self.getClusterCount() + 2, len(self.fat))
+        data_offset = self.getClusterOffset(2)
+        root_offset = self._root_offset()
 
-        # Not enough free entries!
-        if not entries:
-            return False
+        # Walk the tree for the chains of directories and files,
+        # and every entry that points at a chain.
+        dir_chains = []
+        file_chains = []
+        links = []
 
-        self.f.seek(entries[0])
+        dirs = [0]
+        seen = {0}
 
-        # Write each LFN entry.
-        for i in range(len(LFNS)):
+        for cluster in dirs:
+            for entry in self.getDir(cluster=cluster).values():
 
-            # Is this the last LFN entry?
-            if len(LFNS)-i == len(LFNS):
-                self.f.write((len(LFNS)+0x40).to_bytes(1, "little"))
-            else:
-                self.f.write(len(LFNS).to_bytes(1, "little"))
-
-            self.f.write(bytes(LFNS[i][:5], "utf-16-le"))
-            self.f.write(self.attr_flags["LFN"].to_bytes(1, "little"))
-            self.f.write(bytes(1))
-            self.f.write(cs.to_bytes(1, "little"))
-            self.f.write(bytes(LFNS[i][5:11], "utf-16-le"))
-            self.f.write(bytes(2))
-            self.f.write(bytes(LFNS[i][11:13], "utf-16-le"))
-
-        # Update the SFN entry.
-        self.f.write(bytes(file_name.ljust(8), "ascii"))
-        self.f.write(bytes(file_ext.ljust(3), "ascii"))
-        self.f.write(entry["ATTRIBUTES"].to_bytes(1, "little"))
-        self.f.write(entry["RESERVED"].to_bytes(1, "little"))
-        self.f.write(entry["CREATION_TENTH_SECOND"].to_bytes(1, "little"))
-        self.f.write(entry["CREATION_TIME"].to_bytes(2, "little"))
-        self.f.write(entry["CREATION_DATE"].to_bytes(2, "little"))
-        self.f.write(entry["ACCESSED_DATE"].to_bytes(2, "little"))
-        self.f.write(entry["HIGHER_CLUSTER"].to_bytes(2, "little"))
-        self.f.write(entry["MODIFIED_TIME"].to_bytes(2, "little"))
-        self.f.write(entry["MODIFIED_DATE"].to_bytes(2, "little"))
-        self.f.write(entry["LOWER_CLUSTER"].to_bytes(2, "little"))
-        self.f.write(entry["SIZE"].to_bytes(4, "little"))
+                if entry.cluster:
+                    links.append((entry.sfn_lba, entry.cluster))
 
-        return True
+                # The links to this directory and its parent don't own a chain.
+                if entry.short_name in (".", ".."):
+                    continue
 
-    # Frees up an entry.
-    def removeEntry(self, entry):
+                if entry.is_directory:
+                    if entry.cluster and entry.cluster not in seen:
+                        seen.add(entry.cluster)
+                        dirs.append(entry.cluster)
+                        dir_chains.append(entry.cluster)
 
-        entries = entry["LFN_LBA"]
-        entries.append(entry["SFN_LBA"])
+                elif entry.cluster and entry.cluster not in seen:
+                    seen.add(entry.cluster)
+                    file_chains.append(entry.cluster)
 
-        # Remove each entry associated with the file.
-        for i in entries:
-            self.f.seek(i)
-            self.f.write(b'\xE5' + bytes(31))
+        # The boot file goes first.
+        if boot_file:
+            found = self.lookupPath(boot_file)
 
-        return True
+            if not found or not found[1]["IS_FILE"]:
+                raise SlitherIOError("FileDoesNotExist", "The file doesn't exist!")
 
-    # Finds free entries and returns a list of LBAs.
-    def findFreeEntry(self, n=1):
+            if found[1]["CLUSTER"] in file_chains:
+                file_chains.remove(found[1]["CLUSTER"])
+                dir_chains.insert(0, found[1]["CLUSTER"])
 
-        # A chain of entries. Needed for LFNs.
-        entries = []
+        # Keep chains that nothing points to at the end.
+        lost_chains = [i for i in self.chainStarts() if i not in seen]
 
-        # We're at the root directory.
-        if not self.dir_cluster:
+        # Give every chain its new clusters, skipping bad clusters.
+        free = (i for i in range(2, last_cluster) if self.fat[i] != 0xFF7)
 
-            # Seek the start of the root directory.
-            self._seek_root()
+        moves = {}
+        new_fat = array("H", [0xFF7 if i == 0xFF7 else 0 for i in self.fat])
+        new_fat[:2] = self.fat[:2]
+        new_starts = {}
 
-            # Start searching for the file.
-            for i in range(self.attr["Dir_Entries"]):
+        for start in dir_chains + file_chains + lost_chains:
+            chain = self.walkChain(start)
+            new_chain = [next(free) for i in chain]
 
-                # Read the entry.
-                fn = self.f.read(32)
+            for old, new in zip(chain, new_chain):
 
-                # Check to see if this is a free entry.
-                if fn[0] in (0x00, 0xE5):
-                    entries.append(self.f.tell()-32)
+                # Two chains share a cluster.
+                if old in moves:
+                    raise SlitherIOError("CrossLinked", "Can't defragment a disk with cross-linked chains!")
 
-                    # Return if we have enough entries.
-                    if len(entries) == n:
-                        return tuple(entries)
-                else:
-                    entries = []
+                moves[old] = new
 
-        else:
+            for i in range(len(new_chain)):
+                new_fat[new_chain[i]] = new_chain[i + 1] if i + 1 < len(new_chain) else 0xFFF
 
-            cluster = self.dir_cluster
+            new_starts[start] = new_chain[0]
 
-            while cluster and (cluster < 0xFF0):
+        # Every cluster may move.
+        self.lockData(data_offset, (last_cluster - 2) * cluster_size)
 
-                # Load the sector.
-                self.f.seek(((cluster-2) * self.attr["Sectors_Per_Cluster"] + self.getFirstDataSector()) * self.attr["Bytes_Per_Sector"])
+        # Lay out the new data area from the old one.
+        old_data = bytes(self.dev.read(data_offset, (last_cluster - 2) * cluster_size))
+        new_data = bytearray(len(old_data))
 
-                # Get a list of the file entry's LBA.
-                for i in range(self.attr["Sectors_Per_Cluster"] * self.attr["Bytes_Per_Sector"] // 32):
-                    # Read the entry.
-                    fn = self.f.read(32)
+        for old, new in moves.items():
+            new_data[(new - 2) * cluster_size:(new - 1) * cluster_size] = old_data[(old - 2) * cluster_size:(old - 1) * cluster_size]
 
-                    # Check to see if this is a free entry.
-                    if fn[0] in (0x00, 0xE5):
-                        entries.append(self.f.tell()-32)
-                        # Return if we have enough entries.
-                        if len(entries) == n:
-                            return tuple(entries)
-                    else:
-                        entries = []
+        for i in range(2, last_cluster):
+            if self.fat[i] == 0xFF7:
+                new_data[(i - 2) * cluster_size:(i - 1) * cluster_size] = old_data[(i - 2) * cluster_size:(i - 1) * cluster_size]
 
-                # Read cluster data.
-                contents += self.f.read(self.attr["Sectors_Per_Cluster"] * self.attr["Bytes_Per_Sector"])
+        # Point every entry at the new start of its chain, wherever the entry ended up.
+        root = bytearray(self.dev.read(root_offset, 32 * self.attr["Dir_Entries"]))
 
-                # Calculate the location of the next cluster.
-                fat_offset = int(cluster * 1.5)
+        for lba, cluster in links:
+            if cluster not in new_starts:
+                continue
 
-                # Check if the current cluster is even or odd.
-                even = cluster & 1
+            fields = (new_starts[cluster] >> 16).to_bytes(2, "little"), (new_starts[cluster] & 0xFFFF).to_bytes(2, "little")
 
-                # Load the next cluster.
-                self.f.seek(self.attr["Reserved_Sectors"]*self.attr["Bytes_Per_Sector"]+fat_offset)
-                cluster = int.from_bytes(self.f.read(2), "little")
+            if lba < data_offset:
+                buf, offset = root, lba - root_offset
+            else:
+                old = (lba - data_offset) // cluster_size + 2
+                buf, offset = new_data, (moves.get(old, old) - 2) * cluster_size + (lba - data_offset) % cluster_size
 
-                # Adjust the 12-bit cluster appropriately.
-                if even:
-                    cluster >>= 4
-                else:
-                    cluster &= 0xFFF
+            buf[offset + 20:offset + 22] = fields[0]
+            buf[offset + 26:offset + 28] = fields[1]
 
-        # Return the chain of entries.
-        return tuple()
+        if root != self.dev.read(root_offset, len(root)):
+            self.dev.write(root_offset, root)
 
+        # Write the clusters that changed, a run at a time.
+        i = 2
+        while i < last_cluster:
+            if new_data[(i - 2) * cluster_size:(i - 1) * cluster_size] == old_data[(i - 2) * cluster_size:(i - 1) * cluster_size]:
+                i += 1
+                continue
 
-    # Reads a directory and returns its content.
-    def readDir(self):
-        contents = bytes()
+            end = i + 1
+            while (end < last_cluster and
+                   new_data[(end - 2) * cluster_size:(end - 1) * cluster_size] != old_data[(end - 2) * cluster_size:(end - 1) * cluster_size]):
+                end += 1
 
-        sector_offsets = []
+            self.dev.write(self.getClusterOffset(i), memoryview(new_data)[(i - 2) * cluster_size:(end - 2) * cluster_size])
 
-        # We're at the root directory.
-        if not self.dir_cluster:
+            i = end
 
-            # Seek the start of the root directory.
-            self._seek_root()
+        # Swap in the new FAT and write out the sectors of it that changed.
+        new_raw = fatcodec.pack(new_fat)
+        bps = self.attr["Bytes_Per_Sector"]
 
-            # Get a list of the file entry's LBA.
-            for i in range(self.attr["Dir_Entries"]):
-                sector_offsets.append(self.f.tell()+i*32)
+        # An entry can straddle two sectors.
+        for i in fatcodec.compare(self.fat_raw, new_raw):
+            self.fat_dirty.add(i * 3 // 2 // bps)
+            self.fat_dirty.add((i * 3 // 2 + 1) // bps)
 
-            # Read the root directory.
-            contents = self.f.read(32*self.attr["Dir_Entries"])
+        self.fat_raw[:len(new_raw)] = new_raw
 
-        else:
+        self.fat = new_fat
+        self.loadFreeMap()
 
-            cluster = self.dir_cluster
+        # The directories moved.
+        self.dir_cluster = new_starts.get(self.dir_cluster, self.dir_cluster)
+        self.dir_cache = {}
+        self.path_index = None
+        self.entry_hints = {}
+
+        self.flush()
+
+        return before, self.fragmentation()
 
-            while cluster and (cluster < 0xFF0):
+    ############################
+    # CHECK FUNCTIONS
+    ############################
 
-                # Load the sector.
-                self.f.seek(((cluster-2) * self.attr["Sectors_Per_Cluster"] + self.getFirstDataSector()) * self.attr["Bytes_Per_Sector"])
+    # Checks the disk for cross-linked clusters, lost chains, file chains that run past
+    # the size of the file, FAT copies that don't match the first FAT, LFN entries
+    # with a bad checksum and bad "." and ".." entries.
+    # The FAT is checked a whole table at a time and each directory is read once.
+    # With repair, whatever is found gets fixed. Returns a report of what was found.
+    # Only a repair needs the write lock.
+    def fsck(self, repair=False):
+        if repair:
+            return self.repairDisk()
 
-                # Get a list of the file entry's LBA.
-                for i in range(self.attr["Sectors_Per_Cluster"] * self.attr["Bytes_Per_Sector"] // 32):
-                    sector_offsets.append(self.f.tell()+(i*32))
+        return self.scanDisk()
 
-                # Read cluster data.
-                contents += self.f.read(self.attr["Sectors_Per_Cluster"] * self.attr["Bytes_Per_Sector"])
+    @readLocked
+    def scanDisk(self):
 
-                # Calculate the location of the next cluster.
-                fat_offset = int(cluster * 1.5)
+        # Make sure the disk is mounted first!
+        if not self.isMounted():
+            raise SlitherIOError("NotMounted", "No disk mounted!")
 
-                # Check if the current cluster is even or odd.
-                even = cluster & 1
+        return self.checkDisk()
 
-                # Load the next cluster.
-                self.f.seek(self.attr["Reserved_Sectors"]*self.attr["Bytes_Per_Sector"]+fat_offset)
-                cluster = int.from_bytes(self.f.read(2), "little")
+    @writeLocked
+    def repairDisk(self):
 
-                # Adjust the 12-bit cluster appropriately.
-                if even:
-                    cluster >>= 4
-                else:
-                    cluster &= 0xFFF
+        # Make sure the disk is mounted first!
+        if not self.isMounted():
+            raise SlitherIOError("NotMounted", "No disk mounted!")
 
-        return contents, sector_offsets
+        # Make sure the disk can be written to.
+        self.dev.checkWritable()
 
-    # Reads the Entry table for the current directory
-    # and returns a dictonary of entries.
-    def getDir(self, vFAT=True):
+        report = self.checkDisk(True)
 
-        entries = {}
+        if report["ERRORS"]:
+            report["REPAIRED"] = True
 
-        dir_data, sector_offsets = self.readDir()
+            # Fixing one problem can turn up another, like the "." entry of a copied directory.
+            for i in range(4):
+                if not self.checkDisk(True)["ERRORS"]:
+                    break
 
-        offset_count = 0
+        return report
 
-        # LFN holder
-        LFN = []
+    # Runs one pass of fsck().
+    def checkDisk(self, repair=False):
 
-        # Start searching through the root directory.
-        while dir_data:
+        # A repair starts from what's on the disk, not what's waiting to be written.
+        if repair:
+            self.flush()
 
-            # Read the entry.
-            fn = dir_data[:32]
-            dir_data = dir_data[32:]
+        cluster_size = self.getClusterSize()
 
-            # If this entry is empty, we're done.
-            if not fn[0]:
-                break
+        report = {"CROSS_LINKS": set(self.crossLinks()),
+                  "LOST_CHAINS": [],
+                  "LONG_CHAINS": [],
+                  "FAT_MISMATCHES": [i + 2 for i, clusters in enumerate(self.compareFATs()) if clusters],
+                  "BAD_LFNS": [],
+                  "BAD_DOT_ENTRIES": [],
+                  "ERRORS": 0,
+                  "REPAIRED": False}
 
-            # If this entry is free, skip to the next.
-            elif fn[0] == 0xE5:
-                pass
+        # Walk the tree, giving every cluster to the first entry whose chain reaches it.
+        owners = []
+        owned = set()
+        shared = []
+        bad_lfns = []
+        bad_dots = []
 
-            # FIX!
-            # Check to see if this is a vFAT entry.
-            elif vFAT and fn[11] == self.attr_flags["LFN"]:
-                name_part = fn[1:11] + fn[14:26] + fn[28:32]
-                name_part = name_part.decode("utf-16-le")
-
-                # If this is the end of the LFN, cut off the excess.
-                if "\u0000" in name_part:
-                    name_part = name_part.split("\u0000")[0]
-
-                LFN.append((int(fn[0]), int(fn[13]), name_part, sector_offsets[0]))
-
-           # Otherwise this is a 8.3 entry.
-            elif not (fn[11] & self.attr_flags["VOLUME_ID"] or fn[11] & self.attr_flags["LFN"]) :
-
-                entry = {}
-
-                # Read the entry.
-                entry["SHORT_NAME"] = fn[:8].decode(encoding="ascii").rstrip()
-                entry["SHORT_EXT"] = fn[8:11].decode(encoding="ascii").rstrip()
-                entry["ATTRIBUTES"] = int(fn[11])
-                entry["IS_READ_ONLY"] = bool(entry["ATTRIBUTES"] & self.attr_flags["READ_ONLY"])
-                entry["IS_HIDDEN"] = bool(entry["ATTRIBUTES"] & self.attr_flags["HIDDEN"])
-                entry["IS_SYSTEM"] = bool(entry["ATTRIBUTES"] & self.attr_flags["SYSTEM"])
-                entry["IS_VOLUME_ID"] = bool(entry["ATTRIBUTES"] & self.attr_flags["VOLUME_ID"])
-                entry["IS_DIRECTORY"] = bool(entry["ATTRIBUTES"] & self.attr_flags["DIRECTORY"])
-                entry["IS_ARCHIVE"] = bool(entry["ATTRIBUTES"] & self.attr_flags["ARCHIVE"])
-                entry["IS_FILE"] = not (entry["IS_VOLUME_ID"] or entry["IS_DIRECTORY"])
-                entry["RESERVED"] = int(fn[12])
-                entry["CREATION_TENTH_SECOND"] = int(fn[13])
-                entry["CREATION_TIME"] = int.from_bytes(fn[14:16], "little")
-                entry["CREATION_TIME_SECOND"] = (entry["CREATION_TIME"] & 0x1F) * 2
-                entry["CREATION_TIME_MINUTE"] = (entry["CREATION_TIME"] >> 5) & 0x3F
-                entry["CREATION_TIME_HOUR"] = (entry["CREATION_TIME"] >> 11) & 0x1F
-                entry["CREATION_TIME_STR"] = "{:0>2}:{:0>2}:{:0>2}".format(entry["CREATION_TIME_HOUR"], entry["CREATION_TIME_MINUTE"], entry["CREATION_TIME_SECOND"])
-                entry["CREATION_DATE"] = int.from_bytes(fn[16:18], "little")
-                entry["CREATION_DATE_DAY"] = entry["CREATION_DATE"] & 0x1F
-                entry["CREATION_DATE_MONTH"] = (entry["CREATION_DATE"] >> 5) & 0xF
-                entry["CREATION_DATE_YEAR"] = ((entry["CREATION_DATE"] >> 9) & 0x7F) + 1980
-                entry["CREATION_DATE_STR"] = "{:0>2}/{:0>2}/{}".format(entry["CREATION_DATE_MONTH"], entry["CREATION_DATE_DAY"], entry["CREATION_DATE_YEAR"]) #MMDDYYYY
-                entry["ACCESSED_DATE"] = int.from_bytes(fn[18:20], "little")
-                entry["ACCESSED_DATE_DAY"] = entry["ACCESSED_DATE"] & 0x1F
-                entry["ACCESSED_DATE_MONTH"] = (entry["ACCESSED_DATE"] >> 5) & 0xF
-                entry["ACCESSED_DATE_YEAR"] = ((entry["ACCESSED_DATE"] >> 9) & 0x7F) + 1980
-                entry["ACCESSED_DATE_STR"] = "{:0>2}/{:0>2}/{}".format(entry["ACCESSED_DATE_MONTH"], entry["ACCESSED_DATE_DAY"], entry["ACCESSED_DATE_YEAR"]) #MMDDYYYY
-                entry["HIGHER_CLUSTER"] = int.from_bytes(fn[20:22], "little")
-                entry["MODIFIED_TIME"] = int.from_bytes(fn[22:24], "little")
-                entry["MODIFIED_TIME_SECOND"] = (entry["MODIFIED_TIME"] & 0x1F) * 2
-                entry["MODIFIED_TIME_MINUTE"] = (entry["MODIFIED_TIME"] >> 5) & 0x3F
-                entry["MODIFIED_TIME_HOUR"] = (entry["MODIFIED_TIME"] >> 11) & 0x1F
-                entry["MODIFIED_TIME_STR"] = "{:0>2}:{:0>2}:{:0>2}".format(entry["MODIFIED_TIME_HOUR"], entry["MODIFIED_TIME_MINUTE"], entry["MODIFIED_TIME_SECOND"])
-                entry["MODIFIED_DATE"] = int.from_bytes(fn[24:26], "little")
-                entry["MODIFIED_DATE_DAY"] = entry["MODIFIED_DATE"] & 0x1F
-                entry["MODIFIED_DATE_MONTH"] = (entry["MODIFIED_DATE"] >> 5) & 0xF
-                entry["MODIFIED_DATE_YEAR"] = ((entry["MODIFIED_DATE"] >> 9) & 0x7F) + 1980
-                entry["MODIFIED_DATE_STR"] = "{:0>2}/{:0>2}/{}".format(entry["MODIFIED_DATE_MONTH"], entry["MODIFIED_DATE_DAY"], entry["MODIFIED_DATE_YEAR"]) #MMDDYYYY
-                entry["LOWER_CLUSTER"] = int.from_bytes(fn[26:28], "little")
-                entry["CLUSTER"] = (entry["HIGHER_CLUSTER"] << 16) + entry["LOWER_CLUSTER"]
-                entry["SIZE"] = int.from_bytes(fn[28:32], "little")
-                entry["SIZE_ON_DISK"] = self.getChain(len(self.getChain(entry["CLUSTER"]))*self.attr["Sectors_Per_Cluster"] * self.attr["Bytes_Per_Sector"])
-
-                # Check for a LFN.
-                entry["LONG_FILE_NAME"] = ""
-
-                # Make sure the checksum matches.
-                LFN = [i for i in LFN if self.checksumLFN(entry["SHORT_NAME"].ljust(8)+entry["SHORT_EXT"].ljust(3), i[1])]
-
-                for i in LFN[::-1]:
-                    entry["LONG_FILE_NAME"] += i[2]
-
-                # Generate a name for the file/directory.
-                if entry["IS_DIRECTORY"] or not entry["SHORT_EXT"]:
-                    entry["SHORT_FILE_NAME"] = entry["SHORT_NAME"]
-                else:
-                    entry["SHORT_FILE_NAME"] = "{}.{}".format(entry["SHORT_NAME"], entry["SHORT_EXT"])
+        dirs = [(0, 0, "/")]
+        seen = {0}
+
+        for cluster, parent, path in dirs:
+
+            # Read subdirectories without following a chain that loops.
+            if cluster:
+                chain = self.walkChain(cluster)
+                region_offsets = [self.getClusterOffset(i) for i in chain]
+                region_size = cluster_size
+                dir_data = self.readClusters(chain)
+            else:
+                dir_data, region_offsets, region_size = self.readDir(0)
+
+            # Whole long names of entries that lose them, by the LBA of the 8.3 entry.
+            long_names = {}
+
+            # Every LFN entry has to come right before the 8.3 entry it belongs to.
+            lfn = []
+            for index, fn in enumerate(SFN_ENTRY.iter_unpack(dir_data)):
+                lba = region_offsets[index*32 // region_size] + index*32 % region_size
+
+                if fn[0][0] in (0, 0xE5):
+                    bad_lfns.extend(i[0] for i in lfn)
+                    lfn = []
 
-                # Get the file entry's location in LBA.
-                entry["SFN_LBA"] = sector_offsets[0]
-                entry["LFN_LBA"] = [i[3] for i in LFN]
+                    if not fn[0][0]:
+                        break
+
+                elif fn[2] == self.attr_flags["LFN"]:
+                    lfn.append((lba, LFN_ENTRY.unpack_from(dir_data, index*32)))
 
-                # Set the file entry name.
-                if entry["LONG_FILE_NAME"]:
-                    entry["FILE_NAME"] = entry["LONG_FILE_NAME"]
                 else:
-                    entry["FILE_NAME"] = entry["SHORT_FILE_NAME"]
+                    cs = self.gensumLFN((fn[0] + fn[1]).decode("latin-1"))
 
-                # Add the entry to the list of entries.
-                entries[entry["FILE_NAME"]] = entry
+                    # One bad part spoils the whole name, or what's left would cut it short.
+                    # The report still names the entry by all of it.
+                    if any(i[1][4] != cs for i in lfn):
+                        bad_lfns.extend(i[0] for i in lfn)
 
-                # Clean up the LFN for the next entry.
-                LFN = []
+                        long_name = self.joinLFN([i[1] for i in lfn])
+                        if long_name:
+                            long_names[lba] = long_name
 
-            del sector_offsets[0]
+                    lfn = []
 
-        return entries
+            bad_lfns.extend(i[0] for i in lfn)
 
-    ############################
-    # FILE FUNCTIONS
-    ############################
+            report["BAD_LFNS"].extend([path] * (len(bad_lfns) - len(report["BAD_LFNS"])))
 
-    # Creates a new, empty file.
-    # TODO
-    def newFile(self, file):
-        pass
+            # A subdirectory starts with a link to itself and a link to its parent.
+            if cluster:
+                dots = 0
 
-    # Get the contents of a file off the disk.
-    def readFile(self, file, vFAT=False):
+                for index, link in enumerate((cluster, parent)):
+                    fn = SFN_ENTRY.unpack_from(dir_data, index*32)
+                    name = b".".ljust(index + 1, b".").ljust(11)
 
-        # Make sure the disk is mounted first!
-        if not self.isMounted():
-            raise SlitherIOError("NotMounted", "No disk mounted!")
+                    if fn[0] + fn[1] != name or fn[11] != link or not fn[2] & self.attr_flags["DIRECTORY"]:
+                        dots += 1
 
-        # Read the current directory.
-        e = self.getDir()
+                        # Only a link or a free entry can be written over.
+                        if fn[0] + fn[1] == name or fn[0][0] in (0, 0xE5):
+                            bad_dots.append((region_offsets[0] + index*32, name, link))
 
-        # Make sure the file exists.
-        if file not in [i for i in e if e[i]["IS_FILE"]]:
-            raise SlitherIOError("FileDoesNotExist", "The file doesn't exist!")
+                if dots:
+                    report["BAD_DOT_ENTRIES"].append(path)
 
-        # Return the file's content.
-        return self.readChain(e[file]["CLUSTER"])[:e[file]["SIZE"]]
+            for entry in self.parseDir(dir_data, region_offsets, region_size).values():
 
-    def writeFile(self, file, contents):
+                # The links to this directory and its parent don't own a chain.
+                if entry.short_name in (".", ".."):
+                    continue
 
-        # Make sure the disk is mounted first!
-        if not self.isMounted():
-            raise SlitherIOError("NotMounted", "No disk mounted!")
+                chain = self.walkChain(entry.cluster)
 
-        # If the file exists, delete it because we're overwriting it.
-        if self.fileExists(file):
-            self.deleteFile(file)
+                for i in range(len(chain)):
+                    if chain[i] in owned:
+                        report["CROSS_LINKS"].add(chain[i])
+                        shared.append((len(owners), i))
+                        break
 
-        elif self.doesExist(file):
-            raise SlitherIOError("NotFile", "Can't write to a nonfile!")
+                    owned.add(chain[i])
 
-        file_size = len(contents)
+                # The chain shouldn't have more clusters than the file needs.
+                long_chain = entry.is_file and len(chain) > -(-entry.size // cluster_size)
 
-        # Find the number of clusters needed.
-        sectors = file_size // self.attr["Bytes_Per_Sector"]
+                name = long_names.get(entry.sfn_lba, entry.file_name)
 
-        # Fit the last data into the size of a sector, if needed.
-        if file_size % self.attr["Bytes_Per_Sector"]:
-            contents += b'\x00' * (self.attr["Bytes_Per_Sector"] - (file_size % self.attr["Bytes_Per_Sector"]))
-            sectors += 1
+                if long_chain:
+                    report["LONG_CHAINS"].append(path + name)
 
-        # Make a cluster chain.
-        cluster_chain = self.makeChain(sectors)
+                owners.append([entry, entry.cluster, long_chain])
 
-        # Write the data to the disk.
-        for cluster in cluster_chain:
-            self.writeCluster(cluster, contents[:self.attr["Sectors_Per_Cluster"] * self.attr["Bytes_Per_Sector"]])
-            contents = contents[self.attr["Sectors_Per_Cluster"] * self.attr["Bytes_Per_Sector"]:]
+                if entry.is_directory and entry.cluster and entry.cluster not in seen:
+                    seen.add(entry.cluster)
+                    dirs.append((entry.cluster, cluster, path + name + "/"))
 
-        # Update the entry.
-        entry = {}
-        entry["FILE_NAME"] = file
-        entry["ATTRIBUTES"] = 0
-        entry["RESERVED"] = 0
-        entry["CREATION_TENTH_SECOND"] = 0
-        entry["CREATION_TIME"] = int.from_bytes(self.getTime(), "little")
-        entry["CREATION_DATE"] = int.from_bytes(self.getDate(), "little")
-        entry["ACCESSED_DATE"] = int.from_bytes(self.getDate(), "little")
-        entry["HIGHER_CLUSTER"] = 0
-        entry["MODIFIED_TIME"] = int.from_bytes(self.getTime(), "little")
-        entry["MODIFIED_DATE"] = int.from_bytes(self.getDate(), "little")
-        entry["LOWER_CLUSTER"] = cluster_chain[0]
-        entry["SIZE"] = file_size
+        # Chains that no entry reaches are lost.
+        report["LOST_CHAINS"] = [i for i in self.chainStarts() if i not in owned]
+        report["CROSS_LINKS"] = sorted(report["CROSS_LINKS"])
 
-        # Create the new entry within the directory.
-        self.newEntry(file, entry)
+        report["ERRORS"] = sum(len(report[i]) for i in ("CROSS_LINKS", "LOST_CHAINS", "LONG_CHAINS",
+                                                        "FAT_MISMATCHES", "BAD_LFNS", "BAD_DOT_ENTRIES"))
 
-        return True
+        if not repair or not report["ERRORS"]:
+            return report
 
-    # Appends a file.
-    # TODO
-    def appendFile(self, file):
-        pass
+        # Free the lost chains, up to where they run into a chain that's in use.
+        for start in report["LOST_CHAINS"]:
+            for cluster in self.walkChain(start):
+                if cluster in owned:
+                    break
 
+                self.setFAT(cluster, 0)
 
-    # Rename a file.
-    def renameFile(self, old_name, new_name):
+        # Give each entry that runs into another entry's chain its own copy of the rest.
+        for index, i in shared:
+            entry, start, long_chain = owners[index]
+            chain = self.walkChain(start)
 
-        # Make sure the disk is mounted first!
-        if not self.isMounted():
-            raise SlitherIOError("NotMounted", "No disk mounted!")
+            new_chain = self.makeChain(len(chain) - i)
+            self.writeClusters(new_chain, b"".join([bytes(self.readCluster(c)) for c in chain[i:]]))
 
-        # Read the current directory.
-        e = self.getDir()
+            if i:
+                self.setFAT(chain[i - 1], new_chain[0])
+            else:
+                self.setEntryCluster(entry.sfn_lba, new_chain[0])
+                owners[index][1] = new_chain[0]
 
-        # Make sure the file exists.
-        if not self.fileExists(old_name):
-            raise SlitherIOError("FileDoesNotExist", "The file doesn't exist!")
+        # Cut file chains down to the size of the file.
+        for entry, start, long_chain in owners:
+            if long_chain:
+                new_start = self.setChain(start, -(-entry.size // cluster_size))
 
-        # Make sure the new file name isn't already taken!
-        if self.fileExists(new_name):
-            raise SlitherIOError("FileExists", "The new file name already exists!")
+                if new_start != start:
+                    self.setEntryCluster(entry.sfn_lba, new_start)
 
-        
+        for lba, name, link in bad_dots:
+            self.dev.write(lba, SFN_ENTRY.pack(name[:8], name[8:], self.attr_flags["DIRECTORY"],
+                                               0, 0, 0, 0, 0, 0, 0, 0, link, 0))
 
-        # Edit the directory entry.
-        self.editEntry(old_name, e[old_name], {"FILE_NAME": new_name})
+        # Free the LFN entries that don't belong to anything.
+        for lba in bad_lfns:
+            self.dev.write(lba, b"\xE5")
 
-        return True
+        # Write the whole first FAT over every copy.
+        if report["FAT_MISMATCHES"]:
+            self.fat_dirty.update(range(self.attr["Sectors_Per_FAT"]))
 
-    # Deletes a file if it exists.
-    def deleteFile(self, file):
+        self.dir_cache = {}
+        self.path_index = None
+        self.entry_hints = {}
 
-        # Make sure the disk is mounted first!
-        if not self.isMounted():
-            raise SlitherIOError("NotMounted", "No disk mounted!")
+        self.flush()
 
-        # Read the current directory.
-        e = self.getDir()
+        return report
 
-        # Make sure the file exists.
-        if file not in [i for i in e if e[i]["IS_FILE"]]:
-            raise SlitherIOError("FileDoesNotExist", "The file doesn't exist!")
+    # Points the 8.3 entry at the LBA at another cluster.
+    def setEntryCluster(self, lba, cluster):
+        self.dev.write(lba + 20, (cluster >> 16).to_bytes(2, "little"))
+        self.dev.write(lba + 26, (cluster & 0xFFFF).to_bytes(2, "little"))
 
-        # Remove the file entries associated with the file.
-        self.removeEntry(e[file])
+# Checks a disk image with fsck(), repairing it if asked to.
+# Returns the report, or a report with just an ERROR if the image couldn't be checked.
+def checkImage(path, repair=False):
 
-        # Remove the cluster chain associated with the file.
-        self.deleteChain(e[file]["CLUSTER"])
+    disk = FAT12()
 
-        return True
+    try:
+        if not disk.mount(path, "memory" if repair else "file", not repair):
+            return {"ERROR": "Unable to mount the disk!"}
 
-    # Change to writeFile.
-    def addFile(self, file, contents):
-        self.writeFile(file, contents)
+        try:
+            return disk.fsck(repair)
+        finally:
+            disk.unmount()
 
-    def addBootloader(self, file, contents):
-        # Make sure the disk is mounted first!
-        if not self.isMounted():
-            raise SlitherIOError("NotMounted", "No disk mounted!")
+    except SlitherIOError as e:
+        return {"ERROR": e.msg}
 
-        # Fit the last data into the size of a sector, if needed.
-        if len(contents) % self.attr["Bytes_Per_Sector"]:
-            contents += b'\x00' * (self.attr["Bytes_Per_Sector"] - (len(contents) % self.attr["Bytes_Per_Sector"]))
+    except (OSError, ValueError, IndexError, struct.error):
+        return {"ERROR": "Unable to read the disk!"}
+
+# Checks many disk images at once with a process for each core.
+# Returns a dictonary of the report for each image.
+def checkImages(paths, repair=False, workers=None):
+
+    paths = list(paths)
+
+    if not workers:
+        workers = os.cpu_count() or 1
 
-        self.f.seek(0)
+    with ProcessPoolExecutor(workers) as pool:
+        reports = pool.map(checkImage, paths, [repair] * len(paths),
+                           chunksize=max(1, len(paths) // (workers * 4)))
 
-        self.f.write(contents)
+        return dict(zip(paths, reports))
 
 if __name__ == "__main__":
     a = FAT12()
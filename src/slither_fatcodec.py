@@ -0,0 +1,132 @@
+# FAT12 Table Codec
+# Slither
+
+# Packs and unpacks whole FAT12 tables and runs whole-table jobs on them.
+# Tables are unpacked into an array("H") of 12-bit entries, which NumPy can
+# work on in place. Without NumPy, everything falls back to plain Python.
+
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Check to see if NumPy is doing the work.
+def hasNumpy():
+    return numpy is not None
+
+# Unpacks a packed FAT12 table into an array of 12-bit entries.
+# Every 3 bytes hold 2 entries. Bytes left over at the end are ignored.
+def unpack(raw):
+
+    size = len(raw) - len(raw) % 3
+
+    if numpy is not None:
+        data = numpy.frombuffer(raw, dtype=numpy.uint8, count=size).reshape(-1, 3).astype(numpy.uint16)
+
+        fat = numpy.empty(len(data) * 2, dtype=numpy.uint16)
+        fat[0::2] = data[:, 0] | ((data[:, 1] & 0x0F) << 8)
+        fat[1::2] = (data[:, 1] >> 4) | (data[:, 2] << 4)
+
+        return array("H", fat.tobytes())
+
+    raw = bytes(raw[:size])
+
+    fat = array("H", bytes(size // 3 * 4))
+    fat[0::2] = array("H", [a + ((b & 0x0F) << 8) for a, b in zip(raw[0::3], raw[1::3])])
+    fat[1::2] = array("H", [(b >> 4) + (c << 4) for b, c in zip(raw[1::3], raw[2::3])])
+
+    return fat
+
+# Packs an array of 12-bit entries back into a FAT12 table.
+def pack(fat):
+
+    size = len(fat) - len(fat) % 2
+
+    if numpy is not None:
+        entries = numpy.frombuffer(fat, dtype=numpy.uint16, count=size).reshape(-1, 2)
+
+        raw = numpy.empty((len(entries), 3), dtype=numpy.uint8)
+        raw[:, 0] = entries[:, 0] & 0xFF
+        raw[:, 1] = ((entries[:, 0] >> 8) & 0x0F) | ((entries[:, 1] << 4) & 0xF0)
+        raw[:, 2] = (entries[:, 1] >> 4) & 0xFF
+
+        return bytearray(raw.tobytes())
+
+    even = fat[0:size:2]
+    odd = fat[1:size:2]
+
+    raw = bytearray(size // 2 * 3)
+    raw[0::3] = bytes(a & 0xFF for a in even)
+    raw[1::3] = bytes(((a >> 8) & 0x0F) | ((b << 4) & 0xF0) for a, b in zip(even, odd))
+    raw[2::3] = bytes((b >> 4) & 0xFF for b in odd)
+
+    return raw
+
+# Returns a map of the free clusters between start and end, 1 is free.
+# The map covers the whole table, clusters outside the range are never free.
+def freeMap(fat, start, end):
+
+    free = bytearray(len(fat))
+
+    if numpy is not None:
+        entries = numpy.frombuffer(fat, dtype=numpy.uint16)
+        free[start:end] = (entries[start:end] == 0).astype(numpy.uint8).tobytes()
+    else:
+        free[start:end] = bytes(not i for i in fat[start:end])
+
+    return free
+
+# Returns the first cluster of every chain between start and end.
+# A chain starts at a used cluster that no other cluster points to.
+def chainStarts(fat, start, end):
+
+    if numpy is not None:
+        entries = numpy.frombuffer(fat, dtype=numpy.uint16)[start:end]
+
+        used = (entries != 0) & (entries != 0xFF7)
+
+        targets = entries[used]
+        targets = targets[(targets >= start) & (targets < end)]
+
+        pointed = numpy.zeros(end - start, dtype=bool)
+        pointed[targets - start] = True
+
+        return (numpy.flatnonzero(used & ~pointed) + start).tolist()
+
+    used = [i for i in range(start, end) if fat[i] and fat[i] != 0xFF7]
+    pointed = {fat[i] for i in used}
+
+    return [i for i in used if i not in pointed]
+
+# Returns the clusters between start and end that more than one cluster points to.
+def crossLinks(fat, start, end):
+
+    if numpy is not None:
+        entries = numpy.frombuffer(fat, dtype=numpy.uint16)[start:end]
+
+        targets = entries[(entries >= start) & (entries < end)]
+
+        return (numpy.flatnonzero(numpy.bincount(targets - start, minlength=end - start) > 1) + start).tolist()
+
+    counts = {}
+    for i in fat[start:end]:
+        if start <= i < end:
+            counts[i] = counts.get(i, 0) + 1
+
+    return sorted(i for i in counts if counts[i] > 1)
+
+# Returns the clusters whose entries differ between two packed FAT12 tables.
+def compare(raw_a, raw_b):
+
+    a = unpack(raw_a)
+    b = unpack(raw_b)
+
+    size = min(len(a), len(b))
+
+    if numpy is not None:
+        return numpy.flatnonzero(numpy.frombuffer(a, dtype=numpy.uint16, count=size) !=
+                                 numpy.frombuffer(b, dtype=numpy.uint16, count=size)).tolist()
+
+    return [i for i in range(size) if a[i] != b[i]]
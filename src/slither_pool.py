@@ -0,0 +1,297 @@
+# Pool of Mounted Disks
+# Slither
+
+# Keeps disk images mounted between uses, so a service that opens the same images
+# again and again doesn't pay for the mount, the FAT load and the caches every time.
+
+import os
+import threading
+import contextlib
+from collections import OrderedDict
+
+from slither_fat12 import *
+
+# A mounted disk in the pool and what its image looked like when it was last checked.
+class PoolEntry:
+
+    def __init__(self, path):
+        self.path = path
+        self.disk = FAT12()
+
+        # None until the disk is mounted.
+        self.stamp = None
+
+        # Set once the mount is done, with the error if it failed.
+        self.ready = threading.Event()
+        self.error = None
+
+        # Set once the disk has been unmounted.
+        self.closed = threading.Event()
+
+        # Number of callers using the disk. A disk in use is never unmounted.
+        self.users = 0
+
+        # Set once the disk has left the pool, so the last user unmounts it.
+        self.stale = False
+
+# Keeps up to size disk images mounted, unmounting the least recently used first.
+# An image is mounted again if its inode, modified time or size has changed.
+# The pool's lock only guards its map. Mounts, flushes and unmounts happen outside
+# of it, so a slow image never holds up callers using other images.
+class ImagePool:
+
+    def __init__(self, size=8, mode="file", readonly=False, locking="whole", timeout=LOCK_TIMEOUT):
+        self.size = size
+
+        # How every disk in the pool is mounted.
+        self.mode = mode
+        self.readonly = readonly
+        self.locking = locking
+        self.timeout = timeout
+
+        # Pooled disks keyed by the full path of their image, least recently used first.
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        # Disks that left the pool and are being unmounted, keyed by path.
+        # An image is only mounted again once its old disk is gone.
+        self.closing = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    # Returns what identifies a version of the image.
+    def getStamp(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            raise SlitherIOError("ImageDoesNotExist", "The disk image doesn't exist!")
+
+        return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+    # Mounts a disk image, or uses the one in the pool, for the length of a with block.
+    # Changes are flushed once the last caller using the disk is done with it.
+    # Callers that need a current directory should work through disk.handle().
+    @contextlib.contextmanager
+    def open(self, path):
+        entry = self.acquire(path)
+
+        try:
+            yield entry.disk
+        finally:
+            self.release(entry)
+
+    def acquire(self, path):
+        path = os.path.abspath(path)
+
+        while True:
+            with self.lock:
+                old = self.closing.get(path)
+
+                if not old:
+                    entry, mount, closing = self.lookup(path)
+                    break
+
+            old.closed.wait()
+
+        if not mount:
+            try:
+                self.unmountAll(closing)
+            except Exception:
+                self.release(entry)
+                raise
+
+            entry.ready.wait()
+
+            if entry.error:
+                self.release(entry)
+                raise entry.error
+
+            return entry
+
+        # Only this caller mounts the disk, anyone else after it waits for the mount.
+        # The old disk of the image, if any, is unmounted first.
+        try:
+            self.unmountAll(closing)
+
+            if not entry.disk.mount(path, self.mode, self.readonly, self.locking, self.timeout):
+                raise SlitherIOError("ImageDoesNotExist", "The disk image doesn't exist!")
+
+            entry.stamp = self.getStamp(path)
+
+        except Exception as e:
+            entry.error = e
+
+            with self.lock:
+                if self.entries.get(path) is entry:
+                    del self.entries[path]
+
+                entry.stale = True
+                entry.users -= 1
+
+            entry.ready.set()
+
+            raise
+
+        entry.ready.set()
+
+        return entry
+
+    # Finds or adds the pool's entry for a path. Returns the entry, whether the
+    # caller has to mount it and the disks that have to be unmounted.
+    # Only called with the pool's lock held.
+    def lookup(self, path):
+        # Stat first, so a missing image never changes the pool.
+        stamp = self.getStamp(path)
+
+        closing = []
+        entry = self.entries.get(path)
+
+        # While the disk is in use or being mounted, the image only changes through it.
+        if entry and (entry.users or entry.stamp is None or entry.stamp == stamp):
+            self.entries.move_to_end(path)
+            self.hits += 1
+            mount = False
+
+        else:
+            if entry:
+                self.invalidations += 1
+                closing += self.remove(path)
+
+            self.misses += 1
+
+            entry = PoolEntry(path)
+            self.entries[path] = entry
+            mount = True
+
+        # Counted before evicting, so the disk being handed out stays.
+        entry.users += 1
+        closing += self.evict()
+
+        return entry, mount, closing
+
+    def release(self, entry):
+        with self.lock:
+
+            # Only the last user of a pooled disk flushes it.
+            if entry.users > 1 or entry.stale or entry.error:
+                entry.users -= 1
+
+                closing = []
+                if entry.stale and not entry.users and not entry.error:
+                    closing = self.retire(entry)
+
+            else:
+                closing = None
+
+        if closing is not None:
+            self.unmountAll(closing)
+            return
+
+        # Still counted as a user, so the disk can't be unmounted while it's flushed.
+        # Anything written has to reach the image before its stamp is taken again.
+        try:
+            if not self.readonly:
+                entry.disk.flush()
+
+        finally:
+            try:
+                stamp = self.getStamp(entry.path)
+            except SlitherIOError:
+                stamp = None
+
+            with self.lock:
+                entry.users -= 1
+
+                closing = []
+
+                # Someone else came in while it was flushed and will stamp it instead.
+                if entry.users:
+                    pass
+
+                elif entry.stale:
+                    closing = self.retire(entry)
+
+                elif stamp is None:
+                    self.invalidations += 1
+                    closing = self.remove(entry.path)
+
+                else:
+                    entry.stamp = stamp
+                    closing = self.evict()
+
+            self.unmountAll(closing)
+
+    # Picks the least recently used disks that aren't in use until the pool fits.
+    # Returns the disks to unmount. Only called with the pool's lock held.
+    def evict(self):
+        closing = []
+
+        for path in list(self.entries):
+            if len(self.entries) <= self.size:
+                break
+
+            entry = self.entries[path]
+
+            # A disk being mounted counts as in use.
+            if not entry.users:
+                self.evictions += 1
+                closing += self.remove(path)
+
+        return closing
+
+    # Takes a disk out of the pool. Returns it to be unmounted now,
+    # or nothing if it's in use and its last user will unmount it.
+    # Only called with the pool's lock held.
+    def remove(self, path):
+        entry = self.entries.pop(path)
+        entry.stale = True
+
+        if entry.users:
+            return []
+
+        return self.retire(entry)
+
+    # Marks a disk that left the pool as being unmounted. Only called with the pool's lock held.
+    def retire(self, entry):
+        self.closing[entry.path] = entry
+        return [entry]
+
+    # Unmounts disks outside of the pool's lock, which writes out anything pending.
+    def unmountAll(self, entries):
+        for entry in entries:
+            try:
+                entry.disk.unmount()
+
+            finally:
+                with self.lock:
+                    if self.closing.get(entry.path) is entry:
+                        del self.closing[entry.path]
+
+                entry.closed.set()
+
+    # Returns how well the pool is doing.
+    def stats(self):
+        with self.lock:
+            return {"HITS": self.hits,
+                    "MISSES": self.misses,
+                    "EVICTIONS": self.evictions,
+                    "INVALIDATIONS": self.invalidations,
+                    "MOUNTED": len(self.entries)}
+
+    # Unmounts every disk in the pool. Disks still in use are unmounted by their last user.
+    def close(self):
+        with self.lock:
+            closing = []
+            for path in list(self.entries):
+                closing += self.remove(path)
+
+        self.unmountAll(closing)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
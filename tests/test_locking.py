@@ -0,0 +1,145 @@
+# Tests for locking disk images against other processes.
+# Run them from the top of the repository: py -3 -m unittest discover tests
+
+import os
+import sys
+import queue
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+
+from slither_fat12 import *
+
+# formats.ini is read from the working directory.
+def setUpModule():
+    global old_cwd
+
+    old_cwd = os.getcwd()
+    os.chdir(SRC)
+
+def tearDownModule():
+    os.chdir(old_cwd)
+
+# Makes a formatted image with a directory and a file in it.
+def makeImage(path):
+    open(path, "wb").close()
+
+    disk = FAT12()
+    disk.mount(path, "memory", locking="none")
+    disk.formatDisk("IBM PC 3.5IN 1.44MB")
+    disk.makeDir("APPS")
+    disk.writeFile("APPS/calc program.bin", bytes(3000))
+    disk.unmount()
+
+# Mounts an image in another process once it can be locked and sends back what's in the root.
+def listRoot(path, locking, results):
+    disk = FAT12()
+    disk.mount(path, locking=locking, timeout=10)
+    results.put(sorted(disk.getDir()))
+    disk.unmount()
+
+class LockingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp(prefix="slither-test-")
+        self.image = os.path.join(self.work, "test.flp")
+        makeImage(self.image)
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def testReadOnlyRangeMount(self):
+        disk = FAT12()
+        disk.mount(self.image, readonly=True, locking="range")
+
+        disk.goDir("APPS")
+        self.assertEqual(disk.path, "./APPS/")
+        self.assertEqual(disk.readFile("calc program.bin"), bytes(3000))
+
+        self.assertEqual(disk.fsck()["ERRORS"], 0)
+        self.assertEqual(disk.compareFATs(), [[]])
+
+        with self.assertRaises(SlitherIOError):
+            disk.writeFile("NEW.TXT", b"new")
+
+        self.assertTrue(disk.unmount())
+
+        # Nothing was left locked, so it mounts again.
+        disk.mount(self.image, locking="range")
+        disk.unmount()
+
+    @unittest.skipUnless(fcntl and "fork" in multiprocessing.get_all_start_methods(), "needs fcntl and fork")
+    def testReplacedImageStaysLocked(self):
+        for locking in ("whole", "range"):
+            with self.subTest(locking=locking):
+                makeImage(self.image)
+                self.checkReplacedImage(locking)
+
+    # A process waiting for the lock while a memory mount replaces the image has to wait
+    # for the new image, and then read it instead of the old one.
+    def checkReplacedImage(self, locking):
+        disk = FAT12()
+        disk.mount(self.image, "memory")
+
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+        other = context.Process(target=listRoot, args=(self.image, locking, results))
+        other.start()
+
+        try:
+            # Let the other process start waiting for the lock on the old image.
+            time.sleep(0.5)
+
+            disk.writeFile("NEW.TXT", b"new")
+            disk.commit()
+
+            # The new image is still locked, so the other process keeps waiting.
+            with self.assertRaises(queue.Empty):
+                results.get(timeout=1)
+
+            disk.unmount()
+
+            self.assertIn("NEW.TXT", results.get(timeout=10))
+
+        finally:
+            disk.unmount()
+            other.join(10)
+
+        self.assertEqual(other.exitcode, 0)
+
+    def testFailedMountUnlocks(self):
+        with open(self.image, "r+b") as f:
+            f.write(b"\xFF" * 62)
+
+        disk = FAT12()
+        with self.assertRaises(Exception):
+            disk.mount(self.image)
+
+        self.assertFalse(disk.isMounted())
+        self.assertEqual(LOCKED_IMAGES, {})
+
+        # Once the image is fixed, it mounts in this process again.
+        makeImage(self.image)
+        self.assertTrue(disk.mount(self.image))
+        disk.unmount()
+
+    def testFailedBuildUnlocks(self):
+        manifest = os.path.join(self.work, "image.ini")
+        with open(manifest, "w") as f:
+            f.write("[image]\nformat = IBM PC 3.5IN 1.44MB\n\n[MISSING.BIN]\nsource = missing.bin\n")
+
+        disk = FAT12()
+        with self.assertRaises(OSError):
+            disk.buildImage(os.path.join(self.work, "built.flp"), manifest=manifest)
+
+        self.assertFalse(disk.isMounted())
+        self.assertEqual(LOCKED_IMAGES, {})
+        # The half built image is gone too.
+        self.assertEqual(sorted(os.listdir(self.work)), ["image.ini", "test.flp"])
+
+if __name__ == "__main__":
+    unittest.main()